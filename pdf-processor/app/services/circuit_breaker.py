@@ -0,0 +1,157 @@
+"""
+Gemini Circuit Breaker
+Stop sending requests to an unhealthy Gemini API and probe it in the background until it recovers
+"""
+import threading
+import time
+from typing import Callable, Optional
+import google.generativeai as genai
+from app.services.gemini_engine import RateLimitedModel
+
+
+# Breaker states
+CLOSED = 'closed'        # Requests flow normally
+OPEN = 'open'            # Requests fail fast; a background probe checks the API
+HALF_OPEN = 'half_open'  # The probe succeeded; the next request decides
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker shared by every Gemini client of a job
+
+    call_with_retry reports each attempt that failed because the API is
+    unhealthy (server errors, timeouts) and each success. After
+    failure_threshold failures in a row the breaker opens: requests fail
+    fast with CircuitOpenError so callers can fall back to local
+    processing, and a daemon thread runs probe() every probe_interval
+    seconds. Once a probe succeeds the breaker is half-open: exactly one
+    real request is let through as a trial (the others keep failing fast
+    until it resolves), and it closes the breaker again or reopens it.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        probe_interval: float = 30.0,
+        probe: Optional[Callable[[], None]] = None,
+    ):
+        """
+        Initialize the breaker
+
+        Args:
+            failure_threshold: Consecutive failed attempts that open the breaker
+            probe_interval: Seconds between background health probes while open
+            probe: Makes a minimal live API request and raises if it fails
+                (clients register their own probe when none is given)
+        """
+        self.failure_threshold = max(1, failure_threshold)
+        self.probe_interval = probe_interval
+        self.probe = probe
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0  # Times the breaker has opened
+        self._trial_in_flight = False  # Half-open: the one admitted request hasn't resolved yet
+        self._lock = threading.Lock()
+        self._probe_thread = None
+
+    def allow(self) -> bool:
+        """
+        Whether a request may be sent now
+
+        While half-open only the first caller is admitted; it must report
+        its outcome (record_success, record_failure or release).
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == OPEN
+
+    def record_success(self):
+        """A request got a response: the API is healthy"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                print("  ✓ Gemini API recovered - circuit breaker closed", flush=True)
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release(self):
+        """An admitted request ended without showing whether the API is healthy (e.g. a cache hit)"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self, error: Exception):
+        """
+        A request attempt failed because the API is unhealthy
+
+        Args:
+            error: The server error or timeout
+        """
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == OPEN:
+                return
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._open(error)
+
+    def _open(self, error: Exception):
+        """Open the breaker and start probing (caller holds the lock)"""
+        self.state = OPEN
+        self.opened += 1
+        print(f"  ⚡ Circuit breaker open after {self.failures} consecutive failure(s) "
+              f"({error.__class__.__name__}) - degrading to local processing, "
+              f"probing Gemini every {self.probe_interval:.0f}s", flush=True)
+        if self._probe_thread is None or not self._probe_thread.is_alive():
+            self._probe_thread = threading.Thread(target=self._probe_loop, daemon=True)
+            self._probe_thread.start()
+
+    def _probe_loop(self):
+        """Probe the API until it answers, then let requests through again"""
+        while True:
+            time.sleep(self.probe_interval)
+            with self._lock:
+                if self.state != OPEN:
+                    return
+            if self.probe is None:
+                succeeded = True  # Nothing to probe with: let the next real request test the API
+            else:
+                try:
+                    self.probe()
+                    succeeded = True
+                except Exception as e:
+                    print(f"  ⚡ Gemini health probe failed ({e.__class__.__name__}) - circuit stays open", flush=True)
+                    succeeded = False
+            if succeeded:
+                with self._lock:
+                    if self.state == OPEN:
+                        self.state = HALF_OPEN
+                        print("  ↻ Gemini health probe succeeded - circuit breaker half-open", flush=True)
+                return
+
+
+def gemini_probe(model_name: str, rate_limiter=None) -> Callable[[], None]:
+    """
+    Health probe sending a tiny live request to model_name
+
+    The request bypasses the response cache (a cached answer proves
+    nothing) but waits for quota like any other call.
+    """
+    def probe():
+        model = genai.GenerativeModel(model_name)
+        if rate_limiter is not None:
+            model = RateLimitedModel(model, rate_limiter)
+        model.generate_content("Reply with OK", generation_config={'max_output_tokens': 8})
+    return probe
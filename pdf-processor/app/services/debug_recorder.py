@@ -0,0 +1,146 @@
+"""
+Debug Recorder
+Opt-in capture of intermediate images, stats and notes per job/page into one zip bundle
+"""
+import contextlib
+import json
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+# The job's recorder; None (the default) turns every debug hook into a single check
+_recorder = None
+_scope = threading.local()
+
+
+def current_debug() -> Optional['DebugRecorder']:
+    """
+    The active recorder, or None when debug mode is off
+
+    Hooks fetch it once and skip all debug work (image encoding, message
+    formatting) when it is None:
+
+        debug = current_debug()
+        if debug:
+            debug.image('grid_intersections', intersections)
+    """
+    return _recorder
+
+
+@contextlib.contextmanager
+def debug_page(page_num: int):
+    """Attribute what this thread records inside the block to a page"""
+    previous = getattr(_scope, 'page', None)
+    _scope.page = page_num
+    try:
+        yield
+    finally:
+        _scope.page = previous
+
+
+class DebugRecorder:
+    """
+    Thread-safe writer of a job's debug bundle
+
+    Artefacts are written into the zip as they are recorded (images as
+    PNG), so nothing accumulates in memory; stats and notes go into
+    manifest.json, grouped per page, when the recorder is closed.
+    """
+
+    def __init__(self, bundle_path: str, **job_info):
+        """
+        Open the bundle
+
+        Args:
+            bundle_path: Zip file to write
+            **job_info: Stored in the manifest (PDF, settings, ...)
+        """
+        self.bundle_path = Path(bundle_path)
+        self.bundle_path.parent.mkdir(parents=True, exist_ok=True)
+        self._zip = zipfile.ZipFile(self.bundle_path, 'w', compression=zipfile.ZIP_DEFLATED)
+        self._lock = threading.Lock()
+        self._names = set()
+        self.manifest = {
+            'job': job_info,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'job_level': {},  # Recorded outside any page (e.g. Gemini responses)
+            'pages': {},
+        }
+
+    def _entry(self) -> dict:
+        """Manifest section of the current page (caller holds the lock)"""
+        page = getattr(_scope, 'page', None)
+        if page is None:
+            return self.manifest['job_level']
+        return self.manifest['pages'].setdefault(str(page), {})
+
+    def _folder(self) -> str:
+        page = getattr(_scope, 'page', None)
+        return f'page_{page}' if page is not None else 'job'
+
+    def _unique(self, name: str) -> str:
+        """name, or name_2, name_3, ... if it was already written (caller holds the lock)"""
+        folder, slash, base = name.rpartition('/')
+        stem, dot, suffix = base.rpartition('.')
+        if not dot:
+            stem, suffix = base, ''
+        candidate, counter = name, 1
+        while candidate in self._names:
+            counter += 1
+            candidate = f'{folder}{slash}{stem}_{counter}{dot}{suffix}'
+        self._names.add(candidate)
+        return candidate
+
+    def image(self, name: str, image: np.ndarray):
+        """Store an intermediate image as <page folder>/<name>.png"""
+        ok, encoded = cv2.imencode('.png', image)
+        if not ok:
+            return
+        self.file(f'{name}.png', encoded.tobytes(), kind='images')
+
+    def file(self, name: str, data, kind: str = 'files'):
+        """Store raw bytes or text as <page folder>/<name>"""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self._lock:
+            path = self._unique(f'{self._folder()}/{name}')
+            self._zip.writestr(path, data)
+            self._entry().setdefault(kind, []).append(path)
+
+    def stat(self, name: str, value):
+        """Record a value under name (repeated values, e.g. one per contour, are kept in order)"""
+        with self._lock:
+            self._entry().setdefault('stats', {}).setdefault(name, []).append(value)
+
+    def note(self, message: str):
+        """Record a diagnostic message"""
+        with self._lock:
+            self._entry().setdefault('notes', []).append(message)
+
+    def close(self) -> Path:
+        """Write the manifest and finish the zip"""
+        with self._lock:
+            self.manifest['finished'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            self._zip.writestr('manifest.json', json.dumps(self.manifest, indent=2, default=str))
+            self._zip.close()
+        return self.bundle_path
+
+
+def start_debug(bundle_path: str, **job_info) -> DebugRecorder:
+    """Turn debug mode on for the job, recording into bundle_path"""
+    global _recorder
+    _recorder = DebugRecorder(bundle_path, **job_info)
+    return _recorder
+
+
+def stop_debug() -> Optional[Path]:
+    """Turn debug mode off and close the bundle; returns its path (None if it was off)"""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder.close() if recorder else None
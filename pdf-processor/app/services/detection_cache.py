@@ -0,0 +1,101 @@
+"""
+Page Detection Cache
+Job-scoped memo of per-page diagram detector results and the crops saved from them
+"""
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class PageDetectionCache:
+    """
+    Run each diagram detector at most once per page within a job
+
+    Every question of a page that needs a diagram used to rerun the
+    detectors on the whole page (re-reading the PNG and recomputing edges)
+    and re-save the same crops. Questions now take their candidates from
+    the page's memoized detections; a detector that failed on a page fails
+    again from the memo instead of being retried per question.
+
+    Results are keyed by the page image they were computed on and the DPI
+    it was rendered at as well, so a page re-rendered differently (another
+    DPI or colorspace) is detected again rather than served stale boxes.
+    """
+
+    def __init__(self):
+        self._results: Dict[tuple, tuple] = {}
+        self._crops: Dict[str, Tuple[int, tuple]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def detections(
+        self,
+        detector: str,
+        page_num: int,
+        detect: Callable[[], List[dict]],
+        image_key: Optional[str] = None,
+        dpi: Optional[int] = None,
+    ) -> List[dict]:
+        """
+        A detector's results for a page, computed on first use
+
+        Args:
+            detector: Detector name ('vector', 'hybrid', 'yolo')
+            page_num: Page number
+            detect: Runs the detector on the page
+            image_key: Fingerprint of the page image detect() runs on (PageFeatures.fingerprint);
+                None for detectors that read the PDF itself
+            dpi: Resolution the page was rendered at (the detections' pixel scale)
+
+        Returns:
+            The detections (shared between callers: don't modify them)
+
+        Raises:
+            Whatever detect() raised on the first call
+        """
+        key = (detector, page_num, image_key, dpi)
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                self.hits += 1
+        if cached is None:
+            # Detection runs outside the lock; pages are processed by one diagram worker,
+            # so a page is never detected twice concurrently
+            try:
+                cached = (list(detect() or []), None)
+            except Exception as e:
+                cached = (None, e)
+            with self._lock:
+                self.misses += 1
+                self._results[key] = cached
+        detected, error = cached
+        if error is not None:
+            raise error
+        return detected
+
+    def crop_saved(self, page_num: int, path: Path, box: tuple) -> bool:
+        """
+        Whether this crop of a page was already written to path in this job
+
+        Records it otherwise, so the caller writes it exactly once.
+        """
+        key = str(path)
+        crop = (page_num, tuple(int(v) for v in box))
+        with self._lock:
+            if self._crops.get(key) == crop and Path(path).exists():
+                return True
+            self._crops[key] = crop
+            return False
+
+    def invalidate(self, page_num: Optional[int] = None):
+        """Forget the detections and saved crops of one page (of every page without page_num)"""
+        with self._lock:
+            if page_num is None:
+                self._results.clear()
+                self._crops.clear()
+                return
+            for key in [key for key in self._results if key[1] == page_num]:
+                del self._results[key]
+            for path in [path for path, (crop_page, _) in self._crops.items() if crop_page == page_num]:
+                del self._crops[path]
@@ -0,0 +1,212 @@
+"""
+Diagram Locator Service
+Set-of-marks diagram location: the local detectors' candidate boxes are drawn and numbered on the page,
+and one Gemini call picks a candidate (or gives its own box) for each question that still needs a diagram
+"""
+from typing import Optional
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from app.services.gemini_engine import RateLimiter
+from app.services.gemini_retry import RetryPolicy, call_with_retry
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.upload_optimizer import UploadOptimizer, to_upload_part, scale_bbox
+from app.services.gemini_usage import usage_scope
+from app.services.gemini_schemas import DiagramAssignments, json_generation_config, parse_structured
+from app.services.json_repair import parse_llm_json
+from app.services.debug_recorder import current_debug, debug_page
+
+
+# Candidate boxes drawn on a page for the set-of-marks diagram locate call
+MAX_LOCATE_CANDIDATES = 12
+
+
+def box_iou(a, b):
+    """Intersection over union of two (x1, y1, x2, y2) boxes"""
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def unique_candidates(detections: list[dict]) -> list[tuple]:
+    """
+    Candidate boxes of detector results, one per diagram
+
+    The hybrid and YOLO detectors often report the same diagram; a box that
+    overlaps an earlier one by IoU 0.5 or more is dropped.
+
+    Returns:
+        Up to MAX_LOCATE_CANDIDATES (x1, y1, x2, y2) boxes in detection order
+    """
+    candidates = []
+    for detection in detections:
+        box = tuple(int(v) for v in detection['bbox'])
+        if all(box_iou(box, other) < 0.5 for other in candidates):
+            candidates.append(box)
+    return candidates[:MAX_LOCATE_CANDIDATES]
+
+
+def draw_candidate_marks(page_img: Image.Image, boxes) -> Image.Image:
+    """
+    Copy of a page with each candidate box outlined and labelled with its id (1-based)
+
+    Labels are drawn large enough to stay legible after the upload downscale.
+    """
+    marked = page_img.convert('RGB')
+    draw = ImageDraw.Draw(marked)
+    size = max(16, page_img.width // 40)
+    try:
+        font = ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1
+        font = ImageFont.load_default()
+    width = max(2, page_img.width // 400)
+    for idx, (x1, y1, x2, y2) in enumerate(boxes, start=1):
+        draw.rectangle((x1, y1, x2, y2), outline=(255, 0, 0), width=width)
+        label_box = draw.textbbox((x1, y1), str(idx), font=font)
+        draw.rectangle((label_box[0] - 4, label_box[1] - 4, label_box[2] + 4, label_box[3] + 4), fill=(255, 0, 0))
+        draw.text((x1, y1), str(idx), fill=(255, 255, 255), font=font)
+    return marked
+
+
+def locate_prompt(candidate_count: int, questions: list[dict]) -> str:
+    """Prompt asking Gemini to pick a numbered candidate box for each question"""
+    question_lines = []
+    for question in questions:
+        question_context = question.get('question', '') or ''
+        parts_summary = ' '.join(part.get('question_text', '')[:100] for part in question.get('parts', [])[:2])
+        question_lines.append(f'- Q{question.get("number")}: "{question_context[:200]} {parts_summary[:200]}"')
+
+    return f"""This exam page has {candidate_count} numbered candidate box(es) drawn on it in red; each box's id is printed in its top-left corner.
+These questions each refer to a diagram/chart/graph/table on the page:
+{chr(10).join(question_lines)}
+
+For EACH question, return the id of the candidate box that contains its diagram, and a confidence score (0-100) indicating how sure you are that this is the correct diagram.
+If no candidate box fits, set "candidate" to null and give the diagram's bounding box in pixels of this image in "bbox" (null if there is no diagram).
+
+Return ONLY a JSON object in this format:
+{{"questions": [{{"number": "<question number>", "candidate": <id or null>, "bbox": {{"x": <left>, "y": <top>, "width": <width>, "height": <height>}} or null, "type": "<diagram type>", "confidence": <0-100>}}]}}
+"""
+
+
+def assign_diagrams(questions: list[dict], assignments: list, candidates: list[tuple],
+                    upload_scale: float = 1.0) -> list[Optional[dict]]:
+    """
+    Match Gemini's answers to questions and resolve them to page boxes
+
+    Answers are matched by question number; questions left over take the
+    answer at their own position if no other question has claimed it. Each
+    answer is used once. A candidate id
+    outside 1..len(candidates) is ignored in favour of the answer's own box.
+
+    Args:
+        questions: Questions the locate request was sent for
+        assignments: The response's "questions" list
+        candidates: Candidate boxes drawn on the page, in id order
+        upload_scale: Scale of the uploaded page image (own boxes are in its pixels)
+
+    Returns:
+        One entry per question: None when no diagram was located, else a dict with
+        the page pixel 'box' (x1, y1, x2, y2), 'source', 'candidate', 'type' and 'confidence'
+    """
+    assignments = [a for a in assignments if isinstance(a, dict)]
+    unused = set(range(len(assignments)))
+    matched = [None] * len(questions)
+    # Numbers first, so a question without a match can't take the answer meant for a later one
+    for idx, question in enumerate(questions):
+        match = next((i for i in sorted(unused) if str(assignments[i].get('number')) == str(question.get('number'))), None)
+        if match is not None:
+            matched[idx] = match
+            unused.discard(match)
+    for idx in range(len(questions)):
+        if matched[idx] is None and idx in unused:
+            matched[idx] = idx
+            unused.discard(idx)
+
+    located = []
+    for match in matched:
+        assignment = assignments[match] if match is not None else {}
+        candidate = assignment.get('candidate')
+        if isinstance(candidate, int) and not isinstance(candidate, bool) and 1 <= candidate <= len(candidates):
+            box = tuple(candidates[candidate - 1])
+            source = 'gemini_set_of_marks'
+        elif assignment.get('bbox'):
+            bbox = scale_bbox(assignment['bbox'], upload_scale)
+            box = (bbox['x'], bbox['y'], bbox['x'] + bbox['width'], bbox['y'] + bbox['height'])
+            candidate = None
+            source = 'gemini_intelligent_fallback'
+        else:
+            located.append(None)
+            continue
+        located.append({
+            'box': box,
+            'source': source,
+            'candidate': candidate,
+            'type': assignment.get('type') or 'unknown',
+            'confidence': float(assignment.get('confidence') or 60.0),
+        })
+    return located
+
+
+def locate_page_diagrams(
+    model,
+    page_img: Image.Image,
+    candidates: list[tuple],
+    questions: list[dict],
+    retry_policy: RetryPolicy,
+    page_num: int,
+    rate_limiter: Optional[RateLimiter] = None,
+    breaker: Optional[CircuitBreaker] = None,
+    upload_optimizer: Optional[UploadOptimizer] = None,
+    structured_output: bool = False,
+) -> list[Optional[dict]]:
+    """
+    Locate the diagrams of all of a page's questions that still need one, in one Gemini call
+
+    The page is sent once with the candidate boxes drawn and numbered on it;
+    Gemini picks a candidate id for each question, or gives a box of its own
+    when none fits.
+
+    Args:
+        model: Gemini model (with the client's wrapper stack)
+        page_img: Page image the candidate boxes refer to
+        candidates: Local detector boxes (x1, y1, x2, y2) in page pixels
+        questions: Questions that need a diagram
+        retry_policy: Retry policy of the client
+        page_num: Page number, for logging, usage records and the debug bundle
+
+    Returns:
+        One assign_diagrams entry per question
+
+    Raises:
+        GeminiRequestError: The request failed for good (after retries)
+    """
+    prompt = locate_prompt(len(candidates), questions)
+    marked_page = draw_candidate_marks(page_img, candidates)
+    debug = current_debug()
+    if debug:
+        with debug_page(page_num):
+            debug.image('set_of_marks', cv2.cvtColor(np.asarray(marked_page), cv2.COLOR_RGB2BGR))
+            debug.stat('locate_candidates', candidates)
+    upload_part, upload_scale = to_upload_part(marked_page, upload_optimizer)
+
+    if structured_output:
+        def request():
+            response = model.generate_content(
+                [prompt, upload_part], generation_config=json_generation_config(DiagramAssignments)
+            )
+            return parse_structured(DiagramAssignments, response.text)
+    else:
+        def request():
+            # Parse JSON from response, repairing common LLM JSON errors
+            return parse_llm_json(model.generate_content([prompt, upload_part]).text)[0]
+
+    with usage_scope('diagram_locate', [page_num]):
+        assignments = call_with_retry(
+            request, retry_policy, rate_limiter=rate_limiter, model=model,
+            description=f"Diagram location for page {page_num}", breaker=breaker
+        )
+    if not isinstance(assignments, dict):
+        assignments = {}
+    return assign_diagrams(questions, assignments.get('questions') or [], candidates, upload_scale)
@@ -3,47 +3,101 @@ Gemini Answer Parser Service
 Parses step-by-step answers from answer PDF using Gemini Vision
 """
 import google.generativeai as genai
-from PIL import Image
-import json
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
 import numpy as np
+from app.services.gemini_cache import GeminiResponseCache
+from app.services.gemini_engine import RateLimiter
+from app.services.gemini_model_stack import CallCounter, wrap_model
+from app.services.upload_optimizer import UploadOptimizer, to_upload_part, log_payload
+from app.services.gemini_retry import RetryPolicy, GeminiRequestError, call_with_retry
+from app.services.json_stream import IncrementalJSONParser
+from app.services.json_repair import parse_llm_json
+from app.services.gemini_usage import UsageRecorder, usage_scope
+from app.services.circuit_breaker import CircuitBreaker, gemini_probe
+from app.services.gemini_schemas import AnswerBatch, json_generation_config, parse_structured
 
 
 class GeminiAnswerParser:
     """Parse step-by-step answers from answer PDF"""
     
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        response_cache: Optional[GeminiResponseCache] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        upload_optimizer: Optional[UploadOptimizer] = None,
+        structured_output: bool = False,
+        usage_recorder: Optional[UsageRecorder] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None
+    ):
         """
         Initialize Gemini Answer Parser
         
         Args:
             api_key: Google Gemini API key
+            response_cache: Persistent response cache; identical requests are served from it
+            rate_limiter: RPM/TPM limiter shared by every client using the same API key
+            retry_policy: Retry budget and back-off for failed requests (default: RetryPolicy())
+            upload_optimizer: Downscales/encodes page images before upload (default: None, SDK encoding)
+            structured_output: Constrain JSON responses to the pydantic schemas in gemini_schemas
+                and validate them in one pass instead of cleaning up free-form text
+            usage_recorder: Records tokens, payload, latency and cache hits of every call
+            circuit_breaker: Fails requests fast while the API is unhealthy (shared by the job's clients)
         """
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.upload_optimizer = upload_optimizer
+        self.structured_output = structured_output
+        self.circuit_breaker = circuit_breaker
+        if circuit_breaker is not None and circuit_breaker.probe is None:
+            circuit_breaker.probe = gemini_probe('gemini-2.0-flash-exp', rate_limiter)
+        self.model = wrap_model(
+            genai.GenerativeModel('gemini-2.0-flash-exp'), rate_limiter, response_cache, usage_recorder
+        )
+        self._calls = CallCounter()  # Per-thread (live, cached) request counts
+    
+    def pop_call_counts(self) -> tuple[int, int]:
+        """
+        Requests this thread sent since the last call (retries included)
+        
+        Returns:
+            (live API calls, calls served from the response cache)
+        """
+        return self._calls.pop()
     
     def extract_answers_from_batch(
         self, 
-        images_with_page_nums: List[tuple[int, np.ndarray]]
+        images_with_page_nums: List[tuple[int, np.ndarray]],
+        on_answer: Optional[Callable[[int, Dict], None]] = None
     ) -> Dict[int, Dict]:
         """
         Extract step-by-step answers from multiple pages
         
+        With on_answer the response is streamed and every answer is handed over
+        as soon as its JSON object is complete. Streamed answers are provisional
+        (a retried request streams them again); the returned dict is authoritative.
+        
         Args:
             images_with_page_nums: List of (page_number, image) tuples
+            on_answer: Called with (page_number, answer) for each streamed answer
             
         Returns:
             Dict mapping page_number -> answer_data
+            
+        Raises:
+            GeminiRequestError: The request failed for good (after retries)
         """
         try:
             batch_size = len(images_with_page_nums)
             print(f"    → ANSWER PARSER: Processing {batch_size} pages in 1 API call...", flush=True)
             
-            # Convert all images to PIL
+            # Convert all images to upload parts
             pil_images = []
             page_numbers = []
             for page_num, img in images_with_page_nums:
-                pil_images.append(Image.fromarray(img))
+                pil_images.append(to_upload_part(img, self.upload_optimizer)[0])
                 page_numbers.append(page_num)
             
             # Enhanced prompt for answer extraction
@@ -150,23 +204,43 @@ IMPORTANT:
 - Question numbers should match the original exam questions
 """
             
-            # Send all images at once
-            print(f"    → Waiting for Gemini answer extraction...", flush=True)
+            # Send all images at once; rate limits, server errors and unparseable output are retried
             content_parts = [prompt] + pil_images
-            response = self.model.generate_content(content_parts)
-            print(f"    ✓ Answer extraction complete!", flush=True)
+            log_payload(content_parts, self.upload_optimizer)
             
-            # Parse response
-            result = response.text.strip()
+            # Structured output constrains the response to the AnswerBatch schema
+            generate_kwargs = {}
+            if self.structured_output:
+                generate_kwargs['generation_config'] = json_generation_config(AnswerBatch)
             
-            # Remove markdown if present
-            if result.startswith('```'):
-                result = result.split('```')[1]
-                if result.startswith('json'):
-                    result = result[4:]
-                result = result.strip()
+            def request():
+                print(f"    → Waiting for Gemini answer extraction...", flush=True)
+                if on_answer is None:
+                    response = self.model.generate_content(content_parts, **generate_kwargs)
+                    self._calls.count(self.model)
+                else:
+                    response = self.model.generate_content(content_parts, stream=True, **generate_kwargs)
+                    self._calls.count(self.model)
+                    self._stream_answers(response, page_numbers, on_answer)
+                print(f"    ✓ Answer extraction complete!", flush=True)
+                
+                if self.structured_output:
+                    return parse_structured(AnswerBatch, response.text)
+                
+                # Parse response, repairing common LLM JSON errors
+                data, fixes, truncated = parse_llm_json(response.text)
+                if fixes:
+                    print(f"    ⚠ Repaired Gemini JSON: {', '.join(fixes)}", flush=True)
+                if truncated:
+                    print("    ⚠ Response was cut off - the last page may be incomplete", flush=True)
+                return data
             
-            data = json.loads(result, strict=False)
+            with usage_scope('answer_batch', page_numbers):
+                data = call_with_retry(
+                    request, self.retry_policy, rate_limiter=self.rate_limiter, model=self.model,
+                    description=f"Answer extraction of page(s) {', '.join(map(str, page_numbers))}",
+                    breaker=self.circuit_breaker
+                )
             
             # Map results back to page numbers
             results = {}
@@ -179,12 +253,29 @@ IMPORTANT:
             print(f"    ✅ Extracted answers for {len(results)} pages!", flush=True)
             return results
             
+        except GeminiRequestError as e:
+            print(f"  ⚠ Warning: Answer extraction failed - {e}", flush=True)
+            raise
         except Exception as e:
             print(f"  ⚠ Warning: Answer extraction failed - {e}", flush=True)
             import traceback
             traceback.print_exc()
             return {}
     
+    def _stream_answers(self, response, page_numbers, on_answer):
+        """Read a streamed response to the end, handing over each answer as it completes"""
+        parser = IncrementalJSONParser(['answers'])
+        for chunk in response:
+            try:
+                chunk_text = chunk.text
+            except ValueError:
+                continue  # No text in this chunk (e.g. the final one); response.text reports real errors
+            for path, _, answer in parser.feed(chunk_text):
+                # Pages are mapped back by position, like the full response below
+                page_index = path[1] if len(path) > 1 and isinstance(path[1], int) else 0
+                if page_index < len(page_numbers):
+                    on_answer(page_numbers[page_index], answer)
+    
     def extract_single_page_answers(self, image: np.ndarray) -> Dict:
         """
         Extract answers from a single page
@@ -0,0 +1,249 @@
+"""
+Gemini Response Cache
+Persistent SQLite cache of Gemini responses keyed by image hash, prompt hash and model name
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+from pathlib import Path
+from PIL import Image
+from typing import Optional
+
+
+class CachedResponse:
+    """Stand-in for a Gemini response served from the cache"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __iter__(self):
+        # Replayed streaming requests get the whole response as a single chunk
+        yield self
+
+
+class _CachingStream:
+    """Streaming response that stores its full text in the cache once it has been read to the end"""
+
+    def __init__(self, response, store):
+        self._response = response
+        self._store = store
+
+    def __iter__(self):
+        for chunk in self._response:
+            yield chunk
+        self._store(self._response)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+class GeminiResponseCache:
+    """
+    SQLite-backed cache of Gemini response texts
+
+    Keys are the sha256 of the model name, every prompt string and every
+    image's pixel bytes, so re-running a paper after a crash or a downstream
+    bug replays identical requests without touching the API. Entries expire
+    after ttl_seconds and the database is bounded by max_bytes, evicting
+    least recently used responses first.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "./output/cache/gemini_responses.sqlite3",
+        ttl_seconds: float = 30 * 24 * 3600,
+        max_bytes: int = 512 * 1024 ** 2,
+    ):
+        """
+        Initialize the response cache
+
+        Args:
+            db_path: SQLite database file
+            ttl_seconds: Age after which a cached response is ignored (default: 30 days)
+            max_bytes: Size bound of the stored response texts (default: 512 MB)
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, model TEXT, text TEXT,"
+                " created REAL, accessed REAL, size INTEGER)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @staticmethod
+    def make_key(model_name: str, contents, **kwargs) -> str:
+        """
+        Hash a generate_content request
+
+        Args:
+            model_name: Gemini model name
+            contents: Prompt string or list of prompt strings and images (PIL, numpy or inline blobs)
+            **kwargs: Extra generate_content arguments (generation_config, ...)
+
+        Returns:
+            sha256 hex digest identifying the request
+        """
+        digest = hashlib.sha256(model_name.encode())
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        for part in parts:
+            if isinstance(part, str):
+                digest.update(b'text:' + hashlib.sha256(part.encode()).digest())
+            elif isinstance(part, Image.Image):
+                header = f"image:{part.mode}:{part.size}".encode()
+                digest.update(header + hashlib.sha256(part.tobytes()).digest())
+            elif isinstance(part, dict) and isinstance(part.get('data'), bytes):
+                header = f"blob:{part.get('mime_type')}".encode()
+                digest.update(header + hashlib.sha256(part['data']).digest())
+            elif isinstance(part, np.ndarray):
+                header = f"array:{part.dtype}:{part.shape}".encode()
+                digest.update(header + hashlib.sha256(np.ascontiguousarray(part).tobytes()).digest())
+            else:
+                digest.update(b'other:' + repr(part).encode())
+        for name in sorted(kwargs):
+            digest.update(f"{name}={kwargs[name]!r}".encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a response text
+
+        Args:
+            key: Request key (see make_key)
+
+        Returns:
+            Cached response text, or None on a miss or an expired entry
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    with self._conn:
+                        self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model_name: str, text: str):
+        """
+        Store a response text, then enforce the size bound
+
+        Args:
+            key: Request key (see make_key)
+            model_name: Gemini model name
+            text: Response text
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, text, created, accessed, size)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, text, now, now, len(text.encode()))
+            )
+            self._evict()
+
+    def _evict(self):
+        """Delete expired entries, then least recently used ones until the cache fits in max_bytes"""
+        self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl_seconds,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed"
+        ).fetchall():
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def delete(self, key: str):
+        """Remove one entry"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
+
+
+class CachedGenerativeModel:
+    """Drop-in wrapper around genai.GenerativeModel that serves repeated requests from a GeminiResponseCache"""
+
+    def __init__(self, model, cache: GeminiResponseCache, model_name: Optional[str] = None):
+        """
+        Wrap a Gemini model
+
+        Args:
+            model: genai.GenerativeModel instance
+            cache: Response cache shared by all clients of a job
+            model_name: Name hashed into the cache keys (default: model.model_name). Models built
+                from cached context need one that identifies the cached prompt as well
+        """
+        self.model = model
+        self.cache = cache
+        self.model_name = model_name or model.model_name
+        self._local = threading.local()  # Requests may run concurrently on worker threads
+
+    @property
+    def last_call_cached(self) -> bool:
+        """Whether this thread's last generate_content call was served from the cache"""
+        return getattr(self._local, 'cached', False)
+
+    def forget_last(self):
+        """Drop this thread's last response from the cache (e.g. it turned out to be unparseable)"""
+        key = getattr(self._local, 'key', None)
+        if key is not None:
+            self.cache.delete(key)
+            self._local.key = None
+
+    def generate_content(self, contents, **kwargs):
+        """
+        Same as GenerativeModel.generate_content, but cached
+
+        Streaming and non-streaming requests share cache entries: a streamed
+        response is stored once it has been read to the end, and a hit is
+        replayed as a single chunk. Responses without text (blocked by
+        safety filters, empty candidates) are not stored.
+        """
+        self._local.cached = False
+        self._local.key = None
+        cache_kwargs = {name: value for name, value in kwargs.items() if name != 'stream'}
+        key = GeminiResponseCache.make_key(self.model_name, contents, **cache_kwargs)
+        self._local.key = key
+        text = self.cache.get(key)
+        if text is not None:
+            self._local.cached = True
+            return CachedResponse(text)
+
+        def store(response):
+            try:
+                self.cache.put(key, self.model_name, response.text)
+            except (ValueError, sqlite3.Error) as e:
+                print(f"  ⚠ Warning: Unable to cache Gemini response: {e}")
+
+        response = self.model.generate_content(contents, **kwargs)
+        if kwargs.get('stream'):
+            return _CachingStream(response, store)
+        store(response)
+        return response
+
+    def __getattr__(self, name):
+        # Everything else (count_tokens, start_chat, ...) goes to the wrapped model
+        return getattr(self.model, name)
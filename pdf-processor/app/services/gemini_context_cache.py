@@ -0,0 +1,51 @@
+"""
+Gemini Context Cache
+Store a static prompt prefix server-side once (CachedContent) instead of resending it with every request
+"""
+import datetime
+import hashlib
+from google.generativeai import caching
+
+
+def context_cache_name(model_name: str, system_instruction: str) -> str:
+    """Display name identifying the cached context of a model + prompt pair"""
+    digest = hashlib.sha256(f"{model_name}\n{system_instruction}".encode()).hexdigest()[:16]
+    return f"quiz-prompt-{digest}"
+
+
+def get_context_cache(model_name: str, system_instruction: str, ttl_seconds: float) -> caching.CachedContent:
+    """
+    Cached context holding system_instruction for model_name
+
+    An unexpired cache created for the same model and prompt (by an earlier
+    run, say) is reused and its TTL extended; otherwise a new one is created.
+    A changed prompt or model version gets a new display name, so stale
+    contexts are never reused.
+
+    Args:
+        model_name: Gemini model name (e.g. 'gemini-2.5-flash')
+        system_instruction: Static prompt to cache
+        ttl_seconds: How long the cache lives after its last creation/reuse
+
+    Returns:
+        CachedContent to build a model with GenerativeModel.from_cached_content
+
+    Raises:
+        google.api_core.exceptions.GoogleAPIError: Caching is unavailable (e.g. free tier,
+            or the prompt is below the model's minimum cacheable size)
+    """
+    display_name = context_cache_name(model_name, system_instruction)
+    ttl = datetime.timedelta(seconds=ttl_seconds)
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    for cached in caching.CachedContent.list():
+        if cached.display_name == display_name and cached.expire_time > now:
+            cached.update(ttl=ttl)
+            return cached
+
+    return caching.CachedContent.create(
+        model=model_name,
+        display_name=display_name,
+        system_instruction=system_instruction,
+        ttl=ttl,
+    )
@@ -0,0 +1,277 @@
+"""
+Gemini Request Engine
+Token-bucket RPM/TPM limiting and asyncio fan-out of Gemini requests
+"""
+import asyncio
+import math
+import threading
+import time
+from io import BytesIO
+from PIL import Image
+from typing import Callable, List, Optional
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at rate_per_minute
+
+    Callers reserve tokens up front (the balance may go negative) and sleep
+    off the debt outside the lock, so concurrent callers queue fairly
+    instead of spinning.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        """
+        Initialize the bucket (full)
+
+        Args:
+            rate_per_minute: Refill rate
+            capacity: Maximum burst (default: one minute of quota)
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take amount tokens from the bucket
+
+        Returns:
+            Seconds the caller must wait before using them
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+    def set_rate(self, rate_per_minute: float):
+        """Change the refill rate, keeping the current balance"""
+        with self._lock:
+            self._refill()
+            self.rate = rate_per_minute / 60.0
+
+    def drain(self, seconds: float):
+        """Empty the bucket so the next callers wait at least seconds"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def adjust(self, amount: float):
+        """Charge (positive) or refund (negative) tokens after the fact"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limits for one Gemini quota
+
+    The request rate adapts AIMD-style: halved when the API throttles us
+    (at most once per cooldown, so a burst of 429s from concurrent requests
+    counts once) and raised additively on every success until it is back
+    at the configured rpm.
+    """
+
+    def __init__(
+        self,
+        rpm: float = 8,
+        tpm: Optional[float] = 250_000,
+        min_rpm: float = 1,
+        recovery_rpm: float = 0.5,
+        throttle_cooldown: float = 10.0,
+    ):
+        """
+        Initialize the limiter
+
+        Args:
+            rpm: Requests per minute (default: 8, under the 10 RPM free tier)
+            tpm: Input + output tokens per minute (default: 250k; None disables)
+            min_rpm: Floor of the adaptive request rate
+            recovery_rpm: Request rate regained per successful request
+            throttle_cooldown: Seconds during which further throttles don't lower the rate again
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.min_rpm = min(min_rpm, rpm)
+        self.recovery_rpm = recovery_rpm
+        self.throttle_cooldown = throttle_cooldown
+        self.current_rpm = rpm
+        self.throttles = 0
+        self._last_throttle = float('-inf')
+        self._lock = threading.Lock()
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    def on_throttle(self, pause: float = 0):
+        """
+        The API reported a rate limit: back off multiplicatively
+
+        Args:
+            pause: Seconds every caller should wait before the next request
+        """
+        with self._lock:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self._last_throttle >= self.throttle_cooldown:
+                self._last_throttle = now
+                self.current_rpm = max(self.min_rpm, self.current_rpm / 2)
+                self.requests.set_rate(self.current_rpm)
+                print(f"    ⏱️  Throttled by API: request rate lowered to {self.current_rpm:.1f} RPM", flush=True)
+        if pause > 0:
+            self.requests.drain(pause)
+
+    def on_success(self):
+        """A request went through: recover additively towards the configured rpm"""
+        with self._lock:
+            if self.current_rpm < self.rpm:
+                self.current_rpm = min(self.rpm, self.current_rpm + self.recovery_rpm)
+                self.requests.set_rate(self.current_rpm)
+
+    def acquire(self, tokens: float = 0):
+        """Block until one request of roughly tokens tokens fits in the quota"""
+        wait = self.requests.reserve(1)
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens))
+        if wait > 0:
+            print(f"    ⏱️  Rate limiting: waiting {wait:.1f}s for API quota", flush=True)
+            time.sleep(wait)
+
+    def settle(self, estimated: float, actual: float):
+        """Correct the token bucket once a response reports its real usage"""
+        if self.tokens is not None:
+            self.tokens.adjust(actual - estimated)
+
+
+def _is_image(part) -> bool:
+    return isinstance(part, Image.Image) or (isinstance(part, dict) and isinstance(part.get('data'), bytes))
+
+
+def _image_size(part) -> tuple:
+    if isinstance(part, Image.Image):
+        return part.size
+    # Inline blob: PIL only parses the header to get the size
+    with Image.open(BytesIO(part['data'])) as img:
+        return img.size
+
+
+def estimate_tokens(contents) -> int:
+    """
+    Rough input token count of a generate_content request
+
+    Text is ~4 characters per token; Gemini bills images at 258 tokens per
+    768x768 tile (a single tile for images up to 384 px on both sides).
+    """
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    total = 0
+    for part in parts:
+        if isinstance(part, str):
+            total += len(part) // 4 + 1
+        elif _is_image(part):
+            width, height = _image_size(part)
+            if width <= 384 and height <= 384:
+                total += 258
+            else:
+                total += 258 * math.ceil(width / 768) * math.ceil(height / 768)
+    return total
+
+
+class _SettlingStream:
+    """Streaming response that reports its token usage to the limiter after the last chunk"""
+
+    def __init__(self, response, on_done: Callable):
+        self._response = response
+        self._on_done = on_done
+
+    def __iter__(self):
+        for chunk in self._response:
+            yield chunk
+        self._on_done()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+class RateLimitedModel:
+    """Drop-in wrapper around genai.GenerativeModel that waits for RPM/TPM quota before each call"""
+
+    def __init__(self, model, limiter: RateLimiter, expected_output_tokens: int = 4096):
+        """
+        Wrap a Gemini model
+
+        Args:
+            model: genai.GenerativeModel instance
+            limiter: Rate limiter shared by all clients of the same API key
+            expected_output_tokens: Output tokens reserved per image (at least one per call)
+                until the real usage is known
+        """
+        self.model = model
+        self.limiter = limiter
+        self.expected_output_tokens = expected_output_tokens
+
+    def generate_content(self, contents, **kwargs):
+        """Same as GenerativeModel.generate_content, after waiting for quota"""
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        images = sum(_is_image(part) for part in parts)
+        estimated = estimate_tokens(contents) + self.expected_output_tokens * max(1, images)
+        self.limiter.acquire(estimated)
+        response = self.model.generate_content(contents, **kwargs)
+        if kwargs.get('stream'):
+            # Usage is only final once the last chunk has arrived
+            return _SettlingStream(response, lambda: self._settle(response, estimated))
+        self._settle(response, estimated)
+        return response
+
+    def _settle(self, response, estimated: float):
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None and getattr(usage, 'total_token_count', 0):
+            self.limiter.settle(estimated, usage.total_token_count)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+class GeminiRequestEngine:
+    """Run blocking Gemini client calls concurrently with asyncio, N in flight"""
+
+    def __init__(self, concurrency: int = 4):
+        """
+        Initialize the engine
+
+        Args:
+            concurrency: Maximum number of requests in flight
+        """
+        self.concurrency = max(1, concurrency)
+
+    def run(self, calls: List[Callable]) -> list:
+        """
+        Run zero-argument callables concurrently
+
+        Quota is enforced by the RateLimitedModel the clients call through,
+        so the engine only bounds how many requests are in flight.
+
+        Args:
+            calls: Callables, e.g. functools.partial(client.extract_..., page)
+
+        Returns:
+            Results in the same order as calls
+        """
+        if not calls:
+            return []
+        return asyncio.run(self._run_all(calls))
+
+    async def _run_all(self, calls: List[Callable]) -> list:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_one(call):
+            async with semaphore:
+                return await asyncio.to_thread(call)
+
+        return await asyncio.gather(*(run_one(call) for call in calls))
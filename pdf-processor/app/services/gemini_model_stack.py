@@ -0,0 +1,71 @@
+"""
+Gemini Model Stack
+The wrapper layers every Gemini client puts around its GenerativeModel, and per-thread call counts
+"""
+import threading
+from typing import Optional
+from app.services.gemini_cache import GeminiResponseCache, CachedGenerativeModel
+from app.services.gemini_engine import RateLimiter, RateLimitedModel
+from app.services.gemini_usage import UsageRecorder, UsageRecordingModel
+
+
+def wrap_model(
+    model,
+    rate_limiter: Optional[RateLimiter] = None,
+    response_cache: Optional[GeminiResponseCache] = None,
+    usage_recorder: Optional[UsageRecorder] = None,
+    cache_model_name: Optional[str] = None,
+    model_name: Optional[str] = None,
+):
+    """
+    Add quota, response caching and usage recording to a Gemini model
+
+    The order is fixed: the response cache sits outside the rate limiter so
+    cache hits don't spend quota, and the usage recorder sits outside the
+    cache so cache hits are recorded too. Layers whose argument is None are
+    left out.
+
+    Args:
+        model: genai.GenerativeModel instance
+        rate_limiter: RPM/TPM limiter shared by every client using the same API key
+        response_cache: Persistent response cache shared by the job's clients
+        usage_recorder: Records tokens, payload, latency and cache hits of every call
+        cache_model_name: Name hashed into the response cache keys (default: model.model_name);
+            models built from cached context need one that identifies the cached prompt
+        model_name: Base model name the calls are priced as (default: model.model_name)
+
+    Returns:
+        Wrapped model with the GenerativeModel.generate_content interface
+    """
+    if rate_limiter is not None:
+        model = RateLimitedModel(model, rate_limiter)
+    if response_cache is not None:
+        model = CachedGenerativeModel(model, response_cache, model_name=cache_model_name)
+    if usage_recorder is not None:
+        model = UsageRecordingModel(model, usage_recorder, model_name=model_name)
+    return model
+
+
+class CallCounter:
+    """Per-thread count of the live and response-cache-served requests a client sent"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def count(self, model):
+        """Count the request model just answered (cached if it was replayed from the response cache)"""
+        if getattr(model, 'last_call_cached', False):
+            self._local.cached = getattr(self._local, 'cached', 0) + 1
+        else:
+            self._local.live = getattr(self._local, 'live', 0) + 1
+
+    def pop(self) -> tuple[int, int]:
+        """
+        Requests this thread sent since the last pop
+
+        Returns:
+            (live API calls, calls served from the response cache)
+        """
+        counts = (getattr(self._local, 'live', 0), getattr(self._local, 'cached', 0))
+        self._local.live = self._local.cached = 0
+        return counts
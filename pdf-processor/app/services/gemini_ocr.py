@@ -3,26 +3,115 @@ Gemini Vision OCR Service
 Uses Google's Gemini Flash for accurate math OCR (FREE tier available)
 """
 import google.generativeai as genai
-import base64
-from PIL import Image
-import io
+import json
 import numpy as np
 from typing import Optional
+from app.services.gemini_cache import GeminiResponseCache
+from app.services.gemini_engine import RateLimiter
+from app.services.gemini_model_stack import wrap_model
+from app.services.upload_optimizer import UploadOptimizer, to_upload_part, log_payload
+from app.services.gemini_retry import RetryPolicy, call_with_retry
+from app.services.gemini_schemas import Quiz, TextAndQuiz, QuizBatch, json_generation_config, parse_structured
+from app.services.json_repair import parse_llm_json
+from app.services.gemini_usage import UsageRecorder, usage_scope
+from app.services.circuit_breaker import CircuitBreaker, gemini_probe
 
 
 class GeminiOCR:
     """Use Gemini Flash for vision-based OCR with math support"""
     
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        response_cache: Optional[GeminiResponseCache] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        upload_optimizer: Optional[UploadOptimizer] = None,
+        structured_output: bool = False,
+        usage_recorder: Optional[UsageRecorder] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None
+    ):
         """
         Initialize Gemini OCR
         
         Args:
             api_key: Google Gemini API key (get free at https://makersuite.google.com/app/apikey)
+            response_cache: Persistent response cache; identical requests are served from it
+            rate_limiter: RPM/TPM limiter shared by every client using the same API key
+            retry_policy: Retry budget and back-off for failed requests (default: RetryPolicy())
+            upload_optimizer: Downscales/encodes page images before upload (default: None, SDK encoding)
+            structured_output: Constrain JSON responses to the pydantic schemas in gemini_schemas
+                and validate them in one pass instead of cleaning up free-form text
+            usage_recorder: Records tokens, payload, latency and cache hits of every call
+            circuit_breaker: Fails requests fast while the API is unhealthy (shared by the job's clients)
         """
         genai.configure(api_key=api_key)
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.upload_optimizer = upload_optimizer
+        self.structured_output = structured_output
+        self.circuit_breaker = circuit_breaker
+        if circuit_breaker is not None and circuit_breaker.probe is None:
+            circuit_breaker.probe = gemini_probe('gemini-2.5-flash', rate_limiter)
         # Use gemini-2.5-flash - stable with good free tier
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        self.model = wrap_model(
+            genai.GenerativeModel('gemini-2.5-flash'), rate_limiter, response_cache, usage_recorder
+        )
+    
+    def _generate(self, content_parts: list, schema=None, parse_json: bool = False, last_item: str = 'question'):
+        """
+        Call the model, retrying rate limits, server errors and unparseable output
+        
+        Args:
+            content_parts: Prompt and images
+            schema: Pydantic model of the JSON response; the output is constrained
+                to it and validated (responses that don't validate are retried)
+            parse_json: Parse the free-form response as a JSON object, repairing
+                common LLM JSON errors (responses that can't be parsed are retried)
+            last_item: What the last item of the JSON is, for the cut-off warning
+            
+        Returns:
+            The response, or with a schema or parse_json the JSON object as a dict
+            
+        Raises:
+            GeminiRequestError: The request failed for good (after retries)
+        """
+        log_payload(content_parts, self.upload_optimizer)
+        
+        def request():
+            if schema is not None:
+                response = self.model.generate_content(
+                    content_parts, generation_config=json_generation_config(schema)
+                )
+                return parse_structured(schema, response.text)
+            response = self.model.generate_content(content_parts)
+            if parse_json:
+                return self._parse_json(response.text, last_item)
+            response.text  # Raises on blocked/empty responses so they are classified too
+            return response
+        
+        with usage_scope('ocr'):
+            return call_with_retry(
+                request, self.retry_policy, rate_limiter=self.rate_limiter, model=self.model,
+                description="Gemini OCR", breaker=self.circuit_breaker
+            )
+    
+    @staticmethod
+    def _parse_json(response_text: str, last_item: str) -> dict:
+        """
+        Parse a free-form response as a JSON object, repairing common LLM JSON errors
+        
+        Raises:
+            json.JSONDecodeError: The response isn't a recoverable JSON object
+        """
+        data, fixes, truncated = parse_llm_json(response_text)
+        if fixes:
+            print(f"    ⚠ Repaired Gemini JSON: {', '.join(fixes)}", flush=True)
+        if not isinstance(data, dict):
+            raise json.JSONDecodeError("Expected a JSON object", response_text, 0)
+        if truncated:
+            print(f"    ⚠ Response was cut off - the last {last_item} may be incomplete", flush=True)
+        return data
     
     def extract_text_from_image(self, image: np.ndarray) -> str:
         """
@@ -35,8 +124,8 @@ class GeminiOCR:
             Extracted text with proper math notation
         """
         try:
-            # Convert numpy array to PIL Image
-            pil_image = Image.fromarray(image)
+            # Convert numpy array to an upload part (PIL image or optimized blob)
+            pil_image, _ = to_upload_part(image, self.upload_optimizer)
             
             # Create prompt for OCR
             prompt = """Extract all text from this exam paper page, preserving the exact formatting and mathematical notation.
@@ -52,7 +141,7 @@ Instructions:
 Return only the extracted text, nothing else."""
             
             # Generate response
-            response = self.model.generate_content([prompt, pil_image])
+            response = self._generate([prompt, pil_image])
             
             return response.text.strip()
             
@@ -71,8 +160,8 @@ Return only the extracted text, nothing else."""
             Extracted questions in structured format with numbers
         """
         try:
-            # Convert numpy array to PIL Image
-            pil_image = Image.fromarray(image)
+            # Convert numpy array to an upload part (PIL image or optimized blob)
+            pil_image, _ = to_upload_part(image, self.upload_optimizer)
             
             # Create prompt specifically for question extraction
             prompt = """Extract ONLY the exam questions from this page. Do NOT include:
@@ -109,7 +198,7 @@ Example format:
 Return ONLY the questions, nothing else."""
             
             # Generate response
-            response = self.model.generate_content([prompt, pil_image])
+            response = self._generate([prompt, pil_image])
             
             return response.text.strip()
             
@@ -125,12 +214,13 @@ Return ONLY the questions, nothing else."""
             image: Image as numpy array (RGB)
             
         Returns:
-            JSON string with questions and sample answers
+            JSON string {"questions": [...]} with questions and sample answers
+            (same shape as the quiz of extract_text_and_quiz), or "" on failure
         """
         try:
             print(f"    → Calling Gemini API for quiz extraction...", flush=True)
-            # Convert numpy array to PIL Image
-            pil_image = Image.fromarray(image)
+            # Convert numpy array to an upload part (PIL image or optimized blob)
+            pil_image, _ = to_upload_part(image, self.upload_optimizer)
             
             # Create prompt for quiz format with answers
             prompt = """Extract exam questions and provide sample answers in JSON format with multiple choice options.
@@ -191,10 +281,13 @@ Return ONLY the JSON object, nothing else."""
             
             # Generate response with timeout handling
             print(f"    → Waiting for Gemini response...", flush=True)
-            response = self.model.generate_content([prompt, pil_image])
+            # Unparseable responses are retried like rate limits and server errors
+            data = self._generate(
+                [prompt, pil_image], schema=Quiz if self.structured_output else None, parse_json=True
+            )
             print(f"    ✓ Gemini response received", flush=True)
             
-            return response.text.strip()
+            return json.dumps({'questions': data.get('questions', [])})
             
         except Exception as e:
             print(f"  ⚠ Warning: Gemini quiz extraction failed - {e}", flush=True)
@@ -212,8 +305,8 @@ Return ONLY the JSON object, nothing else."""
         """
         try:
             print(f"    → Single Gemini API call for text + quiz...", flush=True)
-            # Convert numpy array to PIL Image
-            pil_image = Image.fromarray(image)
+            # Convert numpy array to an upload part (PIL image or optimized blob)
+            pil_image, _ = to_upload_part(image, self.upload_optimizer)
             
             # Combined prompt for both OCR and quiz extraction
             prompt = """Extract ALL text from this exam page AND structure questions in quiz format with multiple choice options.
@@ -257,21 +350,11 @@ Return ONLY the JSON object."""
             
             # Generate response
             print(f"    → Waiting for Gemini response...", flush=True)
-            response = self.model.generate_content([prompt, pil_image])
+            # Unparseable responses are retried like rate limits and server errors
+            data = self._generate(
+                [prompt, pil_image], schema=TextAndQuiz if self.structured_output else None, parse_json=True
+            )
             print(f"    ✓ Gemini response received", flush=True)
-            
-            # Parse response
-            import json
-            result = response.text.strip()
-            
-            # Remove markdown code blocks if present
-            if result.startswith('```'):
-                result = result.split('```')[1]
-                if result.startswith('json'):
-                    result = result[4:]
-                result = result.strip()
-            
-            data = json.loads(result)
             plain_text = data.get('text', '')
             quiz_data = json.dumps(data.get('quiz', {}))
             
@@ -299,7 +382,7 @@ Return ONLY the JSON object."""
             pil_images = []
             page_numbers = []
             for page_num, img in images_with_page_nums:
-                pil_images.append(Image.fromarray(img))
+                pil_images.append(to_upload_part(img, self.upload_optimizer)[0])
                 page_numbers.append(page_num)
             
             # Batch prompt
@@ -350,22 +433,12 @@ CRITICAL:
             # Send all images at once
             print(f"    → Waiting for Gemini batch response...", flush=True)
             content_parts = [prompt] + pil_images
-            response = self.model.generate_content(content_parts)
+            # Unparseable responses are retried like rate limits and server errors
+            data = self._generate(
+                content_parts, schema=QuizBatch if self.structured_output else None, parse_json=True, last_item='page'
+            )
             print(f"    ✓ Batch response received!", flush=True)
             
-            # Parse batch response
-            import json
-            result = response.text.strip()
-            
-            # Remove markdown
-            if result.startswith('```'):
-                result = result.split('```')[1]
-                if result.startswith('json'):
-                    result = result[4:]
-                result = result.strip()
-            
-            data = json.loads(result)
-            
             # Map results back to page numbers
             results = {}
             for page_data in data.get('pages', []):
@@ -3,32 +3,139 @@ Enhanced Gemini Vision OCR Service with Auto-Enrichment
 Uses Google's Gemini Flash for accurate math OCR + automatic metadata extraction
 """
 import google.generativeai as genai
-import base64
-from PIL import Image
-import io
 import numpy as np
-from typing import Optional
+from typing import Callable, Optional
 import json
-import ast
-from pathlib import Path
+import threading
+from app.services.gemini_cache import GeminiResponseCache
+from app.services.gemini_engine import RateLimiter, estimate_tokens
+from app.services.gemini_context_cache import get_context_cache, context_cache_name
+from app.services.gemini_usage import UsageRecorder, usage_scope
+from app.services.gemini_model_stack import CallCounter, wrap_model
+from app.services.circuit_breaker import CircuitBreaker, gemini_probe
+from app.services.upload_optimizer import UploadOptimizer, to_upload_part, log_payload, scale_bbox
+from app.services.gemini_retry import RetryPolicy, GeminiRequestError, call_with_retry, PARSE
+from app.services.json_stream import IncrementalJSONParser
+from app.services.json_repair import parse_llm_json
+from app.services.debug_recorder import current_debug
+from app.services.gemini_schemas import EnrichedBatch, EnrichedQuestion, json_generation_config, parse_structured
+
+
+class PartialBatchError(GeminiRequestError):
+    """Some pages of a batch failed for good; the pages in results were extracted and verified"""
+
+    def __init__(self, error: GeminiRequestError, results: dict[int, dict], failed_pages: list[int]):
+        super().__init__(error.category, error.attempts, error.cause)
+        self.results = results
+        self.failed_pages = failed_pages
 
 
 class GeminiOCREnriched:
     """Enhanced Gemini OCR with automatic question enrichment"""
     
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        response_cache: Optional[GeminiResponseCache] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        upload_optimizer: Optional[UploadOptimizer] = None,
+        structured_output: bool = False,
+        context_cache_ttl: Optional[float] = None,
+        usage_recorder: Optional[UsageRecorder] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None
+    ):
         """
         Initialize Gemini OCR with enrichment capabilities
         
         Args:
             api_key: Google Gemini API key
+            response_cache: Persistent response cache; identical requests are served from it
+            rate_limiter: RPM/TPM limiter shared by every client using the same API key
+            retry_policy: Retry budget and back-off for failed requests (default: RetryPolicy())
+            upload_optimizer: Downscales/encodes page images before upload (default: None, SDK encoding)
+            structured_output: Constrain JSON responses to the pydantic schemas in gemini_schemas
+                and validate them in one pass instead of cleaning up free-form text
+            context_cache_ttl: Store the static enriched prompt as cached context for this many
+                seconds and send only the page images with each request (default: None, the
+                prompt is sent every time). Falls back to inline prompts if caching is unavailable
+            usage_recorder: Records tokens, payload, latency and cache hits of every call
+            circuit_breaker: Fails requests fast while the API is unhealthy (shared by the job's clients)
         """
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        self.model_name = 'gemini-2.5-flash'
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.upload_optimizer = upload_optimizer
+        self.structured_output = structured_output
+        self.context_cache_ttl = context_cache_ttl
+        self.usage_recorder = usage_recorder
+        self.circuit_breaker = circuit_breaker
+        if circuit_breaker is not None and circuit_breaker.probe is None:
+            circuit_breaker.probe = gemini_probe(self.model_name, rate_limiter)
+        self.model = wrap_model(
+            genai.GenerativeModel(self.model_name), rate_limiter, response_cache, usage_recorder,
+            model_name=self.model_name
+        )
+        self._context_model = None  # Model built from the cached prompt; False once caching failed
+        self._context_lock = threading.Lock()
+        self.prompt_tokens_saved = 0  # Prompt tokens served from the context cache instead of resent
+        self._calls = CallCounter()  # Per-thread (live, cached) request counts
+    
+    def _context_cached_model(self, prompt: str):
+        """
+        Model whose requests start with prompt as cached context
+        
+        The context is created (or an unexpired one from an earlier run reused)
+        on first use. If that fails, e.g. because the API key has no access to
+        context caching, the prompt is sent inline from then on.
+        
+        Returns:
+            Wrapped model, or None to send the prompt with every request
+        """
+        if self.context_cache_ttl is None:
+            return None
+        with self._context_lock:
+            if self._context_model is None:
+                try:
+                    cached = get_context_cache(self.model_name, prompt, self.context_cache_ttl)
+                    cache_name = context_cache_name(self.model_name, prompt)
+                    self._context_model = wrap_model(
+                        genai.GenerativeModel.from_cached_content(cached),
+                        self.rate_limiter, self.response_cache, self.usage_recorder,
+                        cache_model_name=f"{self.model_name}:{cache_name}", model_name=self.model_name
+                    )
+                    print(f"    ♻ Context cache {cache_name}: ~{estimate_tokens([prompt])} prompt tokens "
+                          f"stored for {self.context_cache_ttl / 60:.0f} min", flush=True)
+                except Exception as e:
+                    print(f"    ⚠ Context caching unavailable, sending the prompt inline: {e}", flush=True)
+                    self._context_model = False
+            return self._context_model or None
+    
+    def _record_prompt_savings(self, response, prompt: str):
+        """Count the prompt tokens a context-cached request didn't resend"""
+        usage = getattr(response, 'usage_metadata', None)
+        saved = getattr(usage, 'cached_content_token_count', 0) or estimate_tokens([prompt])
+        with self._context_lock:
+            self.prompt_tokens_saved += saved
+        print(f"    ♻ Context cache: ~{saved} prompt tokens not resent "
+              f"({len(prompt.encode()) / 1024:.1f} KB)", flush=True)
+    
+    def pop_call_counts(self) -> tuple[int, int]:
+        """
+        Requests this thread sent since the last call (batch splits and retries included)
+        
+        Returns:
+            (live API calls, calls served from the response cache)
+        """
+        return self._calls.pop()
     
     def extract_enriched_batch_quiz(
         self, 
-        images_with_page_nums: list[tuple[int, np.ndarray]]
+        images_with_page_nums: list[tuple[int, np.ndarray]],
+        skip_ocr_text=False,
+        on_question: Optional[Callable[[int, dict], None]] = None
     ) -> dict[int, dict]:
         """
         Extract quiz data with AUTOMATIC ENRICHMENT from multiple pages
@@ -41,23 +148,41 @@ class GeminiOCREnriched:
         - Learning outcomes
         - Time estimates
         
+        Every image is tagged with a PAGE_ID marker and the returned page ids
+        are checked against the ones sent. Pages whose mapping is ambiguous
+        (missing, duplicated or unknown ids), and whole batches whose response
+        can't be parsed, are split in halves and requested again.
+        
+        With on_question the response is streamed and every question is handed
+        over as soon as its JSON object is complete, so callers can work on it
+        while Gemini is still generating the rest. Streamed questions are
+        provisional: a retried or re-mapped request streams them again, and
+        the returned dict stays the authoritative result.
+        
         Args:
             images_with_page_nums: List of (page_number, image) tuples
+            skip_ocr_text: The caller already has the page text (PDF text layer),
+                so Gemini returns an empty "text" instead of transcribing the page.
+                True for every page, or a collection of page numbers
+            on_question: Called with (page_number, question) for each streamed question
             
         Returns:
             Dict mapping page_number -> enriched_data
+            
+        Raises:
+            GeminiRequestError: The request failed for good (after retries); a PartialBatchError
+                when only some pages failed, carrying the results of the others
         """
+        page_numbers = [page_num for page_num, _ in images_with_page_nums]
+        if skip_ocr_text is True:
+            text_layer_pages = set(page_numbers)
+        else:
+            text_layer_pages = set(skip_ocr_text or ())
+        
         try:
             batch_size = len(images_with_page_nums)
             print(f"    → ENRICHED BATCH: Processing {batch_size} pages in 1 API call...", flush=True)
             
-            # Convert all images to PIL
-            pil_images = []
-            page_numbers = []
-            for page_num, img in images_with_page_nums:
-                pil_images.append(Image.fromarray(img))
-                page_numbers.append(page_num)
-            
             # Enhanced batch prompt with auto-enrichment
             prompt = """Extract ALL text and quiz data from these exam pages WITH AUTOMATIC ENRICHMENT.
 
@@ -148,7 +273,7 @@ Return JSON with this EXACT structure:
 {
   "pages": [
     {
-      "page_number": 1,
+      "page_id": 1,
       "text": "Full OCR text from page...",
       "quiz": {
         "questions": [
@@ -208,72 +333,242 @@ Return JSON with this EXACT structure:
     }
   ]
 }
+
+PAGE IDENTIFICATION (CRITICAL):
+- Every page image is preceded by a marker line "PAGE_ID: <n>"
+- Return exactly ONE object in "pages" per image, in the same order as the images
+- Set "page_id" to the number from that image's marker - never merge pages or invent ids
+- If the marker says "(text layer available)", do NOT transcribe that page: set its "text" to an empty string "" and put all output into the "quiz" data
 """
 
-            # Send all images at once
-            print(f"    → Waiting for Gemini enriched batch response...", flush=True)
-            content_parts = [prompt] + pil_images
-            response = self.model.generate_content(content_parts)
-            print(f"    ✓ Enriched batch response received!", flush=True)
+            # With context caching the prompt is already on the server; a short instruction replaces it
+            model = self._context_cached_model(prompt)
+            if model is None:
+                model = self.model
+                content_parts = [prompt]
+            else:
+                content_parts = ["Extract the following exam pages as instructed."]
             
-            # Parse batch response
-            result = response.text.strip()
-            
-            # Debug: Save raw response for inspection
-            debug_path = Path('output/gemini_debug_response.json')
-            debug_path.parent.mkdir(exist_ok=True)
-            with open(debug_path, 'w') as f:
-                f.write(result)
+            # Tag every image with its page id so the response can be mapped back reliably
+            upload_scales = {}
+            for page_num, img in images_with_page_nums:
+                marker = f"PAGE_ID: {page_num}"
+                if page_num in text_layer_pages:
+                    marker += " (text layer available)"
+                upload_part, upload_scales[page_num] = to_upload_part(img, self.upload_optimizer)
+                content_parts += [marker, upload_part]
+            log_payload(content_parts, self.upload_optimizer)
             
-            # Remove markdown if present
-            if result.startswith('```'):
-                result = result.split('```')[1]
-                if result.startswith('json'):
-                    result = result[4:]
-                result = result.strip()
+            # Structured output constrains the response to the EnrichedBatch schema
+            generate_kwargs = {}
+            if self.structured_output:
+                generate_kwargs['generation_config'] = json_generation_config(EnrichedBatch)
             
-            try:
-                data = json.loads(result, strict=False)
-            except json.JSONDecodeError as e:
-                print(f"    ⚠ JSON Decode Error: {str(e)} - Trying fallback parsing...", flush=True)
-                try:
-                    # Fix common LLM JSON errors
-                    # 1. Replace single quotes with double quotes (risky but worth a try if ast fails)
-                    # 2. Handle Python-style booleans/None if using ast.literal_eval
-                    
-                    # Try ast.literal_eval which handles single quotes and Python syntax
-                    # First convert JSON null/true/false to Python None/True/False
-                    python_style = result.replace('null', 'None').replace('true', 'True').replace('false', 'False')
-                    data = ast.literal_eval(python_style)
-                    print(f"    ✓ Fallback parsing successful using ast.literal_eval!", flush=True)
-                except Exception as e2:
-                    print(f"    ❌ Fallback parsing failed: {str(e2)}", flush=True)
-                    # Last ditch effort: regex cleanup for trailing commas
-                    try:
-                        clean_json = re.sub(r',\s*([\]}])', r'\1', result)
-                        data = json.loads(clean_json, strict=False)
-                        print(f"    ✓ Fallback parsing successful using regex cleanup!", flush=True)
-                    except Exception as e3:
-                        raise e # Re-raise original error if all fallbacks fail
+            # Send all images at once; rate limits, server errors and unparseable output are retried
+            def request():
+                print(f"    → Waiting for Gemini enriched batch response...", flush=True)
+                if on_question is None:
+                    response = model.generate_content(content_parts, **generate_kwargs)
+                    self._calls.count(model)
+                else:
+                    response = model.generate_content(content_parts, stream=True, **generate_kwargs)
+                    self._calls.count(model)
+                    self._stream_questions(response, page_numbers, upload_scales, on_question)
+                print(f"    ✓ Enriched batch response received!", flush=True)
+                if model is not self.model and not getattr(model, 'last_call_cached', False):
+                    self._record_prompt_savings(response, prompt)
+                return self._parse_response(response.text, page_count=len(page_numbers))
             
-            # Map results back to page numbers
-            # IMPORTANT: Gemini always returns page_number:1, so we need to map using our input page numbers
-            results = {}
-            gemini_pages = data.get('pages', [])
+            with usage_scope('enriched_batch', page_numbers):
+                data = call_with_retry(
+                    request, self.retry_policy, rate_limiter=self.rate_limiter, model=model,
+                    description=f"Enriched extraction of page(s) {', '.join(map(str, page_numbers))}",
+                    breaker=self.circuit_breaker
+                )
             
-            for idx, page_data in enumerate(gemini_pages):
-                # Use the actual page number from our input, not from Gemini's response
-                actual_page_num = page_numbers[idx] if idx < len(page_numbers) else page_data.get('page_number', 1)
-                results[actual_page_num] = page_data
+            # Map results back to page numbers by the returned page ids
+            results, unresolved = self._map_pages(data, page_numbers)
             
+            # Gemini's boxes are in uploaded-image pixels; map them back to the page image
+            for page_num, page_data in results.items():
+                for question in ((page_data.get('quiz') or {}).get('questions') or []):
+                    enrichment = question.get('enrichment') if isinstance(question, dict) else None
+                    if isinstance(enrichment, dict) and enrichment.get('diagram_bbox'):
+                        enrichment['diagram_bbox'] = scale_bbox(enrichment['diagram_bbox'], upload_scales[page_num])
             print(f"    ✅ Extracted ENRICHED data for {len(results)} pages in 1 call!", flush=True)
-            return results
             
+        except GeminiRequestError as e:
+            # Long multi-page responses are the ones that get truncated or garbled: try smaller batches
+            if e.category == PARSE and len(images_with_page_nums) > 1:
+                print(f"    ⚠ Unparseable response for {len(page_numbers)} pages - splitting batch", flush=True)
+                return self._request_in_halves(images_with_page_nums, text_layer_pages, on_question)
+            print(f"  ⚠ Warning: Enriched batch extraction failed - {e}", flush=True)
+            raise
         except Exception as e:
             print(f"  ⚠ Warning: Enriched batch extraction failed - {e}", flush=True)
             import traceback
             traceback.print_exc()
             return {}
+        
+        if unresolved:
+            print(f"    ⚠ Ambiguous page mapping for page(s) {', '.join(map(str, sorted(unresolved)))} "
+                  f"- requesting them again", flush=True)
+            retry_pages = [(page_num, img) for page_num, img in images_with_page_nums if page_num in unresolved]
+            try:
+                results.update(self._request_in_halves(retry_pages, text_layer_pages, on_question))
+            except PartialBatchError as e:
+                # Keep the pages this response mapped; only the re-requested ones that failed are missing
+                results.update(e.results)
+                raise PartialBatchError(e, results, e.failed_pages) from e.cause
+        return results
+    
+    def _stream_questions(self, response, page_numbers, upload_scales, on_question):
+        """
+        Read a streamed response to the end, handing over each question as it completes
+        
+        Questions are only handed over when their page's id was generated
+        before them and is one that was sent (any id for single-page batches,
+        which can't be mis-mapped); the rest wait for the full response.
+        """
+        parser = IncrementalJSONParser(['questions'])
+        for chunk in response:
+            try:
+                chunk_text = chunk.text
+            except ValueError:
+                continue  # No text in this chunk (e.g. the final one); response.text reports real errors
+            for _, context, question in parser.feed(chunk_text):
+                page_num = page_numbers[0] if len(page_numbers) == 1 else self._page_id(context)
+                if page_num not in page_numbers:
+                    continue
+                if self.structured_output:
+                    # Same shape as the validated full response, so callers can match them up
+                    try:
+                        question = EnrichedQuestion.model_validate(question).model_dump()
+                    except ValueError:
+                        continue
+                enrichment = question.get('enrichment')
+                if isinstance(enrichment, dict) and enrichment.get('diagram_bbox'):
+                    enrichment['diagram_bbox'] = scale_bbox(enrichment['diagram_bbox'], upload_scales[page_num])
+                on_question(page_num, question)
+    
+    def _request_in_halves(self, images_with_page_nums, text_layer_pages, on_question=None) -> dict[int, dict]:
+        """
+        Request pages again as two smaller batches (or one single-page batch)
+        
+        A half that fails doesn't cost the other half its results.
+        
+        Raises:
+            PartialBatchError: Some pages failed for good; it carries the pages that didn't
+        """
+        middle = (len(images_with_page_nums) + 1) // 2
+        results = {}
+        failed_pages = []
+        error = None
+        for chunk in (images_with_page_nums[:middle], images_with_page_nums[middle:]):
+            if chunk:
+                chunk_text_layer = text_layer_pages & {page_num for page_num, _ in chunk}
+                try:
+                    results.update(self.extract_enriched_batch_quiz(
+                        chunk, skip_ocr_text=chunk_text_layer, on_question=on_question
+                    ))
+                except GeminiRequestError as e:
+                    if isinstance(e, PartialBatchError):
+                        results.update(e.results)
+                    failed_pages += [page_num for page_num, _ in chunk if page_num not in results]
+                    error = error or e
+        if error is not None:
+            raise PartialBatchError(error, results, failed_pages) from error.cause
+        return results
+    
+    @staticmethod
+    def _page_id(page_data: dict) -> Optional[int]:
+        """Page id Gemini returned for a page object, or None if missing/garbled"""
+        page_id = page_data.get('page_id')
+        try:
+            return int(str(page_id).replace('PAGE_ID:', '').strip())
+        except ValueError:
+            return None
+    
+    def _map_pages(self, data: dict, page_numbers: list[int]) -> tuple[dict[int, dict], set[int]]:
+        """
+        Map returned page objects to the page numbers that were sent
+        
+        Args:
+            data: Parsed Gemini response
+            page_numbers: Page numbers sent, in order
+            
+        Returns:
+            (page_number -> page data for verified pages, page numbers that couldn't be mapped)
+        """
+        gemini_pages = [page for page in data.get('pages', []) if isinstance(page, dict)]
+        
+        # A single image can't be mis-mapped; fold any extra page objects into it
+        if len(page_numbers) == 1:
+            if not gemini_pages:
+                return {}, set()
+            page_data = gemini_pages[0]
+            for extra in gemini_pages[1:]:
+                quiz = page_data.get('quiz') or {}
+                quiz.setdefault('questions', []).extend((extra.get('quiz') or {}).get('questions', []))
+                page_data['quiz'] = quiz
+                page_data['text'] = '\n'.join(filter(None, [page_data.get('text'), extra.get('text')]))
+            return {page_numbers[0]: page_data}, set()
+        
+        by_id = {}
+        for page_data in gemini_pages:
+            by_id.setdefault(self._page_id(page_data), []).append(page_data)
+        
+        sent = set(page_numbers)
+        results = {
+            page_id: pages[0] for page_id, pages in by_id.items()
+            if page_id in sent and len(pages) == 1
+        }
+        return results, sent - results.keys()
+    
+    def _parse_response(self, response_text: str, page_count: int = 1) -> dict:
+        """
+        Parse Gemini's JSON answer, repairing common LLM JSON errors in one pass
+        
+        In structured output mode the response is validated against the
+        EnrichedBatch schema in one pass instead.
+        
+        Args:
+            response_text: Raw response text
+            page_count: Number of pages sent; when a multi-page response was cut
+                off, its last (incomplete) page is dropped so it is requested again,
+                and a single page's last question gets 'truncated': True
+        
+        Raises:
+            json.JSONDecodeError: The response isn't recoverable JSON
+            pydantic.ValidationError: The structured response doesn't match the schema
+        """
+        result = response_text.strip()
+        
+        # Debug mode: keep every raw response for inspection
+        debug = current_debug()
+        if debug:
+            debug.file('gemini_response.json', result)
+        
+        if self.structured_output:
+            return parse_structured(EnrichedBatch, result)
+        
+        data, fixes, truncated = parse_llm_json(result)
+        if fixes:
+            print(f"    ⚠ Repaired Gemini JSON: {', '.join(fixes)}", flush=True)
+        if not isinstance(data, dict):
+            raise json.JSONDecodeError("Expected a JSON object", result, 0)
+        
+        pages = data.get('pages')
+        if truncated and isinstance(pages, list) and pages:
+            if page_count > 1:
+                pages.pop()
+            else:
+                # Nothing smaller to request: flag the cut-off question so it can be re-requested
+                questions = ((pages[-1].get('quiz') or {}).get('questions') or []) if isinstance(pages[-1], dict) else []
+                if questions and isinstance(questions[-1], dict):
+                    questions[-1]['truncated'] = True
+                    print("    ⚠ Response was cut off - last question flagged as truncated", flush=True)
+        return data
     
     def extract_single_enriched_quiz(self, image: np.ndarray) -> dict:
         """
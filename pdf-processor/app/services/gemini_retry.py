@@ -0,0 +1,229 @@
+"""
+Gemini Retry Layer
+Error classification, server back-off hints and decorrelated-jitter retries for Gemini requests
+"""
+import json
+import random
+import re
+import time
+from typing import Callable, Optional
+from google.api_core import exceptions as google_exceptions
+from google.generativeai.types import BlockedPromptException, StopCandidateException
+from app.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+# Error categories
+RATE_LIMIT = 'rate_limit'
+SERVER = 'server'
+PARSE = 'parse'
+SAFETY = 'safety'
+CIRCUIT_OPEN = 'circuit_open'
+OTHER = 'other'
+
+RETRYABLE = (RATE_LIMIT, SERVER, PARSE)
+
+_RATE_LIMIT_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+_SERVER_ERRORS = (
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.BadGateway,
+    google_exceptions.RetryError,
+    ConnectionError,
+    TimeoutError,
+)
+
+# "Please retry in 37.5s." / "retry_delay { seconds: 37 }" in 429 messages
+_RETRY_IN_PATTERN = re.compile(r'retry in\s+([\d.]+)\s*s', re.IGNORECASE)
+_RETRY_DELAY_PATTERN = re.compile(r'retry_delay\s*\{\s*seconds:\s*(\d+)')
+
+
+class GeminiRequestError(Exception):
+    """A Gemini request that failed for good (non-retryable error or retries exhausted)"""
+
+    def __init__(self, category: str, attempts: int, cause: Exception):
+        super().__init__(f"{category} error after {attempts} attempt(s): {cause}")
+        self.category = category
+        self.attempts = attempts
+        self.cause = cause
+
+
+def classify_error(error: Exception) -> str:
+    """
+    Sort an exception from a Gemini request into an error category
+
+    Returns:
+        One of RATE_LIMIT, SERVER, PARSE, SAFETY, CIRCUIT_OPEN or OTHER
+    """
+    if isinstance(error, CircuitOpenError):
+        return CIRCUIT_OPEN
+    if isinstance(error, _RATE_LIMIT_ERRORS):
+        return RATE_LIMIT
+    if isinstance(error, _SERVER_ERRORS):
+        return SERVER
+    if isinstance(error, (BlockedPromptException, StopCandidateException)):
+        return SAFETY
+    if isinstance(error, (json.JSONDecodeError, SyntaxError)):
+        return PARSE
+
+    message = str(error)
+    if isinstance(error, ValueError) and 'finish_reason' in message:
+        # response.text raises ValueError when no text came back; only
+        # MAX_TOKENS (2) is worth retrying, SAFETY (3) / RECITATION (4) are deterministic
+        return PARSE if 'MAX_TOKENS' in message or 'is 2' in message else SAFETY
+    if '429' in message or 'quota' in message.lower():
+        return RATE_LIMIT
+    if isinstance(error, ValueError):
+        return PARSE
+    return OTHER
+
+
+def retry_after_hint(error: Exception) -> Optional[float]:
+    """
+    Extract the server's requested back-off in seconds, if any
+
+    Looks at RetryInfo details of gRPC errors, a Retry-After header on
+    HTTP errors, and the "retry in Ns" text of Gemini quota messages.
+    """
+    for detail in getattr(error, 'details', None) or []:
+        delay = getattr(detail, 'retry_delay', None)
+        if delay is not None and (getattr(delay, 'seconds', 0) or getattr(delay, 'nanos', 0)):
+            return delay.seconds + delay.nanos / 1e9
+
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    retry_after = headers.get('Retry-After') if hasattr(headers, 'get') else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+
+    message = str(error)
+    for pattern in (_RETRY_IN_PATTERN, _RETRY_DELAY_PATTERN):
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class RetryPolicy:
+    """Retry budget and decorrelated-jitter back-off (sleep = U(base, 3 * previous sleep), capped)"""
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        max_parse_attempts: int = 2,
+        base_delay: float = 2.0,
+        max_delay: float = 60.0,
+    ):
+        """
+        Initialize the retry policy
+
+        Args:
+            max_attempts: Attempts per request for rate limit and server errors
+            max_parse_attempts: Attempts per request when the response can't be parsed
+            base_delay: Minimum back-off in seconds
+            max_delay: Maximum back-off in seconds
+        """
+        self.max_attempts = max_attempts
+        self.max_parse_attempts = max_parse_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def next_delay(self, previous: float) -> float:
+        """Decorrelated jitter back-off following a sleep of previous seconds"""
+        return min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, previous) * 3))
+
+
+def call_with_retry(
+    request: Callable,
+    policy: Optional[RetryPolicy] = None,
+    rate_limiter=None,
+    model=None,
+    description: str = "Gemini request",
+    breaker: Optional[CircuitBreaker] = None,
+):
+    """
+    Run request() until it succeeds, retrying transient failures
+
+    Rate limit and server errors are retried up to policy.max_attempts,
+    waiting at least as long as the server asks. Parse errors (the model
+    returned malformed output) are retried up to policy.max_parse_attempts
+    with the bad response evicted from the response cache. Safety blocks
+    and other errors fail immediately. With a circuit breaker, server
+    errors count towards opening it, and while it is open the request
+    fails at once (category CIRCUIT_OPEN) instead of waiting out retries.
+    Responses replayed from the response cache say nothing about the API:
+    they neither reset the breaker nor speed up the rate limiter.
+
+    Args:
+        request: Zero-argument callable making the Gemini call (and parsing its response)
+        policy: Retry policy (default: RetryPolicy())
+        rate_limiter: RateLimiter to slow down on throttling and speed up on success
+        model: Model the request calls; a cached model forgets a response that didn't parse
+        description: Label used in log messages
+        breaker: Circuit breaker shared by the job's Gemini clients
+
+    Returns:
+        Whatever request() returns
+
+    Raises:
+        GeminiRequestError: The request failed for good
+    """
+    policy = policy or RetryPolicy()
+    delay = 0.0
+    attempt = 0
+    failures = {}  # category -> failed attempts, each category has its own budget
+
+    while True:
+        if breaker is not None and not breaker.allow():
+            raise GeminiRequestError(CIRCUIT_OPEN, attempt, CircuitOpenError("Gemini circuit breaker is open"))
+        attempt += 1
+        try:
+            result = request()
+        except Exception as e:
+            category = classify_error(e)
+            if breaker is not None:
+                if category == SERVER:
+                    breaker.record_failure(e)
+                elif category in (PARSE, SAFETY) and not _served_from_cache(model):
+                    breaker.record_success()  # The API answered; the output was the problem
+                else:
+                    breaker.release()
+            failures[category] = failures.get(category, 0) + 1
+            limit = policy.max_parse_attempts if category == PARSE else policy.max_attempts
+            if category not in RETRYABLE or failures[category] >= limit:
+                raise GeminiRequestError(category, attempt, e) from e
+
+            delay = policy.next_delay(delay)
+            hint = retry_after_hint(e)
+            if hint is not None:
+                delay = max(delay, hint + random.uniform(0, 1))
+            if category == PARSE and hasattr(model, 'forget_last'):
+                model.forget_last()
+
+            print(f"    ↻ {description}: {category} error ({e.__class__.__name__}), "
+                  f"retry {failures[category]}/{limit - 1} in {delay:.1f}s", flush=True)
+            if category == RATE_LIMIT and rate_limiter is not None:
+                # The limiter holds back this retry and every other request sharing the quota
+                rate_limiter.on_throttle(pause=delay)
+            else:
+                time.sleep(delay)
+            continue
+
+        if _served_from_cache(model):
+            if breaker is not None:
+                breaker.release()
+            return result
+        if rate_limiter is not None:
+            rate_limiter.on_success()
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+
+def _served_from_cache(model) -> bool:
+    """Whether the model's last call on this thread was replayed from the response cache"""
+    return bool(getattr(model, 'last_call_cached', False))
@@ -0,0 +1,206 @@
+"""
+Gemini Response Schemas
+Pydantic models of every JSON document Gemini returns, used as response_schema in structured output mode
+"""
+import functools
+from typing import List, Optional, Type
+from pydantic import BaseModel
+
+
+class DiagramBox(BaseModel):
+    """Diagram bounding box in image pixels"""
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+class QuizOption(BaseModel):
+    """Multiple-choice option"""
+    label: str
+    text: str
+
+
+class QuizPart(BaseModel):
+    """Sub-question (a), (b), ... of a question"""
+    part: str
+    question_text: str
+    marks: Optional[int] = None
+    options: List[QuizOption] = []
+    correct_option: Optional[str] = None
+    sample_answer: Optional[str] = None
+    explanation: Optional[str] = None
+
+
+class QuizQuestion(BaseModel):
+    """Question with its sub-questions"""
+    number: str
+    question: Optional[str] = None
+    parts: List[QuizPart] = []
+
+
+class Quiz(BaseModel):
+    """Questions of one page (GeminiOCR.extract_quiz_with_answers response)"""
+    questions: List[QuizQuestion] = []
+
+
+class TextAndQuiz(BaseModel):
+    """GeminiOCR.extract_text_and_quiz response"""
+    text: str
+    quiz: Quiz
+
+
+class QuizPage(BaseModel):
+    """One page of a GeminiOCR.extract_batch_quiz response"""
+    page_number: int
+    text: str
+    quiz: Quiz
+
+
+class QuizBatch(BaseModel):
+    """GeminiOCR.extract_batch_quiz response"""
+    pages: List[QuizPage]
+
+
+class Enrichment(BaseModel):
+    """Adaptive learning metadata of a question"""
+    topic: Optional[str] = None
+    chapter: Optional[str] = None
+    subject: Optional[str] = None
+    school_level: Optional[str] = None
+    question_level: Optional[str] = None
+    difficulty: Optional[str] = None
+    question_type: Optional[str] = None
+    time_estimate_minutes: Optional[int] = None
+    keywords: List[str] = []
+    learning_outcomes: List[str] = []
+    prerequisite_topics: List[str] = []
+    common_mistakes: List[str] = []
+    requires_diagram: bool = False
+    diagram_bbox: Optional[DiagramBox] = None
+    diagram_description: Optional[str] = None
+
+
+class EnrichedQuizPart(QuizPart):
+    """Sub-question with worked answer and hints"""
+    step_by_step_answer: Optional[str] = None
+    hints: List[str] = []
+
+
+class EnrichedQuestion(QuizQuestion):
+    """Question with worked answers and enrichment metadata"""
+    parts: List[EnrichedQuizPart] = []
+    enrichment: Enrichment
+
+
+class EnrichedQuiz(BaseModel):
+    """Enriched questions of one page"""
+    questions: List[EnrichedQuestion] = []
+
+
+class EnrichedPage(BaseModel):
+    """One page of a GeminiOCREnriched.extract_enriched_batch_quiz response"""
+    page_id: int
+    text: str
+    quiz: EnrichedQuiz
+
+
+class EnrichedBatch(BaseModel):
+    """GeminiOCREnriched.extract_enriched_batch_quiz response"""
+    pages: List[EnrichedPage]
+
+
+class AnswerPart(BaseModel):
+    """Worked answer of one sub-question"""
+    part: str
+    steps: List[str] = []
+    final_answer: Optional[str] = None
+    marks: Optional[int] = None
+    has_diagram: bool = False
+
+
+class Answer(BaseModel):
+    """Worked answers of one question"""
+    question_num: str
+    parts: List[AnswerPart] = []
+
+
+class AnswerPage(BaseModel):
+    """One page of a GeminiAnswerParser.extract_answers_from_batch response"""
+    page_number: int
+    paper_section: Optional[str] = None
+    answers: List[Answer] = []
+
+
+class AnswerBatch(BaseModel):
+    """GeminiAnswerParser.extract_answers_from_batch response"""
+    pages: List[AnswerPage]
+
+
+class DiagramAssignment(BaseModel):
+    """Diagram picked for one question by the set-of-marks locate request"""
+    number: str
+    candidate: Optional[int] = None
+    bbox: Optional[DiagramBox] = None
+    type: Optional[str] = None
+    confidence: float = 0.0
+
+
+class DiagramAssignments(BaseModel):
+    """Response of the per-page diagram locate request"""
+    questions: List[DiagramAssignment] = []
+
+
+# Keys of pydantic's JSON schema that carry over to Gemini's Schema (the class docstrings
+# pydantic turns into descriptions are written for developers, not for the model)
+_SCHEMA_KEYS = ('type', 'format', 'enum')
+
+
+@functools.lru_cache(maxsize=None)
+def to_gemini_schema(model: Type[BaseModel]) -> dict:
+    """
+    Convert a pydantic model to a Gemini response_schema
+
+    Gemini accepts an OpenAPI subset: $refs are inlined, Optional[X]
+    becomes a nullable X, and defaults, titles and descriptions are
+    dropped. Every property is required so the model always emits the full
+    document (with null or [] where there is nothing to say).
+    """
+    root = model.model_json_schema()
+    definitions = root.get('$defs', {})
+
+    def convert(node: dict) -> dict:
+        if '$ref' in node:
+            node = {**definitions[node['$ref'].split('/')[-1]], **{k: v for k, v in node.items() if k != '$ref'}}
+        if 'anyOf' in node:
+            variants = [variant for variant in node['anyOf'] if variant.get('type') != 'null']
+            schema = convert(variants[0])
+            if len(variants) < len(node['anyOf']):
+                schema['nullable'] = True
+            return schema
+
+        schema = {key: node[key] for key in _SCHEMA_KEYS if key in node}
+        if node.get('type') == 'object':
+            properties = node.get('properties', {})
+            schema['properties'] = {name: convert(prop) for name, prop in properties.items()}
+            schema['required'] = list(properties)
+        elif node.get('type') == 'array':
+            schema['items'] = convert(node.get('items', {'type': 'string'}))
+        return schema
+
+    return convert(root)
+
+
+def json_generation_config(model: Type[BaseModel]) -> dict:
+    """generation_config constraining a request's output to JSON matching model"""
+    return {'response_mime_type': 'application/json', 'response_schema': to_gemini_schema(model)}
+
+
+def parse_structured(model: Type[BaseModel], response_text: str) -> dict:
+    """
+    Validate a structured-output response in one pass
+
+    Raises:
+        pydantic.ValidationError: The response doesn't match the schema (a ValueError, retried as a parse error)
+    """
+    return model.model_validate_json(response_text).model_dump()
@@ -0,0 +1,265 @@
+"""
+Gemini Usage Accounting
+Per-call token, payload, latency and cost records, aggregated per page, prompt and job
+"""
+import contextlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+from app.services.gemini_engine import estimate_tokens
+from app.services.gemini_retry import classify_error
+from app.services.upload_optimizer import payload_bytes
+
+
+# USD per million tokens: (input, output, cached input). List prices at the time of
+# writing; pass UsageRecorder(prices=...) when they change
+DEFAULT_PRICES = {
+    'gemini-2.5-flash': (0.30, 2.50, 0.075),
+    'gemini-2.0-flash-exp': (0.10, 0.40, 0.025),
+}
+
+_scope = threading.local()
+
+
+def price_model_name(model_name: str) -> str:
+    """
+    Model name as listed in the price table
+
+    Drops the API's 'models/' prefix and the ':<context cache>' suffix that
+    context-cached models carry in their response cache key names.
+    """
+    return model_name.replace('models/', '').split(':', 1)[0]
+
+
+@contextlib.contextmanager
+def usage_scope(prompt: str, pages: Iterable[int] = ()):
+    """
+    Attribute the Gemini calls this thread makes inside the block to a prompt and pages
+
+    Calls after the first one in a scope are counted as retries. Scopes
+    nest; the innermost one applies (e.g. a batch split in halves).
+
+    Args:
+        prompt: Name of the prompt (e.g. 'enriched_batch', 'diagram_locate')
+        pages: Page numbers the request covers
+    """
+    previous = getattr(_scope, 'current', None)
+    _scope.current = {'prompt': prompt, 'pages': list(pages), 'calls': 0}
+    try:
+        yield
+    finally:
+        _scope.current = previous
+
+
+class UsageRecorder:
+    """Thread-safe collector of per-call Gemini usage records"""
+
+    def __init__(self, prices: Optional[Dict[str, tuple]] = None):
+        """
+        Initialize the recorder
+
+        Args:
+            prices: Model name -> USD per million (input, output, cached input) tokens
+                (default: DEFAULT_PRICES)
+        """
+        self.prices = prices or DEFAULT_PRICES
+        self.calls: List[dict] = []
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        model_name: str,
+        contents,
+        response=None,
+        latency: float = 0.0,
+        cached: bool = False,
+        error: Optional[Exception] = None,
+    ):
+        """
+        Store one generate_content call
+
+        Token counts come from the response's usage metadata; when it is
+        missing (test doubles, some streamed responses) they are estimated
+        and the record is flagged as such. Cache hits and failed calls
+        aren't billed and count no tokens. Payload bytes count the text and
+        the encoded image blobs; PIL images left to the SDK aren't sized.
+
+        Args:
+            model_name: Gemini model name
+            contents: Request contents
+            response: Response (None if the call failed)
+            latency: Seconds until the complete response was received
+            cached: Served from the response cache
+            error: Exception the call raised
+        """
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        scope = getattr(_scope, 'current', None) or {'prompt': 'unscoped', 'pages': [], 'calls': 0}
+        scope['calls'] += 1
+
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+        output_tokens = getattr(usage, 'candidates_token_count', 0) or 0
+        cached_content_tokens = getattr(usage, 'cached_content_token_count', 0) or 0
+        estimated = not prompt_tokens
+        if estimated:
+            prompt_tokens = estimate_tokens(parts)
+            if response is not None and error is None:
+                try:
+                    output_tokens = len(response.text) // 4
+                except ValueError:
+                    output_tokens = 0
+
+        billed = not cached and error is None
+        entry = {
+            'model': price_model_name(model_name),
+            'prompt': scope['prompt'],
+            'pages': scope['pages'],
+            'retry': scope['calls'] > 1,
+            'cached': cached,
+            'error': classify_error(error) if error is not None else None,
+            'prompt_tokens': prompt_tokens if billed else 0,
+            'cached_content_tokens': cached_content_tokens if billed else 0,
+            'output_tokens': output_tokens if billed else 0,
+            'tokens_estimated': estimated and billed,
+            'payload_bytes': 0 if cached else (
+                payload_bytes(parts) + sum(len(part.encode()) for part in parts if isinstance(part, str))
+            ),
+            'latency_seconds': round(latency, 3),
+        }
+        entry['cost_usd'] = round(self._cost(entry), 6)
+        with self._lock:
+            self.calls.append(entry)
+
+    def _cost(self, entry: dict) -> float:
+        input_price, output_price, cached_price = self.prices.get(entry['model'], (0.0, 0.0, 0.0))
+        uncached = entry['prompt_tokens'] - entry['cached_content_tokens']
+        return (uncached * input_price + entry['cached_content_tokens'] * cached_price
+                + entry['output_tokens'] * output_price) / 1e6
+
+    @staticmethod
+    def _totals(entries: List[dict], share: Callable[[dict], float] = lambda entry: 1.0) -> dict:
+        """Sum records, weighting each by share(entry) (its part of a multi-page call)"""
+        totals = {
+            'calls': 0, 'live_calls': 0, 'cached_calls': 0, 'failed_calls': 0, 'retries': 0,
+            'prompt_tokens': 0.0, 'cached_content_tokens': 0.0, 'output_tokens': 0.0,
+            'payload_bytes': 0.0, 'latency_seconds': 0.0, 'cost_usd': 0.0,
+        }
+        for entry in entries:
+            weight = share(entry)
+            totals['calls'] += 1
+            totals['cached_calls'] += entry['cached']
+            totals['live_calls'] += not entry['cached']
+            totals['failed_calls'] += entry['error'] is not None
+            totals['retries'] += entry['retry']
+            for key in ('prompt_tokens', 'cached_content_tokens', 'output_tokens',
+                        'payload_bytes', 'latency_seconds', 'cost_usd'):
+                totals[key] += entry[key] * weight
+        for key in ('prompt_tokens', 'cached_content_tokens', 'output_tokens', 'payload_bytes'):
+            totals[key] = round(totals[key])
+        totals['latency_seconds'] = round(totals['latency_seconds'], 3)
+        totals['cost_usd'] = round(totals['cost_usd'], 6)
+        return totals
+
+    def summary(self) -> dict:
+        """
+        Aggregate the records
+
+        A call covering several pages is shared evenly between them in the
+        per-page totals (tokens, bytes, latency and cost); call counts are
+        not split.
+
+        Returns:
+            {"job": totals, "by_prompt": {prompt: totals}, "by_page": {page: totals}, "calls": records}
+        """
+        with self._lock:
+            calls = list(self.calls)
+
+        by_prompt = {}
+        by_page = {}
+        for entry in calls:
+            by_prompt.setdefault(entry['prompt'], []).append(entry)
+            for page in entry['pages']:
+                by_page.setdefault(page, []).append(entry)
+
+        return {
+            'job': self._totals(calls),
+            'by_prompt': {prompt: self._totals(entries) for prompt, entries in by_prompt.items()},
+            'by_page': {
+                str(page): self._totals(entries, share=lambda entry: 1 / len(entry['pages']))
+                for page, entries in sorted(by_page.items())
+            },
+            'calls': calls,
+        }
+
+    def write(self, path) -> dict:
+        """Write summary() as JSON to path and return it"""
+        summary = self.summary()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+
+class _RecordingStream:
+    """Streaming response that is recorded once it has been read to the end"""
+
+    def __init__(self, response, on_done: Callable):
+        self._response = response
+        self._on_done = on_done
+
+    def __iter__(self):
+        try:
+            for chunk in self._response:
+                yield chunk
+        except Exception as e:
+            self._on_done(e)
+            raise
+        self._on_done(None)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+class UsageRecordingModel:
+    """Drop-in wrapper around a Gemini model (or its caching/limiting wrappers) that records every call"""
+
+    def __init__(self, model, recorder: UsageRecorder, model_name: Optional[str] = None):
+        """
+        Wrap a Gemini model
+
+        Args:
+            model: genai.GenerativeModel, RateLimitedModel or CachedGenerativeModel
+            recorder: Recorder shared by all clients of a job
+            model_name: Base model name the calls are priced as (default: model.model_name,
+                which for context-cached models includes the cache name)
+        """
+        self.model = model
+        self.recorder = recorder
+        self.model_name = model_name or model.model_name
+
+    def generate_content(self, contents, **kwargs):
+        """Same as GenerativeModel.generate_content, recorded in the usage recorder"""
+        start = time.monotonic()
+
+        def done(response, error):
+            cached = getattr(self.model, 'last_call_cached', False)
+            self.recorder.record(
+                self.model_name, contents, response=response, latency=time.monotonic() - start,
+                cached=cached, error=error
+            )
+
+        try:
+            response = self.model.generate_content(contents, **kwargs)
+        except Exception as e:
+            done(None, e)
+            raise
+        if kwargs.get('stream'):
+            return _RecordingStream(response, lambda error: done(None if error else response, error))
+        done(response, None)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
@@ -0,0 +1,320 @@
+"""
+LLM JSON Repair
+Single-pass tolerant tokenizer that turns Gemini's almost-JSON into valid JSON and reports what it fixed
+"""
+import json
+import math
+import re
+import sys
+from typing import Any, List, Tuple
+
+
+# LaTeX commands whose backslash JSON would silently read as a \b, \f, \n, \r or \t escape.
+# Commands that are also words after a real escape ("\ne", "\nu", "\ni", "\not", "\to":
+# a newline before "e 5", "not drawn to scale", ...) are left out and decode as JSON escapes
+LATEX_ESCAPE_COMMANDS = frozenset({
+    'bar', 'barwedge', 'beta', 'because', 'bigcap', 'bigcup', 'binom', 'bmod', 'boldsymbol',
+    'bot', 'boxed', 'bullet', 'bf', 'big', 'bigg', 'bigl', 'bigr',
+    'frac', 'dfrac', 'forall', 'flat', 'frown', 'frak',
+    'nabla', 'neq', 'neg', 'newline', 'nleq', 'ngeq', 'notin', 'nparallel',
+    'rangle', 'rceil', 'rfloor', 'rho', 'right', 'rightarrow', 'rightleftharpoons', 'rm', 'rvert',
+    'tan', 'tau', 'text', 'textbf', 'textit', 'textrm', 'therefore', 'theta', 'tilde', 'times',
+    'top', 'triangle', 'triangleq',
+})
+_LATEX_ESCAPE = re.compile(
+    r'(?<!\\)(?:\\\\)*\\(?:' + '|'.join(sorted(LATEX_ESCAPE_COMMANDS, key=len, reverse=True)) + r')(?![A-Za-z])'
+)
+
+_PYTHON_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null', 'NaN': 'null', 'undefined': 'null'}
+_NUMBER = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?$')
+_CONTROL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t', '\b': '\\b', '\f': '\\f'}
+_STRUCTURAL = set(',:{}[]"\'') | set(' \t\r\n')
+# Fixes that mean the output was cut off (the last item is incomplete)
+_TRUNCATION_FIXES = ('truncated', 'unterminated')
+
+
+def repair_json(text: str) -> Tuple[str, List[str]]:
+    """
+    Rewrite LLM output as valid JSON in one pass
+
+    Handles the defects Gemini produces: text or markdown fences around the
+    document, trailing and missing commas, single-quoted strings, unquoted
+    keys, Python literals (True/False/None), raw newlines and unescaped
+    quotes inside strings, LaTeX backslashes (\\frac, \\(, ...) that are not
+    valid or not intended JSON escapes, and documents truncated mid-string
+    or mid-container (closed at the point of truncation). Valid JSON is
+    returned unchanged, apart from LaTeX commands such as \\frac and \\times
+    whose backslash would otherwise be decoded as a control character.
+
+    Args:
+        text: Raw model output
+
+    Returns:
+        (repaired JSON text, descriptions of the fixes applied)
+    """
+    fixes = {}
+
+    def fix(name: str):
+        fixes[name] = fixes.get(name, 0) + 1
+
+    out = []
+    stack = []  # [kind, state]; object states: key/colon/value/after, array states: value/after
+    comma_at = None  # Index in out of a ',' that nothing significant has followed yet
+    n = len(text)
+
+    start = min((pos for pos in (text.find('{'), text.find('[')) if pos >= 0), default=-1)
+    if start < 0:
+        return text, []
+    if text[:start].strip():
+        fix('text before the document')
+    i = start
+
+    def before_value() -> bool:
+        """Prepare the container for a new token; returns True if the token is an object key"""
+        nonlocal comma_at
+        frame = stack[-1]
+        if frame[1] == 'after':
+            out.append(',')
+            fix('missing comma')
+            frame[1] = 'key' if frame[0] == '{' else 'value'
+        elif frame[0] == '{' and frame[1] == 'colon':
+            out.append(':')
+            fix('missing colon')
+            frame[1] = 'value'
+        comma_at = None
+        return frame[0] == '{' and frame[1] == 'key'
+
+    def after_token(was_key: bool):
+        stack[-1][1] = 'colon' if was_key else 'after'
+
+    def close_top():
+        nonlocal comma_at
+        kind, state = stack.pop()
+        if comma_at is not None:
+            out[comma_at] = ''
+            fix('trailing comma')
+        elif kind == '{' and state == 'colon':
+            out.append(':null')
+            fix('missing value')
+        elif kind == '{' and state == 'value':
+            out.append('null')
+            fix('missing value')
+        comma_at = None
+        out.append('}' if kind == '{' else ']')
+        if stack:
+            stack[-1][1] = 'after'
+
+    while i < n:
+        ch = text[i]
+
+        if not stack and out:
+            if text[i:].strip():
+                fix('text after the document')
+            break
+
+        if ch in ' \t\r\n':
+            out.append(ch)
+            i += 1
+        elif ch in '{[':
+            if stack:
+                before_value()
+            stack.append([ch, 'key' if ch == '{' else 'value'])
+            out.append(ch)
+            i += 1
+        elif ch in '}]':
+            expected = '}' if ch == '}' else ']'
+            if any(kind == ('{' if expected == '}' else '[') for kind, _ in stack):
+                while stack[-1][0] != ('{' if expected == '}' else '['):
+                    fix('mismatched bracket')
+                    close_top()
+                close_top()
+            else:
+                fix('stray bracket')
+            i += 1
+        elif ch == ',':
+            frame = stack[-1]
+            if frame[1] == 'after':
+                out.append(',')
+                comma_at = len(out) - 1
+                frame[1] = 'key' if frame[0] == '{' else 'value'
+            else:
+                fix('extra comma')
+            i += 1
+        elif ch == ':':
+            frame = stack[-1]
+            if frame[0] == '{' and frame[1] == 'colon':
+                out.append(':')
+                frame[1] = 'value'
+            else:
+                fix('stray colon')
+            i += 1
+        elif ch in '"\'':
+            is_key = before_value()
+            i = _read_string(text, i, out, fix)
+            after_token(is_key)
+        elif text.startswith('//', i):
+            fix('comment')
+            end = text.find('\n', i)
+            i = n if end < 0 else end
+        else:
+            k = i
+            while k < n and text[k] not in _STRUCTURAL:
+                k += 1
+            token = text[i:k]
+            is_key = before_value()
+            if is_key:
+                out.append(json.dumps(token))
+                fix('unquoted key')
+            elif token in ('true', 'false', 'null') or _NUMBER.match(token):
+                out.append(token)
+            elif token in _PYTHON_LITERALS:
+                out.append(_PYTHON_LITERALS[token])
+                fix('Python literal')
+            elif k == n and any(literal.startswith(token) for literal in ('true', 'false', 'null')):
+                out.append(next(literal for literal in ('true', 'false', 'null') if literal.startswith(token)))
+                fix('truncated literal')
+            else:
+                try:
+                    number = float(token)
+                except ValueError:
+                    number = None
+                if number is not None and math.isfinite(number):
+                    out.append(json.dumps(number))
+                    fix('malformed number')
+                else:
+                    out.append(json.dumps(token))
+                    fix('bare word')
+            after_token(is_key)
+            i = k
+
+    if stack:
+        fix('truncated document')
+        while stack:
+            close_top()
+
+    return ''.join(out), [f"{name} x{count}" if count > 1 else name for name, count in fixes.items()]
+
+
+def _read_string(text: str, i: int, out: list, fix) -> int:
+    """Copy the string starting at text[i] to out as a valid JSON string; returns the index after it"""
+    quote = text[i]
+    if quote == "'":
+        fix('single-quoted string')
+    n = len(text)
+    buf = ['"']
+    j = i + 1
+    closed = False
+
+    while j < n:
+        c = text[j]
+        if c == '\\':
+            if j + 1 >= n:
+                j += 1
+                break
+            nxt = text[j + 1]
+            if nxt in 'bfnrt':
+                k = j + 1
+                while k < n and text[k].isalpha():
+                    k += 1
+                if text[j + 1:k] in LATEX_ESCAPE_COMMANDS:
+                    buf.append('\\\\')
+                    fix('LaTeX backslash')
+                    j += 1
+                    continue
+                buf.append(text[j:j + 2])
+                j += 2
+            elif nxt == 'u' and re.match(r'[0-9a-fA-F]{4}', text[j + 2:j + 6]):
+                buf.append(text[j:j + 6])
+                j += 6
+            elif nxt in '"\\/':
+                buf.append(text[j:j + 2])
+                j += 2
+            elif nxt == "'":
+                buf.append("'")
+                fix('invalid escape')
+                j += 2
+            else:
+                buf.append('\\\\')  # \( \sqrt \alpha ...: keep the backslash as text
+                fix('LaTeX backslash')
+                j += 1
+        elif c == quote:
+            # A quote only ends the string if the document continues after it
+            # (possibly with the next string, when the comma is missing)
+            k = j + 1
+            while k < n and text[k] in ' \t\r\n':
+                k += 1
+            if k >= n or text[k] in ',:}]' or (text[k] in '"\'' and k > j + 1):
+                closed = True
+                j += 1
+                break
+            buf.append('\\"' if quote == '"' else "'")
+            if quote == '"':
+                fix('unescaped quote')
+            j += 1
+        elif c == '"':
+            buf.append('\\"')
+            j += 1
+        elif c in _CONTROL_ESCAPES or ord(c) < 0x20:
+            buf.append(_CONTROL_ESCAPES.get(c) or f'\\u{ord(c):04x}')
+            fix('raw control character')
+            j += 1
+        else:
+            buf.append(c)
+            j += 1
+
+    if not closed:
+        fix('unterminated string')
+    buf.append('"')
+    out.append(''.join(buf))
+    return j
+
+
+def parse_llm_json(text: str) -> Tuple[Any, List[str], bool]:
+    """
+    Parse model output as JSON, repairing it if needed
+
+    Well-formed output (optionally in a markdown fence) goes straight to
+    json.loads; only malformed output, or output with LaTeX commands that
+    would decode as control characters, goes through repair_json.
+
+    Returns:
+        (parsed document, descriptions of the fixes applied, whether the output
+        was cut off - its last item, e.g. the final question, is incomplete and
+        should be requested again)
+
+    Raises:
+        json.JSONDecodeError: The output isn't recoverable JSON
+    """
+    result = text.strip()
+    if result.startswith('```'):
+        result = result.split('```')[1]
+        if result.startswith('json'):
+            result = result[4:]
+        result = result.strip()
+
+    if not _LATEX_ESCAPE.search(result):
+        try:
+            return json.loads(result, strict=False), [], False
+        except json.JSONDecodeError:
+            pass
+
+    repaired, fixes = repair_json(result)
+    return json.loads(repaired), fixes, any(fix.startswith(_TRUNCATION_FIXES) for fix in fixes)
+
+
+if __name__ == "__main__":
+    # Check saved responses (job/gemini_response*.json in a --debug-bundle zip): python -m app.services.json_repair <file> ...
+    if len(sys.argv) < 2:
+        print("Usage: python -m app.services.json_repair <response file> [...]")
+        sys.exit(1)
+    failed = 0
+    for path in sys.argv[1:]:
+        with open(path, encoding='utf-8') as f:
+            raw = f.read()
+        try:
+            _, applied, _ = parse_llm_json(raw)
+            print(f"✓ {path}: {', '.join(applied) if applied else 'valid JSON'}")
+        except json.JSONDecodeError as e:
+            failed += 1
+            print(f"❌ {path}: unrecoverable ({e})")
+    sys.exit(1 if failed else 0)
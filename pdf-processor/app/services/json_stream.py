@@ -0,0 +1,136 @@
+"""
+Incremental JSON Parser
+Pick completed objects out of a JSON document while Gemini is still streaming it
+"""
+from typing import Iterable, List, Tuple
+from app.services.json_repair import parse_llm_json
+
+
+class IncrementalJSONParser:
+    """
+    Chunk-by-chunk JSON scanner that returns array items as soon as they close
+
+    Streamed responses arrive in arbitrary text chunks. The scanner tracks
+    strings, escapes and nesting across chunks, and whenever an object
+    inside an array stored under one of the watched keys (e.g. "questions")
+    is complete, it is decoded and returned with its path in the document
+    and the scalar fields already seen in its enclosing objects (e.g. the
+    page's "page_id"). Text around the document (markdown fences) is
+    ignored; items that don't decode on their own are skipped and left to
+    the full parse of the response.
+    """
+
+    def __init__(self, array_keys: Iterable[str]):
+        """
+        Initialize the parser
+
+        Args:
+            array_keys: Keys of the arrays whose object items should be returned
+        """
+        self.array_keys = set(array_keys)
+        self._text = ''
+        self._pos = 0
+        self._stack = []  # Open containers: {'kind', 'name', 'start', 'key', 'index', 'value_start', 'scalars'}
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._done = False
+
+    def feed(self, chunk: str) -> List[Tuple[tuple, dict, dict]]:
+        """
+        Scan the next chunk of the document
+
+        Args:
+            chunk: Text received since the last call
+
+        Returns:
+            (path, context, item) for every watched item completed by this chunk, where
+            path is the item's keys/indexes from the root (e.g. ('pages', 0, 'questions', 2))
+            and context merges the scalar members of the enclosing objects (innermost wins)
+        """
+        self._text += chunk
+        text = self._text
+        completed = []
+
+        for i in range(self._pos, len(text)):
+            if self._done:
+                break
+            ch = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    frame = self._stack[-1]
+                    if frame['kind'] == '{' and frame['value_start'] is None:
+                        # Repair can decode a malformed key to a container; such keys name nothing
+                        key = self._decode(text[self._string_start:i + 1])
+                        frame['key'] = key if isinstance(key, str) else None
+                continue
+
+            if not self._stack and ch != '{':
+                continue  # Before the document starts (e.g. ```json)
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in '{[':
+                name = None
+                if self._stack:
+                    parent = self._stack[-1]
+                    if parent['kind'] == '{':
+                        name = parent['key']
+                        parent['value_start'] = None  # Containers aren't collected as scalars
+                    else:
+                        name = parent['index']
+                self._stack.append({
+                    'kind': ch, 'name': name, 'start': i,
+                    'key': None, 'index': 0, 'value_start': None, 'scalars': {},
+                })
+            elif ch in '}]':
+                frame = self._stack.pop()
+                if frame['kind'] == '{':
+                    self._collect(frame, text[frame['value_start']:i] if frame['value_start'] else '')
+                if not self._stack:
+                    self._done = True
+                    continue
+                parent = self._stack[-1]
+                if frame['kind'] == '{' and parent['kind'] == '[' and parent['name'] in self.array_keys:
+                    item = self._decode(text[frame['start']:i + 1])
+                    if isinstance(item, dict):
+                        path = tuple(enclosing['name'] for enclosing in self._stack[1:]) + (frame['name'],)
+                        context = {}
+                        for enclosing in self._stack:
+                            context.update(enclosing['scalars'])
+                        completed.append((path, context, item))
+            elif ch == ':' and self._stack[-1]['kind'] == '{':
+                self._stack[-1]['value_start'] = i + 1
+            elif ch == ',':
+                frame = self._stack[-1]
+                if frame['kind'] == '{':
+                    self._collect(frame, text[frame['value_start']:i] if frame['value_start'] else '')
+                else:
+                    frame['index'] += 1
+
+        self._pos = len(text)
+        return completed
+
+    @staticmethod
+    def _decode(raw: str):
+        # Same tolerant parsing as the full response, so streamed items match it
+        try:
+            return parse_llm_json(raw)[0]
+        except ValueError:
+            return None
+
+    def _collect(self, frame: dict, raw: str):
+        """Store a finished scalar member of an object"""
+        raw = raw.strip()
+        if raw and frame['key'] is not None:
+            value = self._decode(raw)
+            if value is not None:
+                frame['scalars'][frame['key']] = value
+        frame['value_start'] = None
@@ -0,0 +1,155 @@
+"""
+Local Question Extraction
+Degraded, Gemini-free page processing: text layer or Tesseract text split into questions with regexes
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.services.question_segmenter import PART_ANCHOR, QUESTION_START
+
+
+# "[2]" / "[2 marks]" mark allocations
+_MARKS = re.compile(r'\[(\d{1,2})(?:[ \t]*marks?)?\]', re.IGNORECASE)
+
+
+def split_questions(text: str) -> List[Dict]:
+    """
+    Split a page's text into questions and parts
+
+    Question numbers must count up by one from the first one found, so
+    numbers at the start of lines inside a question (working, tables,
+    coordinates) aren't taken for new questions.
+
+    Args:
+        text: Page text (PDF text layer or OCR)
+
+    Returns:
+        Questions in the enriched format without enrichment:
+        {"number", "question", "parts": [{"part", "question_text", "marks"}]}
+    """
+    starts = []
+    for match in QUESTION_START.finditer(text):
+        number = int(match.group(1))
+        if number == 0:
+            continue
+        if not starts or number == starts[-1][0] + 1:
+            starts.append((number, match.start(), match.end()))
+
+    questions = []
+    for idx, (number, _, body_start) in enumerate(starts):
+        body_end = starts[idx + 1][1] if idx + 1 < len(starts) else len(text)
+        body = text[body_start:body_end].strip()
+        if not body:
+            continue
+
+        part_matches = list(PART_ANCHOR.finditer(body))
+        stem = body[:part_matches[0].start()].strip() if part_matches else body
+        parts = []
+        for part_idx, match in enumerate(part_matches):
+            part_end = part_matches[part_idx + 1].start() if part_idx + 1 < len(part_matches) else len(body)
+            part_text = body[match.end():part_end].strip()
+            parts.append({
+                'part': f"({match.group(1)})",
+                'question_text': part_text,
+                'marks': _last_marks(part_text),
+            })
+        if not parts:
+            # Single-part question: the whole body is its only part, as Gemini returns it
+            parts.append({'part': '', 'question_text': body, 'marks': _last_marks(body)})
+            stem = ''
+
+        questions.append({'number': str(number), 'question': stem or None, 'parts': parts})
+    return questions
+
+
+def _last_marks(text: str) -> Optional[int]:
+    """Mark allocation printed at the end of a question/part, if any"""
+    found = _MARKS.findall(text)
+    return int(found[-1]) if found else None
+
+
+def extract_page_locally(
+    pdf_processor,
+    page_num: int,
+    page_image: np.ndarray,
+    text_layout: Optional[Dict] = None,
+    use_text_layer: bool = False,
+) -> Dict:
+    """
+    Process a page without Gemini: text layer (or Tesseract) + regex question splitting
+
+    Used while the Gemini circuit breaker is open. The result has the shape
+    of a GeminiOCREnriched page ({"text", "quiz": {"questions"}}) with empty
+    enrichment, so the pipeline downstream runs unchanged; the caller flags
+    the questions for re-enrichment.
+
+    Args:
+        pdf_processor: PDFProcessor with the document open
+        page_num: Page number
+        page_image: Rendered page (for Tesseract)
+        text_layout: extract_text_layout() result, if already computed
+        use_text_layer: The text layer is reliable enough to skip OCR
+
+    Returns:
+        Page data with the text and regex-split questions
+    """
+    text, source = _page_text(pdf_processor, page_num, page_image, text_layout, use_text_layer)
+
+    questions = split_questions(text)
+    for question in questions:
+        question['enrichment'] = {}
+    print(f"  ↓ Degraded mode: {len(text)} chars from {source}, {len(questions)} question(s) split locally")
+    return {'text': text, 'quiz': {'questions': questions}}
+
+
+def extract_answers_locally(
+    pdf_processor,
+    page_num: int,
+    page_image: np.ndarray,
+    text_layout: Optional[Dict] = None,
+    use_text_layer: bool = False,
+) -> Dict:
+    """
+    Process an answer page without Gemini: its text split into answers per question and part
+
+    The answers-PDF counterpart of extract_page_locally. The result has the
+    shape of a GeminiAnswerParser page ({"paper_section", "answers"}); each
+    part's working is kept line by line as its steps, without a final answer.
+
+    Args:
+        pdf_processor: PDFProcessor with the document open
+        page_num: Page number
+        page_image: Rendered page (for Tesseract)
+        text_layout: extract_text_layout() result, if already computed
+        use_text_layer: The text layer is reliable enough to skip OCR
+
+    Returns:
+        Page data with regex-split answers
+    """
+    text, source = _page_text(pdf_processor, page_num, page_image, text_layout, use_text_layer)
+
+    answers = []
+    for question in split_questions(text):
+        answers.append({
+            'question_num': question['number'],
+            'parts': [
+                {
+                    'part': part['part'],
+                    'steps': [line.strip() for line in part['question_text'].splitlines() if line.strip()],
+                    'final_answer': None,
+                    'marks': part['marks'],
+                    'has_diagram': False,
+                }
+                for part in question['parts']
+            ],
+        })
+    print(f"  ↓ Degraded mode: {len(text)} chars from {source}, {len(answers)} answer(s) split locally")
+    return {'paper_section': None, 'answers': answers}
+
+
+def _page_text(pdf_processor, page_num: int, page_image: np.ndarray, text_layout: Optional[Dict],
+               use_text_layer: bool) -> Tuple[str, str]:
+    """(text of the page, where it came from): the text layer when reliable, Tesseract otherwise"""
+    if use_text_layer:
+        return (text_layout or pdf_processor.extract_text_layout(page_num))['text'], 'text layer'
+    return pdf_processor.extract_text_with_ocr(page_image), 'Tesseract'
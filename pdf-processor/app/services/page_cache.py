@@ -0,0 +1,151 @@
+"""
+Page Render Cache
+Content-addressed on-disk cache of rasterized PDF pages
+"""
+import hashlib
+import os
+import shutil
+import uuid
+import cv2
+import numpy as np
+from pathlib import Path
+from typing import Optional
+
+
+# Eviction frees space down to this share of max_bytes, so a full cache isn't rescanned on every store
+EVICT_TO = 0.9
+
+
+class PageRenderCache:
+    """
+    Cache rendered pages keyed by (sha256 of PDF bytes, page index, DPI, colorspace)
+
+    Entries are stored as the same PNG that is written to page_N.png, so a hit
+    costs one file copy and one PNG decode instead of a render and an encode.
+    The cache is bounded by max_bytes and evicts least recently used entries
+    (by mtime, refreshed on every hit). The directory is scanned once and
+    then only when a running estimate of its size goes over the bound. It
+    is safe to share between the render worker processes: writes are
+    atomic renames and eviction tolerates files disappearing underneath it.
+    Each process's estimate only counts its own writes, so the directory can
+    briefly exceed max_bytes by what the other workers stored since their
+    last scan.
+    """
+
+    def __init__(self, cache_dir: str = "./output/cache/pages", max_bytes: int = 2 * 1024 ** 3):
+        """
+        Initialize the page cache
+
+        Args:
+            cache_dir: Directory holding cached page PNGs
+            max_bytes: Size bound of the cache directory (default: 2 GB)
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        # Estimated size of the cache directory (None until the first scan)
+        self._approx_bytes = None
+
+    @staticmethod
+    def hash_pdf(pdf_path: str) -> str:
+        """Return the sha256 hex digest of a PDF's bytes"""
+        digest = hashlib.sha256()
+        with open(pdf_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _entry_path(self, pdf_hash: str, page_index: int, dpi: int, colorspace: str) -> Path:
+        return self.cache_dir / pdf_hash[:2] / f"{pdf_hash}_p{page_index}_{dpi}dpi_{colorspace}.png"
+
+    def fetch(
+        self, pdf_hash: str, page_index: int, dpi: int, colorspace: str, dest_path: Path
+    ) -> Optional[np.ndarray]:
+        """
+        Look up a rendered page
+
+        On a hit the cached PNG is copied to dest_path (the page_N.png the
+        pipeline expects) and decoded.
+
+        Args:
+            pdf_hash: sha256 of the PDF bytes (see hash_pdf)
+            page_index: 0-indexed page number
+            dpi: Render resolution
+            colorspace: Render colorspace name
+            dest_path: Where the page PNG should be written
+
+        Returns:
+            Page image as numpy array, or None on a miss
+        """
+        entry = self._entry_path(pdf_hash, page_index, dpi, colorspace)
+        # Check first: OpenCV warns on stderr for every missing file it is asked to read
+        if not entry.exists():
+            return None
+        try:
+            img = cv2.imread(str(entry), cv2.IMREAD_UNCHANGED)
+            if img is None:
+                return None  # Corrupt entry
+            os.utime(entry)  # Mark as recently used
+            shutil.copyfile(entry, dest_path)
+        except OSError:
+            return None
+
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        return img
+
+    def store(
+        self, pdf_hash: str, page_index: int, dpi: int, colorspace: str, source_path: Path
+    ):
+        """
+        Add an already written page PNG to the cache, evicting if it grows past the size bound
+
+        Args:
+            pdf_hash: sha256 of the PDF bytes (see hash_pdf)
+            page_index: 0-indexed page number
+            dpi: Render resolution
+            colorspace: Render colorspace name
+            source_path: The page PNG to cache
+        """
+        entry = self._entry_path(pdf_hash, page_index, dpi, colorspace)
+        tmp_path = entry.with_name(f".{entry.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            entry.parent.mkdir(exist_ok=True)
+            shutil.copyfile(source_path, tmp_path)
+            added = tmp_path.stat().st_size
+            try:
+                added -= entry.stat().st_size  # Replacing an entry
+            except OSError:
+                pass
+            os.replace(tmp_path, entry)
+        except OSError as e:
+            print(f"  ⚠ Warning: Unable to cache page {page_index + 1}: {e}")
+            tmp_path.unlink(missing_ok=True)
+            return
+        if self._approx_bytes is not None:
+            self._approx_bytes += added
+        if self._approx_bytes is None or self._approx_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Measure the cache and, if it exceeds max_bytes, delete least recently used
+        entries until it fits in EVICT_TO of it
+        """
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob('*/*.png'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                path.unlink(missing_ok=True)
+                total -= size
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+        self._approx_bytes = total
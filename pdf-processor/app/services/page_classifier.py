@@ -0,0 +1,148 @@
+"""
+Page Classifier Service
+Fast local detection of blank, cover and instruction pages so they can skip the paid Gemini calls
+"""
+import math
+import re
+import cv2
+import numpy as np
+from typing import Dict
+from app.services.question_segmenter import QUESTION_START
+
+
+# "BLANK PAGE", "This page is intentionally left blank"
+BLANK_PAGE_PATTERN = re.compile(r'blank\s+page|intentionally\s+(?:left\s+)?blank', re.IGNORECASE)
+
+COVER_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE) for pattern in (
+        r'read\s+these\s+instructions\s+first',
+        r'instructions\s+to\s+candidates',
+        r'do\s+not\s+(?:open|turn\s+over)\s+this\s+(?:booklet|paper|page)',
+        r'this\s+(?:document|question\s+paper)\s+consists\s+of',
+        r'candidate\s+(?:name|number)|index\s+number',
+        r'for\s+examiner\'?s\s+use',
+    )
+]
+
+INSTRUCTION_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE) for pattern in (
+        r'answer\s+all\s+(?:the\s+)?questions',
+        r'write\s+your\s+(?:name|answers)',
+        r'the\s+number\s+of\s+marks\s+is\s+given',
+        r'calculators?\s+(?:may|should|must)\s+be\s+used',
+        r'show\s+all\s+(?:your\s+)?(?:necessary\s+)?working',
+    )
+]
+
+# Mark allocations such as "[2]", "[2 marks]" or "(2 marks)" only appear on pages that contain questions
+QUESTION_MARK_PATTERN = re.compile(
+    r'\[\s*\d{1,2}\s*(?:marks?\s*)?\]|\(\s*\d{1,2}\s*marks?\s*\)', re.IGNORECASE
+)
+
+# Cover and instruction keywords only skip pages with less text than this (non-space characters):
+# first pages often carry the instructions and the first questions
+MAX_SKIPPED_TEXT_CHARS = 1500
+
+# Below this many non-space characters the text layer says nothing about the page (scans,
+# outlined text) and the ink measurement decides whether it is blank
+MIN_TEXT_LAYER_CHARS = 20
+
+
+def calls_avoided(page_count: int, skipped_count: int, pages_per_call: int) -> int:
+    """
+    Gemini calls saved by skipping pages of a window sent pages_per_call pages at a time
+
+    With multi-page calls skipping a page only saves a call when the
+    remaining pages fit in fewer batches: 3 skipped pages of a 5-page window
+    sent 5 per call save nothing.
+
+    Args:
+        page_count: Pages in the window
+        skipped_count: Pages of the window that were skipped
+        pages_per_call: Pages sent per Gemini call (batch_size)
+
+    Returns:
+        Number of calls avoided
+    """
+    pages_per_call = max(1, pages_per_call)
+    return math.ceil(page_count / pages_per_call) - math.ceil((page_count - skipped_count) / pages_per_call)
+
+
+class PageClassifier:
+    """Classify pages as blank / cover / instructions / content before any LLM call"""
+
+    def __init__(self, blank_ink_ratio: float = 0.001, thumbnail_width: int = 200):
+        """
+        Initialize the page classifier
+
+        Args:
+            blank_ink_ratio: Pages without a text layer and less inked-cell share than this are blank
+            thumbnail_width: Number of cells across the page ink is measured on
+        """
+        self.blank_ink_ratio = blank_ink_ratio
+        self.thumbnail_width = thumbnail_width
+
+    def ink_density(self, page_image: np.ndarray) -> float:
+        """
+        Share of page cells (thumbnail_width across) that hold any dark pixel
+
+        Each cell keeps its darkest pixel (a min-pool), so thin strokes still
+        count; averaging the cell would wash a line of text out to near white.
+
+        Args:
+            page_image: Page image as numpy array (RGB or grayscale)
+
+        Returns:
+            Ink density between 0 and 1
+        """
+        gray = page_image
+        if gray.ndim == 3:
+            gray = cv2.cvtColor(gray, cv2.COLOR_RGBA2GRAY if gray.shape[2] == 4 else cv2.COLOR_RGB2GRAY)
+        height, width = gray.shape
+        cell = max(1, -(-width // self.thumbnail_width))
+        rows, cols = -(-height // cell), -(-width // cell)
+        # Pad with white up to whole cells, then take the minimum of each cell's rows, then columns
+        padded = np.full((rows * cell, cols * cell), 255, dtype=gray.dtype)
+        padded[:height, :width] = gray
+        cells = padded.reshape(rows, cell, cols * cell).min(axis=1).reshape(rows, cols, cell).min(axis=2)
+        return float(np.count_nonzero(cells < 160)) / cells.size
+
+    def classify(self, page_image: np.ndarray, page_text: str = "") -> Dict:
+        """
+        Decide whether a page can skip question extraction
+
+        Pages whose text layer shows mark allocations or question numbers are
+        always content. Ink only decides on pages without a usable text
+        layer, and cover and instruction keywords only skip short pages, so
+        a sparse page with one question or a first page that also carries
+        questions 1-3 is kept.
+
+        Args:
+            page_image: Page image as numpy array (RGB or grayscale)
+            page_text: Text layer of the page, if any
+
+        Returns:
+            Dictionary with label ('blank', 'cover', 'instructions' or 'content'),
+            skip flag, reason and measured ink density
+        """
+        ink = self.ink_density(page_image)
+        has_question_marks = bool(QUESTION_MARK_PATTERN.search(page_text))
+
+        def result(label, reason):
+            return {'label': label, 'skip': label != 'content', 'reason': reason, 'ink': round(ink, 4)}
+
+        if has_question_marks:
+            return result('content', "mark allocations found")
+        if BLANK_PAGE_PATTERN.search(page_text):
+            return result('blank', "blank page notice")
+        if QUESTION_START.search(page_text):
+            return result('content', "question numbers found")
+        if len(re.sub(r'\s', '', page_text)) < MIN_TEXT_LAYER_CHARS and ink < self.blank_ink_ratio:
+            return result('blank', f"ink density {ink:.4f}")
+        if len(re.sub(r'\s', '', page_text)) >= MAX_SKIPPED_TEXT_CHARS:
+            return result('content', "too much text for a cover or instruction page")
+        if any(pattern.search(page_text) for pattern in COVER_PATTERNS):
+            return result('cover', "cover page keywords")
+        if any(pattern.search(page_text) for pattern in INSTRUCTION_PATTERNS):
+            return result('instructions', "instruction keywords")
+        return result('content', "no skip rule matched")
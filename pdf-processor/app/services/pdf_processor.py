@@ -8,64 +8,356 @@ import cv2
 import numpy as np
 from PIL import Image
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterator, Optional
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import base64
+import threading
 from io import BytesIO
 import pytesseract
 
 
+# Pixel thresholds in the detectors were tuned on pages rendered at this DPI
+REFERENCE_DPI = 300
+
+# Page colorspaces: 'rgb' (H x W x 3), 'gray' and 'binary' (single-channel H x W,
+# binary pages only hold 0 / 255 and are stored as packed 1-bit PNGs)
+COLORSPACES = ('rgb', 'gray', 'binary')
+
+# Pages whose text layer scores at least this (see extract_text_layout) skip OCR entirely
+TEXT_LAYER_MIN_QUALITY = 0.8
+# Text layers with fewer non-space characters never count as a transcription (blank pages,
+# outlined/vector text, scans without an OCR layer, stray labels)
+TEXT_LAYER_MIN_CHARS = 20
+
+# Text layer flags: everything "dict" extracts except embedded image data
+_TEXT_LAYOUT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+
+def _render_page(page, dpi: int, clip=None, colorspace: str = 'rgb') -> np.ndarray:
+    """Rasterize a single fitz page (or a clip of it, in PDF points) to a numpy array"""
+    # High resolution for better diagram quality
+    mat = fitz.Matrix(dpi / 72, dpi / 72)
+    if colorspace == 'rgb':
+        pix = page.get_pixmap(matrix=mat, clip=clip)
+    else:
+        # Render single-channel straight from fitz instead of converting RGB afterwards
+        pix = page.get_pixmap(matrix=mat, clip=clip, colorspace=fitz.csGRAY, alpha=False)
+    
+    # Convert to numpy array
+    img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(
+        pix.height, pix.width, pix.n
+    )
+    
+    if pix.n == 1:
+        img = img.reshape(pix.height, pix.width)
+        if colorspace == 'binary':
+            _, img = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Convert RGBA to RGB if needed
+    elif img.shape[2] == 4:
+        img = cv2.cvtColor(img, cv2.COLOR_RGBA2RGB)
+    return img
+
+
+def _save_page_image(img: np.ndarray, page_number: int, output_dir: Path, colorspace: str = 'rgb'):
+    """Save full page image for fallback diagram usage"""
+    try:
+        page_image_path = output_dir / f"page_{page_number}.png"
+        if colorspace == 'binary':
+            # Boolean arrays become mode '1' images, written as packed 1-bit PNGs
+            Image.fromarray(img > 127).save(page_image_path)
+        else:
+            Image.fromarray(img).save(page_image_path)
+    except Exception as e:
+        print(f"  ⚠ Warning: Unable to save page image {page_number}: {e}")
+
+
+def _load_or_render_page(
+    doc, page_index: int, dpi: int, output_dir: Path, page_cache=None, pdf_hash: str = None,
+    colorspace: str = 'rgb'
+) -> Tuple[np.ndarray, bool]:
+    """
+    Produce page_index of doc as an image and as page_N.png in output_dir
+    
+    Served from the page cache when possible, otherwise rendered and added to it.
+    
+    Returns:
+        (image, served_from_cache)
+    """
+    page_number = page_index + 1
+    page_image_path = output_dir / f"page_{page_number}.png"
+    if page_cache is not None:
+        img = page_cache.fetch(pdf_hash, page_index, dpi, colorspace, page_image_path)
+        if img is not None:
+            return img, True
+    
+    img = _render_page(doc[page_index], dpi, colorspace=colorspace)
+    _save_page_image(img, page_number, output_dir, colorspace)
+    if page_cache is not None and page_image_path.exists():
+        page_cache.store(pdf_hash, page_index, dpi, colorspace, page_image_path)
+    return img, False
+
+
+def _render_page_range(
+    pdf_path: str, start: int, stop: int, dpi: int, output_dir: Path,
+    page_cache=None, pdf_hash: str = None, colorspace: str = 'rgb'
+) -> List[Tuple[int, np.ndarray, bool]]:
+    """
+    Worker entry point: render pages [start, stop) from a privately opened document
+    
+    Runs in a separate process, so it opens its own fitz document and also
+    encodes the page PNGs there, off the main process.
+    """
+    pages = []
+    with fitz.open(pdf_path) as doc:
+        for page_index in range(start, stop):
+            img, cached = _load_or_render_page(
+                doc, page_index, dpi, output_dir, page_cache, pdf_hash, colorspace
+            )
+            pages.append((page_index + 1, img, cached))
+    return pages
+
+
 class PDFProcessor:
     """Process PDF files and extract regions"""
     
-    def __init__(self, output_dir: str = "./output", dpi: int = 300, gemini_ocr=None):
+    def __init__(
+        self,
+        output_dir: str = "./output",
+        dpi: int = 300,
+        gemini_ocr=None,
+        render_workers: int = 1,
+        render_chunk_size: int = 2,
+        analysis_dpi: Optional[int] = None,
+        page_cache=None,
+        colorspace: str = 'rgb',
+    ):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
         self.dpi = dpi
+        # Two-resolution mode: pages are rendered at analysis_dpi for detection and
+        # Gemini, and only diagram crops are re-rendered at dpi (see render_region)
+        self.analysis_dpi = analysis_dpi if analysis_dpi and analysis_dpi < dpi else None
         self.pdf_doc = None
+        # fitz documents aren't thread-safe: hold this while using pdf_doc or a page from get_page()
+        # (the diagram worker reads the document while the main thread renders and extracts text)
+        self.doc_lock = threading.RLock()
         self.gemini_ocr = gemini_ocr  # Optional Gemini OCR instance
+        # Rasterize in worker processes when > 1; each worker renders render_chunk_size pages at a time
+        self.render_workers = max(1, render_workers)
+        self.render_chunk_size = max(1, render_chunk_size)
+        # Optional PageRenderCache; rendered pages are reused across runs of the same PDF
+        self.page_cache = page_cache
+        # 'gray' / 'binary' render single-channel pages for text-dominant papers (~3x less memory)
+        if colorspace not in COLORSPACES:
+            raise ValueError(f"colorspace must be one of {COLORSPACES}, got {colorspace!r}")
+        self.colorspace = colorspace
+    
+    @property
+    def render_dpi(self) -> int:
+        """DPI of the page images handed to detectors and Gemini"""
+        return self.analysis_dpi or self.dpi
+    
+    @property
+    def pixel_scale(self) -> float:
+        """Scale of rendered page pixels relative to REFERENCE_DPI"""
+        return self.render_dpi / REFERENCE_DPI
         
-    def pdf_to_images(self, pdf_path: str) -> List[np.ndarray]:
+    def get_page_count(self, pdf_path: str) -> int:
         """
-        Convert PDF pages to high-resolution images
+        Count the pages of a PDF without rendering anything
         
         Args:
             pdf_path: Path to PDF file
             
         Returns:
-            List of page images as numpy arrays
+            Number of pages in the document
         """
-        print(f"Converting PDF to images...")
-        self.pdf_doc = fitz.open(pdf_path)  # Store for text extraction
-        images = []
-        
-        for page_num in range(len(self.pdf_doc)):
-            page = self.pdf_doc[page_num]
-            # High resolution for better diagram quality
-            mat = fitz.Matrix(self.dpi / 72, self.dpi / 72)
-            pix = page.get_pixmap(matrix=mat)
+        with fitz.open(pdf_path) as doc:
+            return len(doc)
+    
+    def iter_pages(self, pdf_path: str) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Render PDF pages lazily, one page at a time
+        
+        Only the page currently being consumed is held in memory, so peak
+        memory no longer grows with the length of the document. Each page
+        is still saved as page_N.png for fallback diagram usage. With
+        render_workers > 1, pages are rasterized ahead in worker processes
+        and still yielded in page order. With a page_cache, pages already
+        rendered for the same PDF bytes and DPI are loaded instead.
+        
+        Args:
+            pdf_path: Path to PDF file
             
-            # Convert to numpy array
-            img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(
-                pix.height, pix.width, pix.n
-            )
+        Yields:
+            (page_number, image) tuples, page_number is 1-indexed
+        """
+        self.close()
+        with self.doc_lock:
+            self.pdf_doc = fitz.open(pdf_path)  # Store for text extraction
+        page_count = len(self.pdf_doc)
+        pdf_hash = self.page_cache.hash_pdf(pdf_path) if self.page_cache is not None else None
+        
+        if self.render_workers > 1 and page_count > 1:
+            pages = self._iter_pages_parallel(pdf_path, page_count, pdf_hash)
+        else:
+            pages = self._iter_pages_serial(page_count, pdf_hash)
+        
+        for page_number, img, cached in pages:
+            cache_note = " (cached)" if cached else ""
+            print(f"  Page {page_number}: {img.shape[1]}x{img.shape[0]}{cache_note}")
+            yield page_number, img
+            # Drop our reference so the page can be freed before the next render
+            del img
+    
+    def _iter_pages_serial(
+        self, page_count: int, pdf_hash: str = None
+    ) -> Iterator[Tuple[int, np.ndarray, bool]]:
+        """Render pages one by one in this process"""
+        for page_index in range(page_count):
+            with self.doc_lock:
+                img, cached = _load_or_render_page(
+                    self.pdf_doc, page_index, self.render_dpi, self.output_dir, self.page_cache, pdf_hash,
+                    self.colorspace
+                )
+            yield page_index + 1, img, cached
+            del img
+    
+    def _iter_pages_parallel(
+        self, pdf_path: str, page_count: int, pdf_hash: str = None
+    ) -> Iterator[Tuple[int, np.ndarray, bool]]:
+        """
+        Render page ranges across worker processes, yielding pages in order
+        
+        At most render_workers chunks are in flight, so memory stays bounded
+        by render_workers * render_chunk_size pages.
+        """
+        chunk = self.render_chunk_size
+        ranges = iter([
+            (start, min(start + chunk, page_count))
+            for start in range(0, page_count, chunk)
+        ])
+        print(f"  Rendering with {self.render_workers} worker processes...")
+        
+        with ProcessPoolExecutor(max_workers=self.render_workers) as pool:
+            pending = deque()
             
-            # Convert RGBA to RGB if needed
-            if img.shape[2] == 4:
-                img = cv2.cvtColor(img, cv2.COLOR_RGBA2RGB)
+            def submit_next():
+                page_range = next(ranges, None)
+                if page_range is not None:
+                    pending.append(pool.submit(
+                        _render_page_range, pdf_path, *page_range, self.render_dpi, self.output_dir,
+                        self.page_cache, pdf_hash, self.colorspace
+                    ))
+            
+            for _ in range(self.render_workers):
+                submit_next()
             
-            images.append(img)
-
-            # Save full page image for fallback diagram usage
             try:
-                page_image_path = self.output_dir / f"page_{page_num + 1}.png"
-                Image.fromarray(img).save(page_image_path)
-            except Exception as e:
-                print(f"  ⚠ Warning: Unable to save page image {page_num + 1}: {e}")
-            print(f"  Page {page_num + 1}: {img.shape[1]}x{img.shape[0]}")
+                while pending:
+                    pages = pending.popleft().result()
+                    submit_next()
+                    yield from pages
+                    del pages
+            finally:
+                # Consumer stopped early: don't render pages nobody will read
+                for future in pending:
+                    future.cancel()
+    
+    def iter_page_batches(
+        self, pdf_path: str, batch_size: int
+    ) -> Iterator[List[Tuple[int, np.ndarray]]]:
+        """
+        Render PDF pages lazily in groups of batch_size
+        
+        Args:
+            pdf_path: Path to PDF file
+            batch_size: Maximum number of pages per batch
+            
+        Yields:
+            Lists of (page_number, image) tuples
+        """
+        batch = []
+        for page in self.iter_pages(pdf_path):
+            batch.append(page)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    def pdf_to_images(self, pdf_path: str) -> List[np.ndarray]:
+        """
+        Convert PDF pages to high-resolution images
+        
+        Materializes every page in memory; prefer iter_pages for long documents.
+        
+        Args:
+            pdf_path: Path to PDF file
+            
+        Returns:
+            List of page images as numpy arrays
+        """
+        print(f"Converting PDF to images...")
+        images = [img for _, img in self.iter_pages(pdf_path)]
         
         print(f"✓ Converted {len(images)} pages\n")
         return images
     
+    def get_page(self, page_number: int):
+        """Return the fitz page (1-indexed) of the currently open PDF (use it while holding doc_lock)"""
+        return self.pdf_doc[page_number - 1]
+    
+    def render_region(self, page_number: int, bbox: Tuple[int, int, int, int]) -> np.ndarray:
+        """
+        Re-render a region of a page at full DPI
+        
+        Used in two-resolution mode so diagram crops keep full quality even
+        though detection ran on the low-DPI preview.
+        
+        Args:
+            page_number: Page number (1-indexed) of the currently open PDF
+            bbox: (x1, y1, x2, y2) in rendered page pixels (render_dpi)
+            
+        Returns:
+            Region image as numpy array at self.dpi (grayscale unless pages are RGB)
+        """
+        to_points = 72 / self.render_dpi
+        x1, y1, x2, y2 = bbox
+        # Binary is only for analysis; crops shown to students stay anti-aliased
+        crop_colorspace = 'rgb' if self.colorspace == 'rgb' else 'gray'
+        with self.doc_lock:
+            page = self.pdf_doc[page_number - 1]
+            clip = fitz.Rect(x1 * to_points, y1 * to_points, x2 * to_points, y2 * to_points) & page.rect
+            return _render_page(page, self.dpi, clip=clip, colorspace=crop_colorspace)
+    
+    def crop_page_region(
+        self, page_image: np.ndarray, page_number: int, bbox: Tuple[int, int, int, int]
+    ) -> np.ndarray:
+        """
+        Crop (x1, y1, x2, y2) from a rendered page, at full DPI when possible
+        
+        Args:
+            page_image: Rendered page image the bbox refers to
+            page_number: Page number (1-indexed)
+            bbox: (x1, y1, x2, y2) in page_image pixels
+            
+        Returns:
+            Cropped image as numpy array
+        """
+        if self.analysis_dpi and self.pdf_doc is not None:
+            return self.render_region(page_number, bbox)
+        x1, y1, x2, y2 = bbox
+        return page_image[y1:y2, x1:x2]
+    
+    def close(self):
+        """Close the currently open PDF document, if any"""
+        with self.doc_lock:
+            if self.pdf_doc is not None:
+                self.pdf_doc.close()
+                self.pdf_doc = None
+    
     def extract_text_from_page(self, page_num: int) -> str:
         """
         Extract text from a PDF page
@@ -80,19 +372,137 @@ class PDFProcessor:
             return ""
         
         try:
-            page = self.pdf_doc[page_num - 1]
-            text = page.get_text()
+            with self.doc_lock:
+                text = self.pdf_doc[page_num - 1].get_text()
             return text.strip()
         except Exception as e:
             print(f"Error extracting text from page {page_num}: {e}")
             return ""
     
+    def extract_text_layout(self, page_num: int) -> Dict:
+        """
+        Extract the PDF text layer with its layout and score its quality
+        
+        Coordinates are in pixels of the rendered page (render_dpi), the same
+        space as the page images and the diagram detectors.
+        
+        The quality score (0-1) estimates whether the text layer alone is a
+        complete, readable transcription of the page:
+        - readable: share of characters that are not broken glyphs
+          (U+FFFD, private-use or control characters from bad font encodings)
+        - coverage: pages mostly covered by raster images (scans) only count as
+          complete when they also carry a substantial (OCR'd) text layer
+        - layers with fewer than TEXT_LAYER_MIN_CHARS characters score 0, whatever
+          the coverage: the content must be somewhere else (outlines, pixels)
+        
+        Args:
+            page_num: Page number (1-indexed)
+            
+        Returns:
+            Dictionary with 'text', 'lines' (text, bbox, spans with text/bbox/size/font)
+            and 'quality'
+        """
+        layout = {'text': '', 'lines': [], 'quality': 0.0}
+        if self.pdf_doc is None:
+            return layout
+        
+        try:
+            with self.doc_lock:
+                page = self.pdf_doc[page_num - 1]
+                data = page.get_text("dict", flags=_TEXT_LAYOUT_FLAGS)
+                page_rect = page.rect
+                image_boxes = [info['bbox'] for info in page.get_image_info()]
+        except Exception as e:
+            print(f"Error extracting text layout from page {page_num}: {e}")
+            return layout
+        
+        scale = self.render_dpi / 72
+        
+        def to_pixels(bbox):
+            return tuple(int(round(v * scale)) for v in bbox)
+        
+        lines = []
+        for block in data.get('blocks', []):
+            for line in block.get('lines', []):
+                spans = [
+                    {
+                        'text': span['text'],
+                        'bbox': to_pixels(span['bbox']),
+                        'size': span['size'],
+                        'font': span['font'],
+                    }
+                    for span in line.get('spans', []) if span['text'].strip()
+                ]
+                if spans:
+                    lines.append({
+                        'text': ''.join(span['text'] for span in spans).strip(),
+                        'bbox': to_pixels(line['bbox']),
+                        'spans': spans,
+                    })
+        
+        text = '\n'.join(line['text'] for line in lines)
+        chars = [c for c in text if not c.isspace()]
+        broken = sum(
+            1 for c in chars
+            if c == '\ufffd' or '\ue000' <= c <= '\uf8ff' or ord(c) < 32
+        )
+        readable = 1.0 - broken / len(chars) if chars else 1.0
+        
+        page_area = page_rect.width * page_rect.height
+        image_area = sum((fitz.Rect(bbox) & page_rect).get_area() for bbox in image_boxes)
+        image_coverage = min(image_area / page_area, 1.0) if page_area > 0 else 0.0
+        # 100+ characters was the old "enough text" threshold
+        density = min(len(chars) / 100, 1.0)
+        
+        layout['text'] = text
+        layout['lines'] = lines
+        if len(chars) < TEXT_LAYER_MIN_CHARS:
+            layout['quality'] = 0.0
+        else:
+            layout['quality'] = round(readable * max(density, 1.0 - image_coverage), 3)
+        return layout
+    
+    def extract_words(self, page_num: int) -> List[Dict]:
+        """
+        Extract the words of the PDF text layer with their positions
+        
+        Args:
+            page_num: Page number (1-indexed)
+            
+        Returns:
+            List of {'text', 'bbox', 'block', 'line'} in reading order,
+            bbox in rendered page pixels
+        """
+        if self.pdf_doc is None:
+            return []
+        
+        scale = self.render_dpi / 72
+        words = []
+        try:
+            with self.doc_lock:
+                page_words = self.pdf_doc[page_num - 1].get_text("words")
+            for x0, y0, x1, y1, word, block_no, line_no, _ in page_words:
+                words.append({
+                    'text': word,
+                    'bbox': (int(round(x0 * scale)), int(round(y0 * scale)),
+                             int(round(x1 * scale)), int(round(y1 * scale))),
+                    'block': block_no,
+                    'line': line_no,
+                })
+        except Exception as e:
+            print(f"Error extracting words from page {page_num}: {e}")
+        return words
+    
+    def needs_ocr(self, page_num: int) -> bool:
+        """Return True when the page's text layer is missing or unreliable"""
+        return self.extract_text_layout(page_num)['quality'] < TEXT_LAYER_MIN_QUALITY
+    
     def extract_text_with_ocr(self, page_image: np.ndarray) -> str:
         """
         Extract text from page image using OCR
         
         Args:
-            page_image: Page image as numpy array (RGB)
+            page_image: Page image as numpy array (RGB or grayscale)
             
         Returns:
             Extracted text content
@@ -138,9 +548,12 @@ class PDFProcessor:
             Dictionary with text_blocks, diagram_blocks, and mixed_blocks
         """
         print("Detecting regions...")
+        # Thresholds below are tuned at REFERENCE_DPI; scale them to the rendered resolution
+        scale = self.pixel_scale
+        area_scale = scale * scale
         
-        # Convert to grayscale
-        gray = cv2.cvtColor(page_image, cv2.COLOR_RGB2GRAY)
+        # Convert to grayscale (single-channel pages are used as-is)
+        gray = page_image if page_image.ndim == 2 else cv2.cvtColor(page_image, cv2.COLOR_RGB2GRAY)
         
         # Reduce noise while preserving edges
         blurred = cv2.GaussianBlur(gray, (5, 5), 0)
@@ -173,7 +586,7 @@ class PDFProcessor:
             edge_density = edge_pixels / float(w * h) if w * h > 0 else 0
             
             # Filter out very small regions (noise)
-            if area < 2000:
+            if area < 2000 * area_scale:
                 continue
             
             # Classify region based on heuristics
@@ -187,7 +600,7 @@ class PDFProcessor:
             # Diagrams tend to be larger with substantial edge density
             # OPTIMIZED: Lowered thresholds to catch smaller diagrams (like Q24-27)
             if (
-                area > 10000  # Reduced from 20000 to catch smaller diagrams
+                area > 10000 * area_scale  # Reduced from 20000 to catch smaller diagrams
                 and 0.2 < aspect_ratio < 4.0  # Widened aspect ratio range
                 and edge_density > 0.005  # Reduced edge density threshold
                 and contour_area / area < 0.95  # Relaxed fill ratio
@@ -205,22 +618,23 @@ class PDFProcessor:
                 edges,
                 rho=1,
                 theta=np.pi / 180,
-                threshold=80,  # Reduced from 150 to detect more lines
-                minLineLength=80,  # Reduced from 150
-                maxLineGap=30  # Increased from 20 for better connectivity
+                threshold=max(1, int(80 * scale)),  # Reduced from 150 to detect more lines
+                minLineLength=80 * scale,  # Reduced from 150
+                maxLineGap=30 * scale  # Increased from 20 for better connectivity
             )
             if lines is not None and len(lines) > 5:  # Need at least 5 lines for a diagram
                 xs, ys = [], []
                 for x1, y1, x2, y2 in lines[:, 0]:
                     xs.extend([x1, x2])
                     ys.extend([y1, y2])
-                min_x, max_x = max(min(xs) - 40, 0), min(max(xs) + 40, page_image.shape[1])
-                min_y, max_y = max(min(ys) - 40, 0), min(max(ys) + 40, page_image.shape[0])
+                pad = int(40 * scale)
+                min_x, max_x = max(min(xs) - pad, 0), min(max(xs) + pad, page_image.shape[1])
+                min_y, max_y = max(min(ys) - pad, 0), min(max(ys) + pad, page_image.shape[0])
                 w = max_x - min_x
                 h = max_y - min_y
                 area = w * h
                 # More lenient area check
-                if area > 8000 and w > 100 and h > 100:
+                if area > 8000 * area_scale and w > 100 * scale and h > 100 * scale:
                     regions['diagram_blocks'].append({
                         'bbox': {'x': int(min_x), 'y': int(min_y), 'width': int(w), 'height': int(h)},
                         'area': int(area),
@@ -251,7 +665,10 @@ class PDFProcessor:
     def image_to_base64(self, image: np.ndarray) -> str:
         """Convert numpy image to base64 string"""
         # Convert to PIL Image
-        pil_img = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+        if image.ndim == 2:
+            pil_img = Image.fromarray(image)
+        else:
+            pil_img = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
         
         # Convert to base64
         buffered = BytesIO()
@@ -272,7 +689,10 @@ class PDFProcessor:
             Path to saved file
         """
         output_path = self.output_dir / filename
-        cv2.imwrite(str(output_path), cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+        if image.ndim == 2:
+            cv2.imwrite(str(output_path), image)
+        else:
+            cv2.imwrite(str(output_path), cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
         return str(output_path)
     
     def process_page(self, page_image: np.ndarray, page_num: int) -> Dict:
@@ -293,10 +713,12 @@ class PDFProcessor:
         page_path = self.save_image(page_image, page_filename)
         
         # Extract text from PDF (try direct extraction first)
-        page_text = self.extract_text_from_page(page_num)
+        layout = self.extract_text_layout(page_num)
+        page_text = layout['text']
+        text_layer_ok = layout['quality'] >= TEXT_LAYER_MIN_QUALITY
         
-        # If minimal text found, use OCR on the image
-        if len(page_text) < 100:  # Threshold for "minimal text"
+        # If the text layer is missing or unreliable, use OCR on the image
+        if not text_layer_ok:
             # Try Gemini OCR first (better for math), fallback to Tesseract
             if self.gemini_ocr:
                 print(f"  Minimal text extracted ({len(page_text)} chars), running Gemini Vision OCR...")
@@ -318,12 +740,17 @@ class PDFProcessor:
                     page_text = ocr_text
                     print(f"  ✓ Tesseract OCR extracted {len(page_text)} characters")
         else:
-            print(f"  ✓ Extracted {len(page_text)} characters from PDF")
+            print(f"  ✓ Extracted {len(page_text)} characters from PDF text layer "
+                  f"(quality {layout['quality']:.2f}), no OCR needed")
         
         # Extract structured questions using Gemini if available (OPTIMIZED: Single API call)
         questions_text = ""
         quiz_data = ""
-        if self.gemini_ocr:
+        if self.gemini_ocr and text_layer_ok:
+            # Text layer is already a complete transcription: ask Gemini for the quiz only
+            print(f"  🚀 Text layer complete: Gemini quiz extraction without OCR...")
+            quiz_data = self.gemini_ocr.extract_quiz_with_answers(page_image)
+        elif self.gemini_ocr:
             print(f"  🚀 OPTIMIZED: Single Gemini API call for OCR + Quiz...")
             try:
                 gemini_text, quiz_data = self.gemini_ocr.extract_text_and_quiz(page_image)
@@ -344,7 +771,11 @@ class PDFProcessor:
         # Extract and save diagram crops
         diagram_crops = []
         for idx, diagram_region in enumerate(regions['diagram_blocks']):
-            cropped = self.crop_region(page_image, diagram_region['bbox'])
+            bbox = diagram_region['bbox']
+            cropped = self.crop_page_region(
+                page_image, page_num,
+                (bbox['x'], bbox['y'], bbox['x'] + bbox['width'], bbox['y'] + bbox['height'])
+            )
             crop_filename = f"page_{page_num}_diagram_{idx}.png"
             crop_path = self.save_image(cropped, crop_filename)
             
@@ -379,14 +810,12 @@ class PDFProcessor:
         print(f"{'='*50}\n")
         
         try:
-            # Convert to images
-            page_images = self.pdf_to_images(pdf_path)
-            
-            # Process each page
+            # Render and process one page at a time
             results = []
-            for idx, page_image in enumerate(page_images):
-                page_data = self.process_page(page_image, idx + 1)
+            for page_num, page_image in self.iter_pages(pdf_path):
+                page_data = self.process_page(page_image, page_num)
                 results.append(page_data)
+                del page_image
             
             print(f"\n{'='*50}")
             print(f"PDF processing complete!")
@@ -396,6 +825,4 @@ class PDFProcessor:
             return results
         finally:
             # Close PDF document
-            if hasattr(self, 'pdf_doc') and self.pdf_doc is not None:
-                self.pdf_doc.close()
-                self.pdf_doc = None
+            self.close()
@@ -0,0 +1,181 @@
+"""
+Question Segmenter Service
+Cut exam pages into per-question regions at their question-number anchors, before any Gemini call
+"""
+import re
+import numpy as np
+import pytesseract
+from PIL import Image
+from typing import Dict, List, Optional
+
+
+# Question and part numbers, shared with the page classifier and local extraction.
+# "3", "3.", "3)", "Q3", "Question 3" at the start of a line
+_QUESTION_NUMBER = r'^[ \t]*(?:Q(?:uestion)?[ \t]*)?(\d{1,2})[.)]?'
+# ... followed by the question text, not a duration or mark count ("1 hour 30 minutes", "80 marks")
+_QUESTION_TEXT = r'[ \t]+(?!(?:hours?|minutes?|marks?)\b)(?=\S)'
+# A question (or answer) number opening a line of text ("1 Work out", "2. Solve", "Q3 (a)", "4 5x")
+QUESTION_START = re.compile(_QUESTION_NUMBER + _QUESTION_TEXT, re.IGNORECASE | re.MULTILINE)
+# A question number opening a line, followed by its text or alone on the line
+QUESTION_ANCHOR = re.compile(_QUESTION_NUMBER + r'(?:' + _QUESTION_TEXT + r'|[ \t]*$)', re.IGNORECASE | re.MULTILINE)
+# "(b)", "(ii)", "b)" opening a line: a question part (the label is group 1)
+PART_ANCHOR = re.compile(r'^[ \t]*\(?([a-h]|i{1,3}|iv|vi{0,3}|ix|x)\)', re.IGNORECASE | re.MULTILINE)
+
+# Anchors must start within this share of the page width from the leftmost text
+ANCHOR_MARGIN = 0.08
+# Padding above each anchor, in 300 DPI pixels
+REGION_PADDING = 20
+# Regions shorter than this share of the page height are merged into the previous one
+MIN_REGION_HEIGHT = 0.04
+
+# Above the first question number, this much text (non-space characters) or this share of
+# dark pixels is the end of a question continued from the previous page, not a running header
+CONTINUATION_MIN_CHARS = 40
+CONTINUATION_MIN_INK = 0.02
+
+
+def ocr_lines(page_image: np.ndarray) -> List[Dict]:
+    """
+    Text lines of a scanned page with their positions, from a single Tesseract pass
+
+    Returns:
+        List of {'text', 'bbox'} in page pixels, like extract_text_layout()['lines']
+        (empty if Tesseract is unavailable or fails)
+    """
+    try:
+        data = pytesseract.image_to_data(
+            Image.fromarray(page_image), lang='eng', config='--oem 3 --psm 4',
+            output_type=pytesseract.Output.DICT
+        )
+    except Exception as e:
+        print(f"  Warning: OCR layout failed - {e}")
+        return []
+    lines = {}
+    for idx, word in enumerate(data['text']):
+        if not word.strip():
+            continue
+        key = (data['block_num'][idx], data['par_num'][idx], data['line_num'][idx])
+        x, y, w, h = data['left'][idx], data['top'][idx], data['width'][idx], data['height'][idx]
+        line = lines.setdefault(key, {'words': [], 'bbox': [x, y, x + w, y + h]})
+        line['words'].append(word)
+        bbox = line['bbox']
+        line['bbox'] = [min(bbox[0], x), min(bbox[1], y), max(bbox[2], x + w), max(bbox[3], y + h)]
+    return [
+        {'text': ' '.join(line['words']), 'bbox': tuple(line['bbox'])}
+        for line in sorted(lines.values(), key=lambda line: (line['bbox'][1], line['bbox'][0]))
+    ]
+
+
+def find_question_anchors(lines: List[Dict], page_width: int) -> List[Dict]:
+    """
+    Question-number anchors among a page's text lines
+
+    An anchor is a line opening with a question number at the page's left
+    text margin. Numbers must count up by one from the first anchor, so
+    numbered lines inside a question (working, tables, coordinates) aren't
+    taken for new questions.
+
+    Args:
+        lines: Text lines with 'text' and 'bbox' in page pixels
+        page_width: Page width in pixels
+
+    Returns:
+        List of {'number', 'top'} in page order
+    """
+    if not lines:
+        return []
+    left_margin = min(line['bbox'][0] for line in lines)
+    max_x = left_margin + ANCHOR_MARGIN * page_width
+
+    anchors = []
+    for line in sorted(lines, key=lambda line: (line['bbox'][1], line['bbox'][0])):
+        match = QUESTION_ANCHOR.match(line['text'])
+        if not match or line['bbox'][0] > max_x:
+            continue
+        number = int(match.group(1))
+        if number == 0:
+            continue
+        if not anchors or number == anchors[-1]['number'] + 1:
+            anchors.append({'number': number, 'top': line['bbox'][1]})
+    return anchors
+
+
+def segment_questions(
+    page_image: np.ndarray,
+    lines: Optional[List[Dict]] = None,
+    pixel_scale: float = 1.0,
+) -> List[Dict]:
+    """
+    Split a page into one full-width region per question
+
+    Each region runs from just above its question number to just above the
+    next one (the last one to the bottom of the page), so everything
+    in it - stem, parts, diagrams - belongs to that question. Content above
+    the first question number is its own leading region when the page
+    continues a question from the previous one (see has_continuation);
+    otherwise it is a header and is left out.
+
+    Args:
+        page_image: Rendered page
+        lines: Text lines of the page (extract_text_layout()['lines']); None runs Tesseract
+        pixel_scale: Rendered DPI / 300, to scale the padding
+
+    Returns:
+        List of {'number': str, 'bbox': (x1, y1, x2, y2)} in page pixels; empty if no
+        question numbers were found (the caller should send the whole page). A leading
+        continuation region also has 'continuation': True and the previous question's number
+    """
+    height, width = page_image.shape[:2]
+    if lines is None:
+        lines = ocr_lines(page_image)
+    anchors = find_question_anchors(lines, width)
+    if not anchors:
+        return []
+
+    padding = int(REGION_PADDING * pixel_scale)
+    regions = []
+    first_top = max(0, anchors[0]['top'] - padding)
+    if has_continuation(page_image, lines, anchors[0], first_top):
+        regions.append({
+            'number': str(anchors[0]['number'] - 1),
+            'bbox': (0, 0, width, first_top),
+            'continuation': True,
+        })
+    for idx, anchor in enumerate(anchors):
+        top = max(0, anchor['top'] - padding)
+        # Diagrams can sit below the last text line, so the last region runs to the page bottom
+        end = anchors[idx + 1]['top'] - padding if idx + 1 < len(anchors) else height
+        if regions and end - top < MIN_REGION_HEIGHT * height:
+            # Too short to be a question on its own (e.g. a stray numbered line): keep it with the previous one
+            regions[-1]['bbox'] = (0, regions[-1]['bbox'][1], width, max(end, regions[-1]['bbox'][3]))
+            continue
+        regions.append({'number': str(anchor['number']), 'bbox': (0, top, width, max(end, top + 1))})
+    return regions
+
+
+def has_continuation(page_image: np.ndarray, lines: List[Dict], first_anchor: Dict, first_top: int) -> bool:
+    """
+    Whether the page opens with the rest of a question from the previous page
+
+    Only possible when the first question number on the page isn't 1. The
+    band above it must hold a question part ("(b) ..."), more text than a
+    running header, or (for untranscribed content such as a continued
+    diagram) a substantial share of dark pixels.
+
+    Args:
+        page_image: Rendered page
+        lines: Text lines of the page
+        first_anchor: First question-number anchor ({'number', 'top'})
+        first_top: Top of the first question's region
+    """
+    if first_anchor['number'] <= 1 or first_top <= 0:
+        return False
+    above = [line for line in lines if line['bbox'][3] <= first_anchor['top']]
+    if any(PART_ANCHOR.match(line['text']) for line in above):
+        return True
+    if sum(len(line['text'].replace(' ', '')) for line in above) >= CONTINUATION_MIN_CHARS:
+        return True
+    band = page_image[:first_top]
+    if band.ndim == 3:
+        band = band.min(axis=2)
+    return band.size > 0 and np.count_nonzero(band < 128) / band.size >= CONTINUATION_MIN_INK
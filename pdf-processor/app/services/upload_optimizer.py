@@ -0,0 +1,145 @@
+"""
+Upload Payload Optimizer
+Downscale, reduce and encode page images before they are sent to Gemini
+"""
+import cv2
+import numpy as np
+from io import BytesIO
+from PIL import Image
+from typing import Optional, Tuple, Union
+
+
+UPLOAD_MODES = ('keep', 'gray', 'binary')
+UPLOAD_CODECS = {'jpeg': 'image/jpeg', 'webp': 'image/webp', 'png': 'image/png'}
+
+
+class UploadOptimizer:
+    """
+    Turn page images into compact inline blobs for Gemini
+
+    Without it the SDK uploads every full-resolution page as a lossless WebP,
+    far more bytes (and 768 px vision tiles) than the model needs to read a
+    printed exam page. Images are shrunk to max_long_edge, optionally reduced
+    to grayscale or black/white, and encoded with the chosen codec. Since
+    Gemini answers in the coordinates of the image it saw, callers map
+    returned boxes back with scale_bbox and the scale from prepare().
+    """
+
+    def __init__(
+        self,
+        max_long_edge: Optional[int] = 2048,
+        mode: str = 'keep',
+        codec: str = 'jpeg',
+        quality: int = 90,
+    ):
+        """
+        Initialize the optimizer
+
+        Args:
+            max_long_edge: Downscale images whose longer side exceeds this (None: never)
+            mode: 'keep' (as rendered), 'gray' or 'binary' (Otsu black/white)
+            codec: 'jpeg', 'webp' or 'png'
+            quality: JPEG/WebP quality (1-100), ignored for PNG
+        """
+        if mode not in UPLOAD_MODES:
+            raise ValueError(f"Unsupported upload mode: {mode} (expected one of {', '.join(UPLOAD_MODES)})")
+        if codec not in UPLOAD_CODECS:
+            raise ValueError(f"Unsupported upload codec: {codec} (expected one of {', '.join(UPLOAD_CODECS)})")
+        self.max_long_edge = max_long_edge or None
+        self.mode = mode
+        self.codec = codec
+        self.quality = quality
+
+    def describe(self) -> str:
+        """Short human-readable summary of the settings"""
+        size = f"long edge {self.max_long_edge}px" if self.max_long_edge else "full size"
+        quality = f" q{self.quality}" if self.codec != 'png' else ""
+        return f"{size}, {self.mode}, {self.codec}{quality}"
+
+    def prepare(self, image: Union[np.ndarray, Image.Image]) -> Tuple[dict, float]:
+        """
+        Encode one image for upload
+
+        Args:
+            image: Page image as numpy array (RGB or grayscale) or PIL image
+
+        Returns:
+            (inline blob {'mime_type', 'data'} accepted by generate_content,
+             scale of the uploaded image relative to the input)
+        """
+        img = Image.fromarray(image) if isinstance(image, np.ndarray) else image
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        scale = 1.0
+        width, height = img.size
+        if self.max_long_edge and max(width, height) > self.max_long_edge:
+            scale = self.max_long_edge / max(width, height)
+            img = img.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+
+        if self.mode in ('gray', 'binary') and img.mode != 'L':
+            img = img.convert('L')
+        if self.mode == 'binary':
+            _, binary = cv2.threshold(np.asarray(img), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            img = Image.fromarray(binary)
+            if self.codec == 'png':
+                img = img.convert('1')  # 1 bit per pixel
+
+        buffer = BytesIO()
+        if self.codec == 'jpeg':
+            img.save(buffer, format='JPEG', quality=self.quality, optimize=True)
+        elif self.codec == 'webp':
+            img.save(buffer, format='WEBP', quality=self.quality)
+        else:
+            img.save(buffer, format='PNG', optimize=True)
+
+        return {'mime_type': UPLOAD_CODECS[self.codec], 'data': buffer.getvalue()}, scale
+
+
+def payload_bytes(content_parts) -> int:
+    """Total size of the inline image blobs in a request"""
+    return sum(
+        len(part['data']) for part in content_parts
+        if isinstance(part, dict) and isinstance(part.get('data'), bytes)
+    )
+
+
+def scale_bbox(bbox: Optional[dict], scale: float) -> Optional[dict]:
+    """
+    Map an {"x", "y", "width", "height"} box from uploaded-image pixels back to page pixels
+
+    Args:
+        bbox: Box returned by Gemini (or None)
+        scale: Scale returned by UploadOptimizer.prepare for that image
+
+    Returns:
+        Box in page image pixels, or the input unchanged if it isn't a box
+    """
+    if not isinstance(bbox, dict) or scale == 1.0:
+        return bbox
+    scaled = dict(bbox)
+    for key in ('x', 'y', 'width', 'height'):
+        if isinstance(scaled.get(key), (int, float)):
+            scaled[key] = int(round(scaled[key] / scale))
+    return scaled
+
+
+def to_upload_part(image: Union[np.ndarray, Image.Image], optimizer: Optional[UploadOptimizer] = None):
+    """
+    Image part for generate_content
+
+    Returns:
+        (optimized blob, scale) with an optimizer, else (PIL image, 1.0) for the SDK's default encoding
+    """
+    if optimizer is not None:
+        return optimizer.prepare(image)
+    return (Image.fromarray(image) if isinstance(image, np.ndarray) else image), 1.0
+
+
+def log_payload(content_parts, optimizer: Optional[UploadOptimizer] = None):
+    """Print the image payload size of a request (only known for optimized blobs)"""
+    if optimizer is None:
+        return
+    images = sum(isinstance(part, dict) for part in content_parts)
+    print(f"    → Upload payload: {images} image(s), {payload_bytes(content_parts) / 1024:.0f} KB "
+          f"({optimizer.describe()})", flush=True)
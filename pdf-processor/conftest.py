@@ -0,0 +1,4 @@
+"""
+Pytest configuration
+Tests import the services (app.services.*) and the detector modules from this directory
+"""
@@ -7,21 +7,34 @@ from PIL import Image
 from pathlib import Path
 import cv2
 import numpy as np
+from page_features import PageFeatures
+from app.services.debug_recorder import current_debug
 
-def detect_diagrams_hybrid(image_path, output_dir='output'):
+# Pixel thresholds below are tuned for pages rendered at this DPI
+REFERENCE_DPI = 300
+
+def detect_diagrams_hybrid(page, output_dir='output', dpi=REFERENCE_DPI):
     """
     Hybrid approach: Edge detection + Contour analysis + Density mapping + Grid detection
+    
+    page is the rendered page array (or its PageFeatures, shared with the
+    other detectors); a path to a page image still works for one-off runs.
+    dpi is the resolution the page was rendered at; size thresholds scale
+    with it so low-DPI previews can be analysed too.
     """
     
-    print(f"Detecting diagrams in {Path(image_path).name}...")
+    page = PageFeatures.of(page)
+    debug = current_debug()
+    print(f"Detecting diagrams in {page.name}...")
+    scale = dpi / REFERENCE_DPI
+    area_scale = scale * scale
     
-    # Load image
-    image = cv2.imread(str(image_path))
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    # Every strategy below works on gray
+    gray = page.gray
     height, width = gray.shape
     
     # Strategy 1: Edge-based detection
-    edges = cv2.Canny(gray, 30, 100)
+    edges = page.edges
     
     # Dilate edges to connect nearby elements
     kernel = np.ones((5, 5), np.uint8)
@@ -31,21 +44,17 @@ def detect_diagrams_hybrid(image_path, output_dir='output'):
     contours, _ = cv2.findContours(dilated_edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
     # Strategy 2: Density-based detection
-    # Create a grid and measure edge density in each cell
-    grid_size = 100
-    density_map = np.zeros((height // grid_size + 1, width // grid_size + 1))
-    
-    for i in range(0, height, grid_size):
-        for j in range(0, width, grid_size):
-            cell = edges[i:i+grid_size, j:j+grid_size]
-            density_map[i // grid_size, j // grid_size] = np.sum(cell) / (grid_size * grid_size)
+    # Create a grid and measure edge density in each cell (vectorized; the contours that pass
+    # the filters below sum their box from the page's integral image, built on first use)
+    grid_size = max(10, int(100 * scale))
+    density_map = page.edge_density.cell_grid(grid_size)
     
     # Find regions with high edge density (likely diagrams)
     threshold = np.percentile(density_map, 90)  # Top 10% density
     high_density_regions = density_map > threshold
     
     # Strategy 3: Grid detection for coordinate geometry
-    grid_diagrams = detect_coordinate_grids(gray, edges, width, height)
+    grid_diagrams = detect_coordinate_grids(gray, edges, width, height, scale=scale)
     
     diagrams = []
     
@@ -64,7 +73,7 @@ def detect_diagrams_hybrid(image_path, output_dir='output'):
             region_density = 0
         
         # Filters - balanced to catch valid diagrams without false positives
-        is_large_enough = area > 10000  # 10k pixels minimum (was 15k - too strict)
+        is_large_enough = area > 10000 * area_scale  # 10k pixels minimum (was 15k - too strict)
         max_area = width * height * 0.35  # Max 35% of page area (was 15% - too strict)
         is_not_too_large = area < max_area
         is_not_full_width = w < width * 0.65  # Max 65% of page width (was 40% - too strict)
@@ -73,9 +82,9 @@ def detect_diagrams_hybrid(image_path, output_dir='output'):
         is_reasonable = 0.3 < aspect_ratio < 4.0  # More flexible aspect ratio (was 0.4-2.5)
         has_content = region_density > threshold * 0.65  # High density requirement (was 0.8 - too strict)
         
-        # Debug print for ALL significant regions to help troubleshooting
-        if area > 50000:  # Print for regions > 50k pixels
-            print(f"    Contour: {w}x{h}px ({area}px), max={max_area:.0f}, large_ok={is_large_enough}, size_ok={is_not_too_large}, width_ok={is_not_full_width}, height_ok={is_not_full_height}, aspect_ok={is_reasonable}, density_ok={has_content}")
+        # Filter outcome of ALL significant regions to help troubleshooting (debug mode only)
+        if debug and area > 50000 * area_scale:  # Regions > 50k pixels
+            debug.note(f"Contour: {w}x{h}px ({area}px), max={max_area:.0f}, large_ok={is_large_enough}, size_ok={is_not_too_large}, width_ok={is_not_full_width}, height_ok={is_not_full_height}, aspect_ok={is_reasonable}, density_ok={has_content}")
         
         # Require: reasonable size, not full page, good aspect ratio, high density
         if (is_large_enough and is_not_too_large and is_not_full_width and 
@@ -83,10 +92,10 @@ def detect_diagrams_hybrid(image_path, output_dir='output'):
             
             # Calculate confidence score (0-100)
             # Factors: density, size, aspect ratio, edge content
-            density_score = min(region_density / threshold, 1.0) * 40  # Max 40 points
-            size_score = min(area / 100000, 1.0) * 30  # Max 30 points (100k pixels = full score)
+            density_score = (min(region_density / threshold, 1.0) if threshold > 0 else 1.0) * 40  # Max 40 points
+            size_score = min(area / (100000 * area_scale), 1.0) * 30  # Max 30 points (100k pixels = full score)
             aspect_score = 20 if 0.3 < aspect_ratio < 3.0 else 10  # 20 points for good aspect ratio
-            edge_score = min(np.sum(edges[y:y+h, x:x+w]) / area * 100, 10)  # Max 10 points
+            edge_score = min(page.edge_density.rect_sum(x, y, x + w, y + h) / area * 100, 10)  # Max 10 points
             
             confidence = density_score + size_score + aspect_score + edge_score
             
@@ -134,52 +143,56 @@ def detect_diagrams_hybrid(image_path, output_dir='output'):
     return filtered_diagrams
 
 
-def detect_coordinate_grids(gray, edges, width, height):
+def detect_coordinate_grids(gray, edges, width, height, scale=1.0):
     """
     Detect coordinate grids by finding regular intersection patterns
+    
+    scale is the page resolution relative to REFERENCE_DPI.
     """
+    area_scale = scale * scale
+    line_kernel = max(3, int(40 * scale))
     grid_diagrams = []
-    output_dir = Path('output/debug')
-    output_dir.mkdir(exist_ok=True)
+    # Intermediate images and diagnostics go to the debug bundle, and are skipped entirely without one
+    debug = current_debug()
     
     # Pre-processing to reduce noise
     blurred = cv2.GaussianBlur(gray, (5, 5), 0)
     
     # Method 1: Look for regions with regular grid patterns using morphological operations
     # Create horizontal and vertical line detectors - larger kernels to be less sensitive
-    horizontal_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (40, 1))
-    vertical_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 40))
+    horizontal_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (line_kernel, 1))
+    vertical_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, line_kernel))
     
     # Apply morphological operations on blurred image edges
     edges_blurred = cv2.Canny(blurred, 50, 150)
     horizontal_lines = cv2.morphologyEx(edges_blurred, cv2.MORPH_OPEN, horizontal_kernel)
     vertical_lines = cv2.morphologyEx(edges_blurred, cv2.MORPH_OPEN, vertical_kernel)
     
-    # Save debug images
-    cv2.imwrite(str(output_dir / 'grid_horizontal_lines.png'), horizontal_lines)
-    cv2.imwrite(str(output_dir / 'grid_vertical_lines.png'), vertical_lines)
-    
     # Find intersections (grid points)
     intersections = cv2.bitwise_and(horizontal_lines, vertical_lines)
-    cv2.imwrite(str(output_dir / 'grid_intersections.png'), intersections)
+    if debug:
+        debug.image('grid_horizontal_lines', horizontal_lines)
+        debug.image('grid_vertical_lines', vertical_lines)
+        debug.image('grid_intersections', intersections)
 
     # Find contours of intersection regions
     contours, _ = cv2.findContours(intersections, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
-    print(f"    [Grid Debug] Method 1 (Intersections): Found {len(contours)} intersection contours.")
+    if debug:
+        debug.stat('grid_intersection_contours', len(contours))
 
     for i, contour in enumerate(contours):
         x, y, w, h = cv2.boundingRect(contour)
         area = w * h
         
-        if area > 1000:  # Minimum intersection area
-            print(f"    [Grid Debug] Contour #{i}: Area={area}px")
+        if area > 1000 * area_scale:  # Minimum intersection area
             # Check if this region has regular grid spacing
             region = intersections[y:y+h, x:x+w]
             
             # Find all intersection points in this region
             points = np.column_stack(np.where(region > 0))
-            print(f"    [Grid Debug] Contour #{i}: Found {len(points)} intersection points.")
+            if debug:
+                debug.note(f"Grid contour #{i}: area={area}px, {len(points)} intersection points")
 
             if len(points) >= 9:  # Need at least 3x3 grid points
                 # Analyze spacing
@@ -200,14 +213,15 @@ def detect_coordinate_grids(gray, edges, width, height):
                     y_cv = y_spacing_std / y_mean_spacing if y_mean_spacing > 0 else 0
                     x_cv = x_spacing_std / x_mean_spacing if x_mean_spacing > 0 else 0
                     
-                    print(f"    [Grid Debug] Contour #{i}: Y-spacing CV={y_cv:.2f}, X-spacing CV={x_cv:.2f}")
+                    if debug:
+                        debug.note(f"Grid contour #{i}: Y-spacing CV={y_cv:.2f}, X-spacing CV={x_cv:.2f}")
 
                     # Relaxed CV thresholds - real grids can have some variation
-                    if y_cv < 2.0 and x_cv < 2.0 and y_mean_spacing > 5 and x_mean_spacing > 5:
+                    if y_cv < 2.0 and x_cv < 2.0 and y_mean_spacing > 5 * scale and x_mean_spacing > 5 * scale:
                         # This looks like a regular grid
                         grid_area = w * h
                         
-                        if grid_area > 10000:  # Minimum grid area
+                        if grid_area > 10000 * area_scale:  # Minimum grid area
                             confidence = min(len(y_coords) * len(x_coords) * 2 + (1.0 - y_cv - x_cv) * 40, 100)
                             
                             grid_diagrams.append({
@@ -221,22 +235,25 @@ def detect_coordinate_grids(gray, edges, width, height):
     
     # Method 2: Fallback to line-based detection if no intersections found
     if not grid_diagrams:
-        print("    [Grid Debug] Method 1 failed, trying Method 2 (Hough Lines).")
         # Use adaptive thresholding for better line detection
         thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 15, 4)
-        cv2.imwrite(str(output_dir / 'grid_adaptive_thresh.png'), thresh)
+        if debug:
+            debug.note("Grid method 1 (intersections) found nothing, trying method 2 (Hough lines)")
+            debug.image('grid_adaptive_thresh', thresh)
         
         # Hough line detection - tuned parameters
-        lines = cv2.HoughLinesP(thresh, 1, np.pi / 180, threshold=50, minLineLength=50, maxLineGap=10)
+        lines = cv2.HoughLinesP(thresh, 1, np.pi / 180, threshold=max(1, int(50 * scale)),
+                                minLineLength=50 * scale, maxLineGap=10 * scale)
         
-        print(f"    [Grid Debug] Method 2: Found {len(lines) if lines is not None else 0} lines.")
+        if debug:
+            debug.stat('grid_hough_lines', len(lines) if lines is not None else 0)
 
         if lines is not None and len(lines) > 6:
             horizontal_lines = []
             vertical_lines = []
             
-            for line in lines:
-                x1, y1, x2, y2 = line[0]
+            # (N, 1, 4) in OpenCV 4, (N, 4) in OpenCV 5
+            for x1, y1, x2, y2 in lines.reshape(-1, 4):
                 dx, dy = abs(x2 - x1), abs(y2 - y1)
                 
                 if dx > dy * 2:  # Horizontal
@@ -244,7 +261,8 @@ def detect_coordinate_grids(gray, edges, width, height):
                 elif dy > dx * 2:  # Vertical
                     vertical_lines.append((x1, y1, x2, y2))
             
-            print(f"    [Grid Debug] Method 2: Found {len(horizontal_lines)} horizontal lines and {len(vertical_lines)} vertical lines.")
+            if debug:
+                debug.note(f"Grid method 2: {len(horizontal_lines)} horizontal and {len(vertical_lines)} vertical lines")
 
             if len(horizontal_lines) >= 3 and len(vertical_lines) >= 3:
                 # Group lines by position and check spacing
@@ -264,21 +282,22 @@ def detect_coordinate_grids(gray, edges, width, height):
                     h_cv = h_std / h_mean if h_mean > 0 else 0
                     v_cv = v_std / v_mean if v_mean > 0 else 0
 
-                    print(f"    [Grid Debug] Method 2: Y-spacing CV={h_cv:.2f}, X-spacing CV={v_cv:.2f}")
+                    if debug:
+                        debug.note(f"Grid method 2: Y-spacing CV={h_cv:.2f}, X-spacing CV={v_cv:.2f}")
                     
                     # Relaxed CV thresholds for line-based grid detection
-                    if h_cv < 2.0 and v_cv < 2.0 and h_mean > 15 and v_mean > 15:
+                    if h_cv < 2.0 and v_cv < 2.0 and h_mean > 15 * scale and v_mean > 15 * scale:
                         x1, x2 = min(v_positions), max(v_positions)
                         y1, y2 = min(h_positions), max(h_positions)
                         w, h = x2 - x1, y2 - y1
                         area = w * h
                         
-                        if area > 8000:
+                        if area > 8000 * area_scale:
                             confidence = min(len(h_positions) * len(v_positions) + (1.0 - h_cv - v_cv) * 50, 100)
                             
                             grid_diagrams.append({
-                                'bbox': (x1, y1, x2, y2),
-                                'area': area,
+                                'bbox': (int(x1), int(y1), int(x2), int(y2)),
+                                'area': int(area),
                                 'density': len(horizontal_lines) + len(vertical_lines),
                                 'confidence': round(confidence, 1),
                                 'source': 'grid_lines'
@@ -291,11 +310,15 @@ if __name__ == "__main__":
     import sys
     
     if len(sys.argv) < 2:
-        print("Usage: python detect_diagrams_hybrid.py <image_path>")
+        print("Usage: python detect_diagrams_hybrid.py <image_path> [--debug]")
         print("Example: python detect_diagrams_hybrid.py output/page_10.png")
         sys.exit(1)
     
     image_path = sys.argv[1]
+    if '--debug' in sys.argv[2:]:
+        # Grid detection intermediates and diagnostics, bundled next to the crops
+        from app.services.debug_recorder import start_debug
+        start_debug(f"output/debug/{Path(image_path).stem}_debug.zip", image=image_path)
     diagrams = detect_diagrams_hybrid(image_path)
     
     if diagrams:
@@ -333,4 +356,8 @@ if __name__ == "__main__":
         fallback_crop.save(save_path, optimize=True)
         print(f"  ✓ Saved fallback crop: {filename} ({save_path.stat().st_size // 1024}KB)")
     
+    from app.services.debug_recorder import stop_debug
+    bundle = stop_debug()
+    if bundle:
+        print(f"  🐞 Debug bundle: {bundle}")
     print(f"\n✅ Processing complete!")
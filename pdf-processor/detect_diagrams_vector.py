@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Vector-native diagram detection for born-digital PDFs
+Clusters the page's drawing paths and embedded images into diagram boxes without rasterizing
+"""
+
+import fitz  # PyMuPDF
+import numpy as np
+from pathlib import Path
+
+# A page is treated as a scan when one embedded image covers at least this fraction of it
+SCANNED_IMAGE_COVERAGE = 0.6
+
+
+def is_scanned_page(page):
+    """
+    Return True when the page is a scanned image rather than born-digital content
+
+    Scanned pages (even OCR'd ones with an invisible text layer) are a single
+    large raster, so their diagrams can only be found with the raster detectors.
+    """
+    page_area = page.rect.width * page.rect.height
+    if page_area <= 0:
+        return False
+
+    for info in page.get_image_info():
+        visible = fitz.Rect(info['bbox']) & page.rect
+        if visible.width * visible.height >= page_area * SCANNED_IMAGE_COVERAGE:
+            return True
+    return False
+
+
+def _collect_primitives(page, min_stroke=0.5):
+    """
+    Collect bounding rects (PDF points) of drawing paths and embedded images
+
+    Page furniture is skipped: frames around the whole page and long thin
+    rules such as header/footer lines.
+    """
+    page_rect = page.rect
+    rects = []
+    is_image = []
+
+    for path in page.get_drawings():
+        r = fitz.Rect(path['rect'])
+        # Straight lines have a zero-size side; give them a minimal thickness
+        if r.width < min_stroke:
+            r.x0 -= min_stroke
+            r.x1 += min_stroke
+        if r.height < min_stroke:
+            r.y0 -= min_stroke
+            r.y1 += min_stroke
+
+        is_page_frame = r.width > page_rect.width * 0.85 and r.height > page_rect.height * 0.85
+        is_rule = r.width > page_rect.width * 0.7 and r.height < 3
+        if is_page_frame or is_rule:
+            continue
+        rects.append((r.x0, r.y0, r.x1, r.y1))
+        is_image.append(False)
+
+    for info in page.get_image_info():
+        r = fitz.Rect(info['bbox']) & page_rect
+        if r.is_empty or r.width * r.height >= page_rect.width * page_rect.height * SCANNED_IMAGE_COVERAGE:
+            continue
+        rects.append((r.x0, r.y0, r.x1, r.y1))
+        is_image.append(True)
+
+    return np.array(rects, dtype=np.float64).reshape(-1, 4), np.array(is_image, dtype=bool)
+
+
+def _cluster_rects(rects, gap):
+    """
+    Group rects whose boxes come within gap points of each other (union-find)
+
+    Returns:
+        Array of cluster labels, one per rect
+    """
+    n = len(rects)
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    x0, y0, x1, y1 = rects[:, 0] - gap, rects[:, 1] - gap, rects[:, 2] + gap, rects[:, 3] + gap
+    for i in range(n):
+        # Vectorized test against every later rect; only the union step is per pair
+        touching = (
+            (x0[i + 1:] <= x1[i]) & (x1[i + 1:] >= x0[i])
+            & (y0[i + 1:] <= y1[i]) & (y1[i + 1:] >= y0[i])
+        )
+        for j in np.nonzero(touching)[0] + i + 1:
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[root_j] = root_i
+
+    return np.array([find(i) for i in range(n)])
+
+
+def detect_diagrams_vector(page, dpi=300, gap=10, padding=6):
+    """
+    Detect diagrams from the PDF drawing layer of a born-digital page
+
+    Args:
+        page: fitz page
+        dpi: Resolution of the rendered page the returned boxes refer to
+        gap: Primitives closer than this (PDF points) belong to the same diagram
+        padding: Points added around each cluster to keep nearby labels
+
+    Returns:
+        List of diagram detections in the same format as detect_diagrams_hybrid,
+        bounding boxes in pixels of the page rendered at dpi
+    """
+    rects, is_image = _collect_primitives(page)
+    if len(rects) == 0:
+        return []
+
+    labels = _cluster_rects(rects, gap)
+    page_rect = page.rect
+    scale = dpi / 72
+    diagrams = []
+
+    for label in np.unique(labels):
+        members = labels == label
+        count = int(members.sum())
+        has_image = bool(is_image[members].any())
+        x0, y0 = rects[members, 0].min(), rects[members, 1].min()
+        x1, y1 = rects[members, 2].max(), rects[members, 3].max()
+        w, h = x1 - x0, y1 - y0
+
+        # A diagram is several strokes (or an embedded picture) of a reasonable size;
+        # single boxes and lone underlines are answer spaces, not figures
+        if not has_image and count < 3:
+            continue
+        if max(w, h) < 50 or min(w, h) < 10:
+            continue
+        if w > page_rect.width * 0.95 and h > page_rect.height * 0.9:
+            continue
+
+        box = fitz.Rect(x0 - padding, y0 - padding, x1 + padding, y1 + padding) & page_rect
+        px1, py1 = int(box.x0 * scale), int(box.y0 * scale)
+        px2, py2 = int(np.ceil(box.x1 * scale)), int(np.ceil(box.y1 * scale))
+
+        confidence = 70 + min(count / 20, 1.0) * 20 + (9 if has_image else 0)
+        diagrams.append({
+            'bbox': (px1, py1, px2, py2),
+            'area': (px2 - px1) * (py2 - py1),
+            'density': count,
+            'confidence': round(min(confidence, 99), 1),
+            'source': 'vector_drawings'
+        })
+
+    diagrams = sorted(diagrams, key=lambda x: x['area'], reverse=True)
+
+    print(f"  ✓ Vector layer: {len(diagrams)} diagrams from {len(rects)} primitives")
+    for i, d in enumerate(diagrams[:3]):
+        bbox = d['bbox']
+        w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
+        print(f"    #{i+1}: {w}x{h}px, primitives={d['density']}, conf={d['confidence']:.1f}%")
+
+    return diagrams
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        print("Usage: python detect_diagrams_vector.py <pdf_path> <page_number> [dpi]")
+        print("Example: python detect_diagrams_vector.py exam.pdf 10")
+        sys.exit(1)
+
+    pdf_path = sys.argv[1]
+    page_number = int(sys.argv[2])
+    dpi = int(sys.argv[3]) if len(sys.argv) > 3 else 300
+
+    with fitz.open(pdf_path) as doc:
+        page = doc[page_number - 1]
+        if is_scanned_page(page):
+            print("  ⚠ Page is a scan - use detect_diagrams_hybrid.py on the rendered image instead")
+            sys.exit(0)
+
+        diagrams = detect_diagrams_vector(page, dpi=dpi)
+        output_dir = Path('output')
+        output_dir.mkdir(exist_ok=True)
+        to_points = 72 / dpi
+
+        for idx, diag in enumerate(diagrams):
+            x1, y1, x2, y2 = diag['bbox']
+            clip = fitz.Rect(x1 * to_points, y1 * to_points, x2 * to_points, y2 * to_points)
+            pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), clip=clip)
+
+            filename = f"{Path(pdf_path).stem}_page_{page_number}_vector_diagram_{idx+1}.png"
+            save_path = output_dir / filename
+            pix.save(str(save_path))
+            print(f"  ✓ Saved: {filename}")
+
+        if not diagrams:
+            print("  ⚠ No vector diagrams detected")
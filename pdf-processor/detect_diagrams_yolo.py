@@ -8,6 +8,10 @@ import cv2
 import numpy as np
 from pathlib import Path
 from PIL import Image
+from page_features import PageFeatures
+
+# Pixel thresholds below are tuned for pages rendered at this DPI
+REFERENCE_DPI = 300
 
 class AdvancedLayoutDetector:
     """Advanced diagram detection using pure OpenCV (no ML models)"""
@@ -16,31 +20,31 @@ class AdvancedLayoutDetector:
         """Initialize detector"""
         print("✓ Advanced layout detector initialized")
     
-    def detect_diagrams(self, image_path, confidence_threshold=0.25):
+    def detect_diagrams(self, page, confidence_threshold=0.25, dpi=REFERENCE_DPI):
         """
         Detect diagrams using advanced layout analysis
         
         Args:
-            image_path: Path to page image
+            page: Rendered page array, its PageFeatures, or path to a page image
             confidence_threshold: Minimum confidence (0-1)
+            dpi: Resolution the page was rendered at (size thresholds scale with it)
             
         Returns:
             List of diagram detections with bounding boxes
         """
         try:
-            # Read image
-            img = cv2.imread(str(image_path))
-            if img is None:
-                return []
+            gray = PageFeatures.of(page).gray
                 
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
             height, width = gray.shape
+            scale = dpi / REFERENCE_DPI
+            area_scale = scale * scale
             
             diagrams = []
             
             # Strategy 1: Morphological operations to find diagram regions
             # Apply morphological closing to connect diagram elements
-            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15))
+            kernel_size = max(3, int(15 * scale))
+            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
             closed = cv2.morphologyEx(gray, cv2.MORPH_CLOSE, kernel)
             
             # Threshold
@@ -54,7 +58,7 @@ class AdvancedLayoutDetector:
                 area = w * h
                 
                 # Filter criteria for diagrams
-                min_area = 15000
+                min_area = 15000 * area_scale
                 max_area = width * height * 0.4
                 
                 if (min_area < area < max_area and 
@@ -67,7 +71,7 @@ class AdvancedLayoutDetector:
                     fill_ratio = contour_area / bbox_area if bbox_area > 0 else 0
                     
                     # Diagrams usually have medium fill ratio (not too sparse, not solid)
-                    confidence = 50 + (fill_ratio * 30) + (min(area/50000, 1.0) * 20)
+                    confidence = 50 + (fill_ratio * 30) + (min(area / (50000 * area_scale), 1.0) * 20)
                     
                     diagrams.append({
                         'bbox': (x, y, x + w, y + h),
@@ -79,7 +83,7 @@ class AdvancedLayoutDetector:
             # Strategy 2: Blob detection for circular/structured diagrams
             params = cv2.SimpleBlobDetector_Params()
             params.filterByArea = True
-            params.minArea = 1000
+            params.minArea = 1000 * area_scale
             params.filterByCircularity = False
             params.filterByConvexity = False
             params.filterByInertia = False
@@ -97,7 +101,7 @@ class AdvancedLayoutDetector:
                     w, h = x2 - x1, y2 - y1
                     area = w * h
                     
-                    if area > 20000:
+                    if area > 20000 * area_scale:
                         diagrams.append({
                             'bbox': (x1, y1, x2, y2),
                             'area': area,
@@ -138,15 +142,14 @@ class AdvancedLayoutDetector:
             print(f"  ⚠ Advanced layout detection failed: {e}")
             return []
     
-    def detect_with_layout_analysis(self, image_path):
+    def detect_with_layout_analysis(self, page, dpi=REFERENCE_DPI):
         """
         Alternative: Use layout analysis approach
         Detects large connected components that might be diagrams
         """
+        area_scale = (dpi / REFERENCE_DPI) ** 2
         try:
-            # Read image
-            img = cv2.imread(str(image_path))
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            gray = PageFeatures.of(page).gray
             
             # Adaptive thresholding
             thresh = cv2.adaptiveThreshold(
@@ -169,7 +172,7 @@ class AdvancedLayoutDetector:
                 area = w * h
                 
                 # Filter for diagram-like regions
-                if (area > 15000 and area < 400000 and 
+                if (area > 15000 * area_scale and area < 400000 * area_scale and 
                     0.2 < w/h < 5.0):  # Reasonable aspect ratio
                     
                     # Calculate confidence based on features
@@ -194,21 +197,25 @@ class AdvancedLayoutDetector:
             return []
 
 
-def detect_diagrams_yolo(image_path, output_dir='output'):
+def detect_diagrams_yolo(page, output_dir='output', dpi=REFERENCE_DPI):
     """
     Main function: Advanced layout detection (lightweight, no ML needed)
+    
+    page is the rendered page array or its PageFeatures (a path to a page
+    image still works); both strategies share its grayscale conversion.
     """
-    print(f"Using advanced layout detector for {Path(image_path).name}...")
+    page = PageFeatures.of(page)
+    print(f"Using advanced layout detector for {page.name}...")
     
     detector = AdvancedLayoutDetector()
     
     # Try advanced detection first
-    diagrams = detector.detect_diagrams(image_path)
+    diagrams = detector.detect_diagrams(page, dpi=dpi)
     
     # Fallback to simpler layout analysis if nothing found
     if not diagrams:
         print("  → Falling back to simpler layout analysis")
-        diagrams = detector.detect_with_layout_analysis(image_path)
+        diagrams = detector.detect_with_layout_analysis(page, dpi=dpi)
     
     return diagrams
 
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Shared page preprocessing for the diagram detectors
+One rendered page with its grayscale, Canny edges and edge density computed at most once
+"""
+
+from functools import cached_property
+import hashlib
+from pathlib import Path
+import cv2
+import numpy as np
+from edge_density import EdgeDensity
+
+
+class PageFeatures:
+    """
+    A rendered page and the preprocessing every raster detector starts from
+
+    The pipeline builds one per page from the array it already rendered, so
+    the detectors neither decode page_N.png again nor each redo the
+    grayscale conversion and edge detection.
+    """
+
+    def __init__(self, image: np.ndarray, name: str = 'page'):
+        """
+        Args:
+            image: Rendered page, RGB (H x W x 3) or single-channel (H x W)
+            name: Shown in the detectors' progress output
+        """
+        self.image = image
+        self.name = name
+
+    @classmethod
+    def of(cls, page) -> 'PageFeatures':
+        """
+        Wrap whatever a detector was given
+
+        Args:
+            page: PageFeatures, page array or path of a page image
+        """
+        if isinstance(page, PageFeatures):
+            return page
+        if isinstance(page, np.ndarray):
+            return cls(page)
+        # Only the grayscale version is needed when starting from disk
+        gray = cv2.imread(str(page), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise FileNotFoundError(f"Unable to read page image {page}")
+        return cls(gray, Path(page).name)
+
+    @cached_property
+    def fingerprint(self) -> str:
+        """Hash of the page pixels, so results computed on them can be told from another render's"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((self.image.shape, self.image.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(self.image).data)
+        return digest.hexdigest()
+
+    @cached_property
+    def gray(self) -> np.ndarray:
+        if self.image.ndim == 2:
+            return self.image
+        code = cv2.COLOR_RGBA2GRAY if self.image.shape[2] == 4 else cv2.COLOR_RGB2GRAY
+        return cv2.cvtColor(self.image, code)
+
+    @cached_property
+    def edges(self) -> np.ndarray:
+        """Canny edges (30/100) of the grayscale page"""
+        return cv2.Canny(self.gray, 30, 100)
+
+    @cached_property
+    def edge_density(self) -> EdgeDensity:
+        return EdgeDensity(self.edges)
@@ -9,20 +9,78 @@ warnings.filterwarnings('ignore', category=FutureWarning, module='google.api_cor
 
 import sys
 import os
+import functools
 from pathlib import Path
-from app.services.pdf_processor import PDFProcessor
+from app.services.pdf_processor import PDFProcessor, TEXT_LAYER_MIN_QUALITY
+from app.services.page_cache import PageRenderCache
+from app.services.page_classifier import PageClassifier
+from app.services.gemini_cache import GeminiResponseCache
+from app.services.gemini_engine import GeminiRequestEngine, RateLimiter
+from app.services.upload_optimizer import UploadOptimizer
+from app.services.gemini_retry import GeminiRequestError, CIRCUIT_OPEN, SERVER
+from app.services.gemini_usage import UsageRecorder
 from app.services.gemini_answer_parser import GeminiAnswerParser
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.local_extraction import extract_answers_locally
 import json
 from dotenv import load_dotenv
 
 
-def process_answers_pdf(pdf_path: str, batch_size: int = 5):
+def process_answers_pdf(
+    pdf_path: str,
+    batch_size: int = 5,
+    render_workers: int = 1,
+    analysis_dpi: int = None,
+    page_cache_dir: str = None,
+    page_cache_mb: int = 2048,
+    colorspace: str = 'rgb',
+    skip_non_question_pages: bool = True,
+    response_cache_path: str = None,
+    response_cache_mb: int = 512,
+    response_cache_days: float = 30,
+    concurrency: int = 4,
+    rpm: float = 8,
+    tpm: float = 250_000,
+    upload_long_edge: int = 2048,
+    upload_mode: str = 'keep',
+    upload_codec: str = 'jpeg',
+    upload_quality: int = 90,
+    optimize_uploads: bool = False,
+    stream_responses: bool = True,
+    structured_output: bool = False,
+    breaker_threshold: int = 5,
+    breaker_probe_seconds: float = 30,
+):
     """
     Process answers PDF and extract step-by-step solutions
     
     Args:
         pdf_path: Path to answers PDF file
         batch_size: Number of pages to process per API call (default: 5)
+        render_workers: Worker processes used to rasterize pages (default: 1, serial)
+        analysis_dpi: Render pages at this lower DPI for Gemini (default: None, full DPI)
+        page_cache_dir: Directory of the rendered page cache (default: None, disabled)
+        page_cache_mb: Size bound of the page cache in MB
+        colorspace: Page render colorspace: 'rgb', 'gray' or 'binary' (default: 'rgb')
+        skip_non_question_pages: Don't send blank, cover and instruction pages to Gemini
+        response_cache_path: SQLite file of the Gemini response cache (default: None, disabled)
+        response_cache_mb: Size bound of the response cache in MB
+        response_cache_days: Age in days after which cached responses are ignored
+        concurrency: Gemini requests kept in flight (default: 4)
+        rpm: Gemini requests per minute allowed by the API quota (default: 8)
+        tpm: Gemini tokens per minute allowed by the API quota (default: 250k)
+        upload_long_edge: Downscale page images to this long edge before upload (0: full size)
+        upload_mode: Upload pages as 'keep' (rendered colorspace), 'gray' or 'binary'
+        upload_codec: Upload image codec: 'jpeg', 'webp' or 'png'
+        upload_quality: JPEG/WebP quality of uploaded pages
+        optimize_uploads: Encode uploads with the settings above instead of sending full-resolution
+            pages with the SDK's lossless WebP (default: False)
+        stream_responses: Stream Gemini responses, reporting each answer as soon as it is generated
+        structured_output: Constrain Gemini's JSON output to the pydantic response schemas
+        breaker_threshold: Consecutive Gemini server failures that open the circuit breaker;
+            while it is open, pages are split into answers locally (text layer or Tesseract) and
+            flagged for reprocessing (0: no breaker, failed pages are reported instead)
+        breaker_probe_seconds: Seconds between background health probes while the breaker is open
     """
     print("="*70)
     print("ANSWERS PDF PROCESSOR")
@@ -41,44 +99,145 @@ def process_answers_pdf(pdf_path: str, batch_size: int = 5):
         print("⚠ Error: GEMINI_API_KEY not found in .env file")
         sys.exit(1)
     
-    answer_parser = GeminiAnswerParser(api_key=gemini_api_key)
-    pdf_processor = PDFProcessor(gemini_ocr=None)
+    response_cache = None
+    if response_cache_path:
+        response_cache = GeminiResponseCache(
+            response_cache_path,
+            ttl_seconds=response_cache_days * 24 * 3600,
+            max_bytes=response_cache_mb * 1024 * 1024,
+        )
+    rate_limiter = RateLimiter(rpm=rpm, tpm=tpm)
+    usage_recorder = UsageRecorder()
+    circuit_breaker = None
+    if breaker_threshold > 0:
+        circuit_breaker = CircuitBreaker(failure_threshold=breaker_threshold, probe_interval=breaker_probe_seconds)
+    upload_optimizer = None
+    if optimize_uploads:
+        upload_optimizer = UploadOptimizer(
+            max_long_edge=upload_long_edge, mode=upload_mode, codec=upload_codec, quality=upload_quality
+        )
+    answer_parser = GeminiAnswerParser(
+        api_key=gemini_api_key,
+        response_cache=response_cache,
+        rate_limiter=rate_limiter,
+        upload_optimizer=upload_optimizer,
+        structured_output=structured_output,
+        usage_recorder=usage_recorder,
+        circuit_breaker=circuit_breaker,
+    )
+    page_cache = None
+    if page_cache_dir:
+        page_cache = PageRenderCache(page_cache_dir, max_bytes=page_cache_mb * 1024 * 1024)
+    pdf_processor = PDFProcessor(
+        gemini_ocr=None,
+        render_workers=render_workers,
+        analysis_dpi=analysis_dpi,
+        page_cache=page_cache,
+        colorspace=colorspace,
+    )
+    
+    page_classifier = PageClassifier() if skip_non_question_pages else None
     
     print("✓ Gemini Answer Parser enabled")
     print(f"\nProcessing Answers PDF: {pdf_path}\n")
     
-    # Convert PDF to images
+    # Pages are rendered lazily, one batch at a time, so memory scales with batch_size
     print("="*50)
-    print("Converting PDF to images...")
+    print("Streaming PDF pages...")
     print("="*50)
     
-    page_images = pdf_processor.pdf_to_images(pdf_path)
-    total_pages = len(page_images)
-    print(f"✓ Converted {total_pages} pages\n")
+    total_pages = pdf_processor.get_page_count(pdf_path)
+    print(f"✓ Found {total_pages} pages\n")
     
     # Process pages in batches
     all_answers = []
     all_pages_data = []  # Track page data with sections
     total_api_calls = 0
+    cached_api_calls = 0  # Page extractions replayed from the response cache
+    skipped_pages = []  # Pages the local classifier kept away from Gemini
+    failed_pages = []  # Pages whose Gemini request failed for good (after retries)
+    degraded_pages = []  # Pages processed locally while the circuit breaker was open
     current_paper_section = "Unknown"
     
-    for batch_start in range(0, total_pages, batch_size):
-        batch_end = min(batch_start + batch_size, total_pages)
-        batch_page_images = page_images[batch_start:batch_end]
-        batch_range = f"{batch_start + 1}-{batch_end}"
+    # Page extractions of a batch run concurrently; the shared limiter enforces RPM/TPM quota
+    engine = GeminiRequestEngine(concurrency=concurrency)
+    
+    def report_answer(page_num, answer):
+        print(f"    ⚡ Page {page_num} Q{answer.get('question_num')}: answer streamed "
+              f"({len(answer.get('parts') or [])} part(s))", flush=True)
+    
+    def extract_page(page_num, page_image):
+        """One page's answers with the (live, cached) calls it took; no calls while the breaker is open"""
+        page_results, error = {}, None
+        try:
+            page_results = answer_parser.extract_answers_from_batch(
+                [(page_num, page_image)], on_answer=report_answer if stream_responses else None
+            )
+        except GeminiRequestError as e:
+            error = e
+        live_calls, cached_calls = answer_parser.pop_call_counts()
+        return page_results, live_calls, cached_calls, error
+    
+    for batch_pages in pdf_processor.iter_page_batches(pdf_path, batch_size):
+        batch_range = f"{batch_pages[0][0]}-{batch_pages[-1][0]}"
         
         print(f"\n{'='*50}")
-        print(f"ANSWER BATCH: Pages {batch_range} ({len(batch_page_images)} pages)")
+        print(f"ANSWER BATCH: Pages {batch_range} ({len(batch_pages)} pages)")
         print(f"{'='*50}")
         
+        # Blank, cover and instruction pages have no answers: don't pay for an API call
+        pending_pages = []
+        for actual_page_num, page_image in batch_pages:
+            if page_classifier:
+                page_text = pdf_processor.extract_text_layout(actual_page_num)['text']
+                page_class = page_classifier.classify(page_image, page_text)
+                if page_class['skip']:
+                    print(f"\n⏭ Skipping {page_class['label']} page {actual_page_num} ({page_class['reason']})")
+                    skipped_pages.append({
+                        'page_number': actual_page_num,
+                        'label': page_class['label'],
+                        'reason': page_class['reason'],
+                    })
+                    continue
+            pending_pages.append((actual_page_num, page_image))
+        
+        # Up to `concurrency` pages in flight; results come back in page order
+        page_responses = engine.run([
+            functools.partial(extract_page, page_num, page_image)
+            for page_num, page_image in pending_pages
+        ])
+        
         # Process each page
-        for idx, page_image in enumerate(batch_page_images):
-            actual_page_num = batch_start + idx + 1
+        for (actual_page_num, page_image), (batch_results, live_calls, cached_calls, error) in zip(
+            pending_pages, page_responses
+        ):
             print(f"\nProcessing answers page {actual_page_num}...")
+            total_api_calls += live_calls
+            cached_api_calls += cached_calls
+            if cached_calls and not live_calls:
+                print("  ♻ Served from Gemini response cache")
             
-            total_api_calls += 1
+            # Gemini is unhealthy: keep the page with local text and regex-split answers
+            degraded = bool(error) and circuit_breaker is not None and error.category in (CIRCUIT_OPEN, SERVER)
+            if degraded:
+                text_layout = pdf_processor.extract_text_layout(actual_page_num)
+                batch_results = {actual_page_num: extract_answers_locally(
+                    pdf_processor, actual_page_num, page_image, text_layout,
+                    text_layout['quality'] >= TEXT_LAYER_MIN_QUALITY
+                )}
+                degraded_pages.append(actual_page_num)
+                error = None
             
-            batch_results = answer_parser.extract_answers_from_batch([(actual_page_num, page_image)])
+            # Report pages Gemini couldn't process instead of silently dropping them
+            if error:
+                print(f"  ❌ Page {actual_page_num} failed ({error.category}) after {error.attempts} attempt(s)")
+                failed_pages.append({
+                    'page_number': actual_page_num,
+                    'error_category': error.category,
+                    'attempts': error.attempts,
+                    'error': str(error.cause),
+                })
+                continue
             
             # Get answers for this page
             if actual_page_num in batch_results:
@@ -96,6 +255,7 @@ def process_answers_pdf(pdf_path: str, batch_size: int = 5):
                 # Add paper section to each answer
                 for answer in page_answers:
                     answer['paper_section'] = current_paper_section
+                    answer['needs_reprocessing'] = degraded  # Extracted locally while Gemini was down
                     all_answers.append(answer)
                     q_num = answer.get('question_num')
                     parts_count = len(answer.get('parts', []))
@@ -109,11 +269,31 @@ def process_answers_pdf(pdf_path: str, batch_size: int = 5):
                 })
             else:
                 print(f"  ⚠ No answers found on page {actual_page_num}")
+        
+        # Release this batch's rendered pages before the next batch is rasterized
+        del batch_pages, page_image, pending_pages, page_responses
+    
+    # Per-call token/latency/cost records, aggregated per page, prompt and job
+    usage_file = Path('output/answers') / 'usage_summary.json'
+    usage = usage_recorder.write(usage_file)['job']
     
     print(f"\n{'='*50}")
-    print(f"ANSWERS PDF processing complete!")
+    print("ANSWERS PDF processing complete!")
     print(f"Processed {total_pages} pages")
     print(f"🎯 Total API calls used: {total_api_calls}")
+    print(f"⏭ API calls avoided (blank/cover/instruction pages): {len(skipped_pages)}")
+    print(f"💵 Gemini usage: {usage['prompt_tokens']} prompt + {usage['output_tokens']} output tokens, "
+          f"{usage['latency_seconds']:.1f}s, ~${usage['cost_usd']:.4f} (details: {usage_file})")
+    if response_cache:
+        print(f"♻ API calls served from response cache: {cached_api_calls}")
+        response_cache.close()
+    if failed_pages:
+        print(f"❌ Failed pages: {', '.join(str(p['page_number']) for p in failed_pages)}")
+    if degraded_pages:
+        print(f"↓ Pages processed locally while Gemini was unavailable (need reprocessing): "
+              f"{', '.join(map(str, degraded_pages))}")
+    if rate_limiter.throttles:
+        print(f"⏱️  API throttled {rate_limiter.throttles} time(s); final rate {rate_limiter.current_rpm:.1f} RPM")
     print(f"📚 Total question answers extracted: {len(all_answers)}")
     print(f"{'='*50}\n")
     
@@ -136,6 +316,12 @@ def process_answers_pdf(pdf_path: str, batch_size: int = 5):
             "filename": Path(pdf_path).name,
             "total_pages": total_pages,
             "api_calls_used": total_api_calls,
+            "api_calls_avoided": len(skipped_pages),
+            "skipped_pages": skipped_pages,
+            "cached_api_calls": cached_api_calls,
+            "usage": usage,
+            "failed_pages": failed_pages,
+            "degraded_pages": degraded_pages,
             "total_answers": len(all_answers),
             "papers": list(answers_by_paper.keys()),
             "processing_complete": True
@@ -200,13 +386,92 @@ def process_answers_pdf(pdf_path: str, batch_size: int = 5):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python process_answers_pdf.py <answers_pdf_file> [batch_size]")
-        print("Example: python process_answers_pdf.py Springfield_Ans.pdf 5")
-        print("\nThis script extracts step-by-step answers from answer PDF")
-        sys.exit(1)
+    import argparse
     
-    pdf_path = sys.argv[1]
-    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    parser = argparse.ArgumentParser(
+        description="Extract step-by-step answers from an answer PDF.",
+        epilog="Example: python process_answers_pdf.py Springfield_Ans.pdf 5 --render-workers 8",
+    )
+    parser.add_argument('answers_pdf_file', help="Answers PDF file to process")
+    parser.add_argument('batch_size', nargs='?', type=int, default=5, help="Pages per batch (default: 5)")
+    parser.add_argument('--render-workers', type=int, default=1,
+                        help="Rasterize pages in N worker processes (default: 1, serial)")
+    parser.add_argument('--analysis-dpi', type=int, default=None,
+                        help="Render pages at this lower DPI before sending them to Gemini (e.g. 100)")
+    parser.add_argument('--page-cache', action='store_true',
+                        help="Reuse rendered pages across runs of the same PDF from an on-disk cache "
+                             "(default: off, pages are always rendered)")
+    parser.add_argument('--page-cache-dir', default='output/cache/pages',
+                        help="With --page-cache: directory of the rendered page cache (default: output/cache/pages)")
+    parser.add_argument('--page-cache-mb', type=int, default=2048,
+                        help="With --page-cache: size bound of the page cache in MB (default: 2048)")
+    parser.add_argument('--colorspace', choices=['rgb', 'gray', 'binary'], default='rgb',
+                        help="Render pages as RGB, single-channel grayscale, or 1-bit black/white "
+                             "(gray/binary use ~3x less memory on text-dominant papers)")
+    parser.add_argument('--no-page-filter', action='store_true',
+                        help="Send every page to Gemini, including blank, cover and instruction pages")
+    parser.add_argument('--response-cache', action='store_true',
+                        help="Replay Gemini responses cached by earlier runs for identical requests "
+                             "(default: off, every request calls Gemini)")
+    parser.add_argument('--response-cache-path', default='output/cache/gemini_responses.sqlite3',
+                        help="With --response-cache: SQLite file of the Gemini response cache "
+                             "(default: output/cache/gemini_responses.sqlite3)")
+    parser.add_argument('--response-cache-mb', type=int, default=512,
+                        help="With --response-cache: size bound of the response cache in MB (default: 512)")
+    parser.add_argument('--response-cache-days', type=float, default=30,
+                        help="With --response-cache: ignore cached responses older than this many days (default: 30)")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="Gemini requests kept in flight (default: 4)")
+    parser.add_argument('--rpm', type=float, default=8,
+                        help="Gemini requests per minute allowed by the API quota (default: 8)")
+    parser.add_argument('--tpm', type=float, default=250_000,
+                        help="Gemini tokens per minute allowed by the API quota (default: 250000)")
+    parser.add_argument('--upload-long-edge', type=int, default=2048,
+                        help="With --upload-optimizer: downscale page images to this long edge before "
+                             "sending them to Gemini (default: 2048, 0 keeps full size)")
+    parser.add_argument('--upload-mode', choices=['keep', 'gray', 'binary'], default='keep',
+                        help="With --upload-optimizer: send pages in their rendered colorspace, as grayscale, "
+                             "or as black/white")
+    parser.add_argument('--upload-codec', choices=['jpeg', 'webp', 'png'], default='jpeg',
+                        help="With --upload-optimizer: image codec of uploaded pages (default: jpeg)")
+    parser.add_argument('--upload-quality', type=int, default=90,
+                        help="With --upload-optimizer: JPEG/WebP quality of uploaded pages (default: 90)")
+    parser.add_argument('--upload-optimizer', action='store_true',
+                        help="Downscale and re-encode pages with the --upload-* settings before sending them "
+                             "to Gemini (default: full-resolution lossless pages)")
+    parser.add_argument('--no-streaming', action='store_true',
+                        help="Wait for each complete Gemini response instead of streaming it")
+    parser.add_argument('--structured-output', action='store_true',
+                        help="Constrain Gemini to JSON matching the response schemas and validate it in one pass")
+    parser.add_argument('--breaker-threshold', type=int, default=5,
+                        help="Consecutive Gemini server failures before falling back to local text/OCR "
+                             "for the remaining pages (default: 5, 0 disables the fallback)")
+    parser.add_argument('--breaker-probe-seconds', type=float, default=30,
+                        help="Seconds between Gemini health probes while falling back (default: 30)")
+    args = parser.parse_args()
     
-    process_answers_pdf(pdf_path, batch_size)
+    process_answers_pdf(
+        args.answers_pdf_file,
+        args.batch_size,
+        render_workers=args.render_workers,
+        analysis_dpi=args.analysis_dpi,
+        page_cache_dir=args.page_cache_dir if args.page_cache else None,
+        page_cache_mb=args.page_cache_mb,
+        colorspace=args.colorspace,
+        skip_non_question_pages=not args.no_page_filter,
+        response_cache_path=args.response_cache_path if args.response_cache else None,
+        response_cache_mb=args.response_cache_mb,
+        response_cache_days=args.response_cache_days,
+        concurrency=args.concurrency,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        upload_long_edge=args.upload_long_edge,
+        upload_mode=args.upload_mode,
+        upload_codec=args.upload_codec,
+        upload_quality=args.upload_quality,
+        optimize_uploads=args.upload_optimizer,
+        stream_responses=not args.no_streaming,
+        structured_output=args.structured_output,
+        breaker_threshold=args.breaker_threshold,
+        breaker_probe_seconds=args.breaker_probe_seconds,
+    )
@@ -13,23 +13,113 @@ import warnings
 warnings.filterwarnings('ignore', category=FutureWarning, module='google.api_core')
 
 import sys
-import time
 import os
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
-from app.services.pdf_processor import PDFProcessor
-from app.services.gemini_ocr_enriched import GeminiOCREnriched
-import numpy as np
-import cv2
+from app.services.pdf_processor import PDFProcessor, TEXT_LAYER_MIN_QUALITY
+from app.services.page_cache import PageRenderCache
+from app.services.detection_cache import PageDetectionCache
+from app.services.page_classifier import PageClassifier, calls_avoided
+from app.services.gemini_cache import GeminiResponseCache
+from app.services.gemini_engine import GeminiRequestEngine, RateLimiter
+from app.services.upload_optimizer import UploadOptimizer
+from app.services.gemini_retry import GeminiRequestError, CIRCUIT_OPEN, SERVER
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.local_extraction import extract_page_locally
+from app.services.question_segmenter import segment_questions
+from app.services.gemini_ocr_enriched import GeminiOCREnriched, PartialBatchError
+from app.services.gemini_usage import UsageRecorder
+from app.services.diagram_locator import locate_page_diagrams, unique_candidates
+from app.services.debug_recorder import debug_page, start_debug, stop_debug
+from detect_diagrams_vector import detect_diagrams_vector, is_scanned_page
+from page_features import PageFeatures
 import json
 from PIL import Image
 
-def enriched_batch_process_pdf(pdf_path: str, batch_size: int = 5):
+def save_diagram_crop(pdf_processor, page_img, page_num, box, diagram_path, **save_kwargs):
+    """
+    Crop box (x1, y1, x2, y2 in page image pixels) from a page and save it
+    
+    In two-resolution mode (or when no page image is given) the crop is
+    re-rendered from the PDF at full DPI instead of being cut out of the page.
+    """
+    if pdf_processor.analysis_dpi or page_img is None:
+        crop = Image.fromarray(pdf_processor.render_region(page_num, box))
+    else:
+        crop = page_img.crop(box)
+    crop.save(diagram_path, **save_kwargs)
+    return crop
+
+def enriched_batch_process_pdf(
+    pdf_path: str,
+    batch_size: int = 5,
+    render_workers: int = 1,
+    analysis_dpi: int = None,
+    page_cache_dir: str = None,
+    page_cache_mb: int = 2048,
+    colorspace: str = 'rgb',
+    skip_non_question_pages: bool = True,
+    response_cache_path: str = None,
+    response_cache_mb: int = 512,
+    response_cache_days: float = 30,
+    concurrency: int = 4,
+    rpm: float = 8,
+    tpm: float = 250_000,
+    upload_long_edge: int = 2048,
+    upload_mode: str = 'keep',
+    upload_codec: str = 'jpeg',
+    upload_quality: int = 90,
+    optimize_uploads: bool = False,
+    stream_responses: bool = True,
+    structured_output: bool = False,
+    context_cache_minutes: float = None,
+    breaker_threshold: int = 5,
+    breaker_probe_seconds: float = 30,
+    question_regions: bool = False,
+    debug_bundle: str = None,
+):
     """
     Process PDF with batched API calls AND auto-enrichment
     
     Args:
         pdf_path: Path to PDF file
         batch_size: Number of pages to process per API call (default: 5)
+        render_workers: Worker processes used to rasterize pages (default: 1, serial)
+        analysis_dpi: Render pages at this DPI for detection and Gemini, re-rendering
+            only diagram crops at full DPI (default: None, everything at full DPI)
+        page_cache_dir: Directory of the rendered page cache (default: None, disabled)
+        page_cache_mb: Size bound of the page cache in MB
+        colorspace: Page render colorspace: 'rgb', 'gray' or 'binary' (default: 'rgb')
+        skip_non_question_pages: Don't send blank, cover and instruction pages to Gemini
+        response_cache_path: SQLite file of the Gemini response cache (default: None, disabled)
+        response_cache_mb: Size bound of the response cache in MB
+        response_cache_days: Age in days after which cached responses are ignored
+        concurrency: Gemini requests kept in flight (default: 4)
+        rpm: Gemini requests per minute allowed by the API quota (default: 8)
+        tpm: Gemini tokens per minute allowed by the API quota (default: 250k)
+        upload_long_edge: Downscale page images to this long edge before upload (0: full size)
+        upload_mode: Upload pages as 'keep' (rendered colorspace), 'gray' or 'binary'
+        upload_codec: Upload image codec: 'jpeg', 'webp' or 'png'
+        upload_quality: JPEG/WebP quality of uploaded pages
+        optimize_uploads: Encode uploads with the settings above instead of sending full-resolution
+            pages with the SDK's lossless WebP (default: False)
+        stream_responses: Stream Gemini responses and start diagram detection for each question
+            as soon as it is generated
+        structured_output: Constrain Gemini's JSON output to the pydantic response schemas
+        context_cache_minutes: Cache the static enriched prompt server-side for this many minutes
+            and send only page images per call (default: None, prompt sent with every call)
+        breaker_threshold: Consecutive Gemini server failures that open the circuit breaker;
+            while open, pages are processed locally (text layer/Tesseract, no enrichment) and
+            flagged for re-enrichment (0: no breaker, failed pages are reported instead)
+        breaker_probe_seconds: Seconds between background health probes while the breaker is open
+        question_regions: Cut pages into per-question regions at their question numbers (text
+            layer or Tesseract) and send each region as its own small request; diagrams are then
+            only taken from the question's own region
+        debug_bundle: Zip file collecting detector intermediates (grid line images, filter
+            diagnostics), set-of-marks images and raw Gemini responses per page
+            (default: None, debug mode off - nothing is captured)
     """
     from PIL import Image
     
@@ -53,56 +143,628 @@ def enriched_batch_process_pdf(pdf_path: str, batch_size: int = 5):
         print("⚠ Error: GEMINI_API_KEY not found in .env file")
         sys.exit(1)
     
-    gemini_ocr = GeminiOCREnriched(api_key=gemini_api_key)
-    pdf_processor = PDFProcessor(gemini_ocr=None)  # We'll handle OCR separately
+    response_cache = None
+    if response_cache_path:
+        response_cache = GeminiResponseCache(
+            response_cache_path,
+            ttl_seconds=response_cache_days * 24 * 3600,
+            max_bytes=response_cache_mb * 1024 * 1024,
+        )
+    rate_limiter = RateLimiter(rpm=rpm, tpm=tpm)
+    usage_recorder = UsageRecorder()
+    circuit_breaker = None
+    if breaker_threshold > 0:
+        circuit_breaker = CircuitBreaker(failure_threshold=breaker_threshold, probe_interval=breaker_probe_seconds)
+    upload_optimizer = None
+    if optimize_uploads:
+        upload_optimizer = UploadOptimizer(
+            max_long_edge=upload_long_edge, mode=upload_mode, codec=upload_codec, quality=upload_quality
+        )
+    gemini_ocr = GeminiOCREnriched(
+        api_key=gemini_api_key,
+        response_cache=response_cache,
+        rate_limiter=rate_limiter,
+        upload_optimizer=upload_optimizer,
+        structured_output=structured_output,
+        context_cache_ttl=context_cache_minutes * 60 if context_cache_minutes else None,
+        usage_recorder=usage_recorder,
+        circuit_breaker=circuit_breaker,
+    )
+    page_cache = None
+    if page_cache_dir:
+        page_cache = PageRenderCache(page_cache_dir, max_bytes=page_cache_mb * 1024 * 1024)
+    pdf_processor = PDFProcessor(
+        gemini_ocr=None,  # We'll handle OCR separately
+        render_workers=render_workers,
+        analysis_dpi=analysis_dpi,
+        page_cache=page_cache,
+        colorspace=colorspace,
+    )
+    if debug_bundle:
+        start_debug(debug_bundle, pdf=pdf_path, batch_size=batch_size, dpi=pdf_processor.render_dpi,
+                    colorspace=colorspace, question_regions=question_regions)
+    page_classifier = PageClassifier() if skip_non_question_pages else None
+    render_dpi = pdf_processor.render_dpi
+    # Paddings below are in 300 DPI pixels; scale them to the rendered page
+    pixel_scale = pdf_processor.pixel_scale
     
     print("✓ Enhanced Gemini Vision OCR enabled")
+    if pdf_processor.analysis_dpi:
+        print(f"✓ Two-resolution mode: analysis at {render_dpi} DPI, crops at {pdf_processor.dpi} DPI")
     print(f"\nProcessing PDF: {pdf_path}\n")
     
-    # Convert PDF to images first
+    # Pages are rendered lazily, one window at a time, so memory scales with batch_size * concurrency
     print("="*50)
-    print("Converting PDF to images...")
+    print("Streaming PDF pages...")
     print("="*50)
     
-    page_images = pdf_processor.pdf_to_images(pdf_path)
-    total_pages = len(page_images)
-    print(f"✓ Converted {total_pages} pages\n")
+    total_pages = pdf_processor.get_page_count(pdf_path)
+    print(f"✓ Found {total_pages} pages\n")
     
     # Process pages in batches with enrichment
     enriched_questions = []
     total_api_calls = 0
+    cached_api_calls = 0  # Extraction calls replayed from the response cache
+    skipped_pages = []  # Pages the local classifier kept away from Gemini
+    api_calls_avoided = 0  # Gemini calls those pages would have taken
+    failed_pages = []  # Pages whose Gemini request failed for good (after retries)
+    degraded_pages = []  # Pages processed locally while the circuit breaker was open
+    
+    # Each Gemini call carries batch_size pages and `concurrency` calls run at once, so pages are
+    # rendered batch_size * concurrency at a time; the shared limiter enforces RPM/TPM quota
+    engine = GeminiRequestEngine(concurrency=concurrency)
+    render_window = batch_size * engine.concurrency
+    
+    # Diagram detection runs on a single worker thread (the PDF document isn't thread-safe). With
+    # streaming it is fed each question as soon as Gemini has generated it, overlapping local CPU
+    # work with generation; the final results reuse those jobs when the question came back unchanged
+    diagram_worker = ThreadPoolExecutor(max_workers=1)
+    diagram_jobs = {}  # (page number, question JSON) -> Future of the question's diagrams
+    diagram_jobs_lock = threading.Lock()
+    scanned_pages = {}  # page number -> is a scan
+    # Each detector runs once per page; every question of the page picks from its results
+    detection_cache = PageDetectionCache()
+    # Rendered pages of the current batch, shared by the detectors and crops instead of re-reading page_N.png
+    page_features = {}  # page number -> PageFeatures
+    
+    def page_pil(actual_page_num):
+        """The rendered page as a PIL image (no copy, no decode)"""
+        return Image.fromarray(page_features[actual_page_num].image)
+    
+    def vector_detections(actual_page_num):
+        def detect():
+            # The main thread renders pages and reads text layers from the same document
+            with pdf_processor.doc_lock:
+                return detect_diagrams_vector(pdf_processor.get_page(actual_page_num), dpi=render_dpi)
+        return detection_cache.detections('vector', actual_page_num, detect, dpi=render_dpi)
+    
+    def hybrid_detections(actual_page_num):
+        from detect_diagrams_hybrid import detect_diagrams_hybrid
+        with debug_page(actual_page_num):
+            features = page_features[actual_page_num]
+            return detection_cache.detections('hybrid', actual_page_num, lambda: detect_diagrams_hybrid(
+                features, dpi=render_dpi
+            ), image_key=features.fingerprint, dpi=render_dpi)
+    
+    def yolo_detections(actual_page_num):
+        from detect_diagrams_yolo import detect_diagrams_yolo
+        with debug_page(actual_page_num):
+            features = page_features[actual_page_num]
+            return detection_cache.detections('yolo', actual_page_num, lambda: detect_diagrams_yolo(
+                features, dpi=render_dpi
+            ), image_key=features.fingerprint, dpi=render_dpi)
+    
+    def save_crop(page_img, actual_page_num, box, diagram_path, **save_kwargs):
+        """save_diagram_crop, skipped when another question of the page already saved this crop"""
+        if not detection_cache.crop_saved(actual_page_num, diagram_path, box):
+            save_diagram_crop(pdf_processor, page_img, actual_page_num, box, diagram_path, **save_kwargs)
+    
+    def detect_question_diagrams(actual_page_num, question):
+        """
+        Find, crop and save the diagrams a question refers to
+        
+        Runs on the diagram worker, so questions streamed by Gemini are
+        handled while the rest of their batch is still being generated.
+        
+        Questions extracted from a question region only get the diagrams
+        inside that region.
+        
+        Returns:
+            List of diagram dicts for the question
+        """
+        enrichment = question.get('enrichment', {})
+        region = (question.get('question_region') or {}).get('bbox')
+        # Several questions of a page can have diagrams: name region crops after their question number
+        file_prefix = f"page_{actual_page_num}"
+        if region:
+            file_prefix += f"_q{question['question_region']['number']}"
+        
+        def in_region(bbox):
+            """Whether a detection's center lies in the question's region (always without one)"""
+            if not region:
+                return True
+            center_x, center_y = (bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2
+            return region[0] <= center_x < region[2] and region[1] <= center_y < region[3]
+        
+        # Born-digital pages carry their diagrams in the drawing layer; only scans need raster detection
+        if actual_page_num not in scanned_pages:
+            with pdf_processor.doc_lock:
+                scanned_pages[actual_page_num] = is_scanned_page(pdf_processor.get_page(actual_page_num))
+        page_is_scanned = scanned_pages[actual_page_num]
+        
+        # Use hybrid AI detection for better diagram extraction
+        diagrams = []
+        output_dir = Path('output')
+        
+        # Check if we should detect diagrams - COMPREHENSIVE CHECK
+        question_text = question.get('question', '') or ''
+        parts_text = ' '.join(
+            part.get('question_text', '') or '' for part in question.get('parts', [])
+        )
+        question_type = question.get('question_type') or enrichment.get('question_type')
+        
+        # Enhanced diagram detection - check keywords first
+        text_content = (question_text + ' ' + parts_text).lower()
+        diagram_keywords = ['diagram', 'figure', 'graph', 'chart', 'plot', 'sketch', 'grid', 'map', 'shape', 'triangle', 'circle', 'polygon', 'quadrilateral', 'coordinate', 'dot diagram']
+        has_diagram_keyword = any(keyword in text_content for keyword in diagram_keywords)
+        
+        needs_diagram = (
+            has_diagram_keyword
+            or question_type == 'diagram_based'
+            or enrichment.get('requires_diagram', False) is True
+        )
+        
+        if needs_diagram and not page_is_scanned:
+            # Tier 0: Born-digital page - cluster vector paths and images, no pixels involved
+            try:
+                vector_detected = [d for d in vector_detections(actual_page_num) if in_region(d['bbox'])]
+                for idx, diag_info in enumerate(vector_detected[:3]):  # Take up to 3 detections
+                    # Use index in filename to support multiple diagrams
+                    suffix = f"_{idx+1}" if idx > 0 else ""
+                    diagram_name = f'{file_prefix}_diagram_vector{suffix}.png'
+                    diagram_path = output_dir / diagram_name
+                    save_crop(None, actual_page_num,
+                                      diag_info['bbox'], diagram_path, optimize=True)
+                    
+                    confidence = diag_info.get('confidence', 0)
+                    diagrams.append({
+                        'local_path': f'output/{diagram_name}',
+                        'filename': diagram_name,
+                        'page_number': actual_page_num,
+                        'file_size': os.path.getsize(diagram_path),
+                        'source': 'vector_detection',
+                        'confidence': confidence,
+                        'area': diag_info.get('area'),
+                        'density': diag_info.get('density')
+                    })
+                    x1, y1, x2, y2 = diag_info['bbox']
+                    print(f"      ✓ Vector layer diagram: {x2 - x1}x{y2 - y1} px (confidence: {confidence:.1f}%)")
+            except Exception as e:
+                print(f"      ⚠ Vector diagram detection failed: {e}")
+        
+        if needs_diagram and page_is_scanned and actual_page_num in page_features:
+            # Tier 1: Run hybrid AI detection (best accuracy)
+            try:
+                detected = hybrid_detections(actual_page_num)
+                
+                if detected:
+                    # Save detected diagrams
+                    page_img = page_pil(actual_page_num)
+                    
+                    # Filter out low confidence detections to prefer fallback
+                    high_conf_detected = [d for d in detected if d.get('confidence', 0) > 85 and in_region(d['bbox'])]
+                    
+                    for idx, diag_info in enumerate(high_conf_detected[:3]):  # Take up to 3 high-confidence detections
+                        x1, y1, x2, y2 = diag_info['bbox']
+                        padding = int(40 * pixel_scale)
+                        x1 = max(0, x1 - padding)
+                        y1 = max(0, y1 - padding)
+                        x2 = min(page_img.width, x2 + padding)
+                        y2 = min(page_img.height, y2 + padding)
+                        
+                        # Use index in filename to support multiple diagrams
+                        suffix = f"_{idx+1}" if idx > 0 else ""
+                        diagram_name = f'{file_prefix}_diagram_ai{suffix}.png'
+                        diagram_path = output_dir / diagram_name
+                        save_crop(page_img, actual_page_num,
+                                          (x1, y1, x2, y2), diagram_path, optimize=True)
+                        
+                        confidence = diag_info.get('confidence', 0)
+                        diagrams.append({
+                            'local_path': f'output/{diagram_name}',
+                            'filename': diagram_name,
+                            'page_number': actual_page_num,
+                            'file_size': os.path.getsize(diagram_path),
+                            'source': 'hybrid_ai_detection',
+                            'confidence': confidence,
+                            'area': diag_info.get('area'),
+                            'density': diag_info.get('density')
+                        })
+                        w = x2 - x1
+                        h = y2 - y1
+                        print(f"      ✓ AI detected diagram: {w}x{h} px (confidence: {confidence:.1f}%)")
+            except Exception as e:
+                print(f"      ⚠ Hybrid AI detection failed: {e}")
+            
+            # Tier 2: Try YOLOv8 if hybrid detection found nothing
+            if not diagrams and needs_diagram:
+                try:
+                    print(f"      → Trying YOLOv8 fallback...")
+                    yolo_detected = [
+                        d for d in yolo_detections(actual_page_num)
+                        if in_region(d['bbox'])
+                    ]
+                    
+                    if yolo_detected:
+                        page_img = page_pil(actual_page_num)
+                        
+                        for idx, diag_info in enumerate(yolo_detected[:3]):  # Take up to 3 detections
+                            x1, y1, x2, y2 = diag_info['bbox']
+                            padding = int(40 * pixel_scale)
+                            x1 = max(0, x1 - padding)
+                            y1 = max(0, y1 - padding)
+                            x2 = min(page_img.width, x2 + padding)
+                            y2 = min(page_img.height, y2 + padding)
+                            
+                            # Use index in filename to support multiple diagrams
+                            suffix = f"_{idx+1}" if idx > 0 else ""
+                            diagram_name = f'{file_prefix}_diagram_yolo{suffix}.png'
+                            diagram_path = output_dir / diagram_name
+                            save_crop(page_img, actual_page_num,
+                                              (x1, y1, x2, y2), diagram_path, optimize=True)
+                            
+                            confidence = diag_info.get('confidence', 0)
+                            diagrams.append({
+                                'local_path': f'output/{diagram_name}',
+                                'filename': diagram_name,
+                                'page_number': actual_page_num,
+                                'file_size': os.path.getsize(diagram_path),
+                                'source': 'yolov8_detection',
+                                'confidence': confidence,
+                                'area': diag_info.get('area')
+                            })
+                            w = x2 - x1
+                            h = y2 - y1
+                            print(f"      ✓ YOLOv8 detected diagram: {w}x{h} px (confidence: {confidence:.1f}%)")
+                except Exception as e:
+                    print(f"      ⚠ YOLOv8 detection failed: {e}")
+                    # Tier 3: Final fallback to existing detected diagrams
+                    for diagram_file in output_dir.glob(f'{file_prefix}_diagram_*.png'):
+                        diagrams.append({
+                            'local_path': f'output/{diagram_file.name}',
+                            'filename': diagram_file.name,
+                            'page_number': actual_page_num,
+                            'file_size': os.path.getsize(diagram_file)
+                        })
+        
+        # If Gemini provided diagram_bbox, use it to create a precise crop
+        diagram_bbox = enrichment.get('diagram_bbox')
+        if diagram_bbox and not diagrams:
+            if actual_page_num in page_features:
+                try:
+                    img = page_pil(actual_page_num)
+                    x = diagram_bbox.get('x', 0)
+                    y = diagram_bbox.get('y', 0)
+                    w = diagram_bbox.get('width', img.width)
+                    h = diagram_bbox.get('height', img.height)
+                    
+                    # Add padding
+                    padding = int(50 * pixel_scale)
+                    x = max(0, x - padding)
+                    y = max(0, y - padding)
+                    w = min(img.width - x, w + 2*padding)
+                    h = min(img.height - y, h + 2*padding)
+                    
+                    gemini_crop_name = f'{file_prefix}_diagram_gemini.png'
+                    gemini_crop_path = output_dir / gemini_crop_name
+                    save_crop(img, actual_page_num,
+                                      (x, y, x + w, y + h), gemini_crop_path)
+                    
+                    diagrams.append({
+                        'local_path': f'output/{gemini_crop_name}',
+                        'filename': gemini_crop_name,
+                        'page_number': actual_page_num,
+                        'file_size': os.path.getsize(gemini_crop_path),
+                        'source': 'gemini_bbox'
+                    })
+                    print(f"      ✓ Created diagram from Gemini bbox: {w}x{h} at ({x},{y})")
+                except Exception as e:
+                    print(f"      ⚠ Failed to crop using Gemini bbox: {e}")
+
+        # Nothing found locally and no Gemini bbox: the page's set-of-marks locate call assigns one
+        # (needs_diagram was already calculated above)
+        needs_locate = needs_diagram and not diagrams and actual_page_num in page_features
+        return diagrams, needs_locate
+    
+    def fallback_crop(actual_page_num, page_img, question):
+        """Conservative crop (the question's region, or the middle of the page) as a last resort"""
+        region = (question.get('question_region') or {}).get('bbox')
+        file_prefix = f"page_{actual_page_num}"
+        if region:
+            file_prefix += f"_q{question['question_region']['number']}"
+        crop_height = int(page_img.height * 0.5)
+        crop_start = int(page_img.height * 0.25)
+        fallback_name = f'{file_prefix}_diagram_fallback.png'
+        fallback_path = Path('output') / fallback_name
+        save_crop(page_img, actual_page_num,
+                          tuple(region) if region else
+                          (0, crop_start, page_img.width, crop_start + crop_height),
+                          fallback_path)
+        return {
+            'local_path': f'output/{fallback_name}',
+            'filename': fallback_name,
+            'page_number': actual_page_num,
+            'file_size': os.path.getsize(fallback_path),
+            'source': 'fallback_heuristic',
+            'confidence': 70.0,
+            'is_page_snapshot': True
+        }
+    
+    def page_diagram_candidates(actual_page_num):
+        """Every diagram box the local detectors find on a page, confident or not"""
+        try:
+            if not scanned_pages.get(actual_page_num):
+                detected = vector_detections(actual_page_num)
+            else:
+                detected = hybrid_detections(actual_page_num)
+                try:
+                    detected = detected + yolo_detections(actual_page_num)
+                except Exception as e:
+                    print(f"      ⚠ YOLOv8 candidates unavailable: {e}")
+        except Exception as e:
+            print(f"      ⚠ Diagram candidate detection failed: {e}")
+            detected = []
+        return unique_candidates(detected)
+    
+    def locate_question_diagrams(actual_page_num, questions):
+        """
+        Assign diagrams to all of a page's questions that still need one, in one Gemini call
+        
+        The page is sent once with the local detectors' candidate boxes drawn
+        and numbered on it (set-of-marks); Gemini picks a candidate id for
+        each question, or gives a box of its own when none fits.
+        
+        Returns:
+            List of diagram lists, one per question
+        """
+        output_dir = Path('output')
+        page_img = page_pil(actual_page_num)
+        candidates = page_diagram_candidates(actual_page_num)
+        numbers = ', '.join(f"Q{question.get('number')}" for question in questions)
+        print(f"      🤖 Using Gemini to locate diagrams for {numbers} on page {actual_page_num} "
+              f"({len(candidates)} candidate box(es))...")
+        
+        try:
+            located = locate_page_diagrams(
+                gemini_ocr.model, page_img, candidates, questions, gemini_ocr.retry_policy, actual_page_num,
+                rate_limiter=rate_limiter, breaker=circuit_breaker, upload_optimizer=upload_optimizer,
+                structured_output=structured_output
+            )
+        except Exception as e:
+            print(f"      ⚠ Gemini fallback failed: {e}, using basic crop")
+            if not isinstance(e, GeminiRequestError):
+                import traceback
+                traceback.print_exc()
+            return [[fallback_crop(actual_page_num, page_img, question)] for question in questions]
+        
+        results = []
+        for question, location in zip(questions, located):
+            if location is None:
+                # Gemini couldn't find diagram, use simple crop as last resort
+                print(f"      ⚠ Gemini couldn't locate a diagram for Q{question.get('number')}, using conservative crop")
+                results.append([fallback_crop(actual_page_num, page_img, question)])
+                continue
+            
+            region = (question.get('question_region') or {}).get('bbox')
+            file_prefix = f"page_{actual_page_num}"
+            if region:
+                file_prefix += f"_q{question['question_region']['number']}"
+            
+            # Add padding
+            x1, y1, x2, y2 = location['box']
+            padding = int(50 * pixel_scale)
+            x1, y1 = max(0, x1 - padding), max(0, y1 - padding)
+            x2, y2 = min(page_img.width, x2 + padding), min(page_img.height, y2 + padding)
+            
+            # Crop the diagram
+            fallback_name = f'{file_prefix}_diagram_gemini_fallback.png'
+            fallback_path = output_dir / fallback_name
+            save_crop(page_img, actual_page_num, (x1, y1, x2, y2), fallback_path)
+            
+            results.append([{
+                'local_path': f'output/{fallback_name}',
+                'filename': fallback_name,
+                'page_number': actual_page_num,
+                'file_size': os.path.getsize(fallback_path),
+                'source': location['source'],
+                'confidence': location['confidence'],  # Use Gemini's confidence score
+                'is_page_snapshot': False
+            }])
+            print(f"      ✓ Gemini located Q{question.get('number')} diagram: {x2 - x1}x{y2 - y1} at ({x1},{y1}) "
+                  f"- {'candidate %s' % location['candidate'] if location['candidate'] else 'own box'}, "
+                  f"Type: {location['type']}")
+        return results
+    
+    def diagram_job(page_num, question):
+        """Future of a question's diagrams, started once per distinct (page, question)"""
+        key = (page_num, json.dumps(question, sort_keys=True))
+        with diagram_jobs_lock:
+            if key not in diagram_jobs:
+                diagram_jobs[key] = diagram_worker.submit(detect_question_diagrams, page_num, question)
+            return diagram_jobs[key]
+    
+    def on_question(page_num, question):
+        print(f"    ⚡ Page {page_num} Q{question.get('number')} streamed - detecting diagrams", flush=True)
+        diagram_job(page_num, question)
     
-    # Rate limiting configuration
-    REQUESTS_PER_MINUTE = 8  # Stay under 10 RPM limit (with buffer)
-    SECONDS_BETWEEN_REQUESTS = 60 / REQUESTS_PER_MINUTE  # 7.5 seconds
-    
-    for batch_start in range(0, total_pages, batch_size):
-        # Rate limiting: Wait between batches (except first one)
-        if batch_start > 0:
-            print(f"\n⏱️  Rate limiting: Waiting {SECONDS_BETWEEN_REQUESTS:.1f}s to stay under API limits...")
-            time.sleep(SECONDS_BETWEEN_REQUESTS)
-        batch_end = min(batch_start + batch_size, total_pages)
-        batch_page_images = page_images[batch_start:batch_end]
-        batch_range = f"{batch_start + 1}-{batch_end}"
+    def extract_pages(pages, on_streamed=on_question):
+        gemini_ocr.pop_call_counts()
+        try:
+            chunk_results = gemini_ocr.extract_enriched_batch_quiz(
+                [(page_num, page_image) for page_num, page_image, _, _ in pages],
+                skip_ocr_text={page_num for page_num, _, _, use_text_layer in pages if use_text_layer},
+                on_question=on_streamed if stream_responses else None
+            )
+            error = None
+        except GeminiRequestError as e:
+            # Pages verified before part of the batch failed are kept
+            chunk_results, error = (e.results if isinstance(e, PartialBatchError) else {}), e
+        live_calls, cached_calls = gemini_ocr.pop_call_counts()
+        return chunk_results, live_calls, cached_calls, error
+    
+    def place_in_region(question, region):
+        """Move a question extracted from a region crop into page coordinates and tag its region"""
+        enrichment = question.get('enrichment')
+        if isinstance(enrichment, dict) and enrichment.get('diagram_bbox'):
+            bbox = dict(enrichment['diagram_bbox'])
+            bbox['x'] = bbox.get('x', 0) + region['bbox'][0]
+            bbox['y'] = bbox.get('y', 0) + region['bbox'][1]
+            enrichment['diagram_bbox'] = bbox
+        question['question_region'] = {'number': region['number'], 'bbox': list(region['bbox'])}
+        if region.get('continuation'):
+            # The rest of a question started on the previous page: its parts carry no question number
+            question['question_region']['continuation'] = True
+            if not question.get('number'):
+                question['number'] = region['number']
+        return question
+    
+    def extract_region(page, region):
+        """Enriched extraction of one question region of a page (the whole page without one)"""
+        if region is None:
+            return extract_pages([page])
+        actual_page_num, page_image, _, use_text_layer = page
+        x1, y1, x2, y2 = region['bbox']
+        crop = page_image[y1:y2, x1:x2]
+        chunk_results, live_calls, cached_calls, error = extract_pages(
+            [(actual_page_num, crop, None, use_text_layer)],
+            on_streamed=lambda page_num, question: on_question(page_num, place_in_region(question, region))
+        )
+        page_data = chunk_results.get(actual_page_num)
+        if page_data:
+            for question in ((page_data.get('quiz') or {}).get('questions') or []):
+                place_in_region(question, region)
+        return chunk_results, live_calls, cached_calls, error
+    
+    def merge_page_data(results, page_num, page_data):
+        """Add one request's data for a page to results (the regions of a page are concatenated)"""
+        if page_num not in results:
+            results[page_num] = page_data
+            return
+        merged = results[page_num]
+        merged['text'] = '\n'.join(text for text in (merged.get('text'), page_data.get('text')) if text)
+        merged_quiz = merged.get('quiz') or {}
+        merged_quiz['questions'] = (
+            (merged_quiz.get('questions') or []) + ((page_data.get('quiz') or {}).get('questions') or [])
+        )
+        merged['quiz'] = merged_quiz
+    
+    for batch_pages in pdf_processor.iter_page_batches(pdf_path, render_window):
+        batch_range = f"{batch_pages[0][0]}-{batch_pages[-1][0]}"
         
         print(f"\n{'='*50}")
-        print(f"ENRICHED BATCH: Pages {batch_range} ({len(batch_page_images)} pages)")
+        print(f"ENRICHED BATCH: Pages {batch_range} ({len(batch_pages)} pages)")
         print(f"{'='*50}")
         
-        # Process each page individually (Gemini API doesn't batch multiple images properly)
-        for idx, page_image in enumerate(batch_page_images):
-            actual_page_num = batch_start + idx + 1
+        # Local checks first, so only pages that need Gemini are sent
+        pending_pages = []
+        for actual_page_num, page_image in batch_pages:
+            print(f"\nChecking page {actual_page_num}...")
+            
+            # Born-digital pages already carry a usable text layer: don't pay Gemini to transcribe them
+            text_layout = pdf_processor.extract_text_layout(actual_page_num)
+            use_text_layer = text_layout['quality'] >= TEXT_LAYER_MIN_QUALITY
+            if use_text_layer:
+                print(f"  ✓ Text layer quality {text_layout['quality']:.2f}: skipping OCR transcription")
+            
+            # Blank, cover and instruction pages have no questions: don't pay for an API call
+            if page_classifier:
+                page_class = page_classifier.classify(page_image, text_layout['text'])
+                if page_class['skip']:
+                    print(f"  ⏭ Skipping {page_class['label']} page ({page_class['reason']})")
+                    skipped_pages.append({
+                        'page_number': actual_page_num,
+                        'label': page_class['label'],
+                        'reason': page_class['reason'],
+                    })
+                    continue
+            
+            pending_pages.append((actual_page_num, page_image, text_layout, use_text_layer))
+            page_features[actual_page_num] = PageFeatures(page_image, f'page_{actual_page_num}.png')
+        
+        if question_regions:
+            # Skipped pages have no question numbers, so each would have gone whole in one call
+            api_calls_avoided += len(batch_pages) - len(pending_pages)
+        else:
+            api_calls_avoided += calls_avoided(len(batch_pages), len(batch_pages) - len(pending_pages), batch_size)
+        
+        if question_regions:
+            # One small API call per question region; pages without question numbers go whole
+            page_chunks, page_calls = [], []
+            for page in pending_pages:
+                actual_page_num, page_image, text_layout, use_text_layer = page
+                regions = segment_questions(
+                    page_image, text_layout['lines'] if use_text_layer else None, pixel_scale
+                )
+                if regions:
+                    labels = [f"Q{region['number']}" + (" cont." if region.get('continuation') else "")
+                              for region in regions]
+                    print(f"  ✂ Page {actual_page_num}: {len(regions)} question region(s) ({', '.join(labels)})")
+                else:
+                    print(f"  ⚠ Page {actual_page_num}: no question numbers found - sending the whole page")
+                for region in regions or [None]:
+                    page_chunks.append([page])
+                    page_calls.append(functools.partial(extract_region, page, region))
+        else:
+            # One API call with ENRICHMENT per batch_size pages
+            page_chunks = [pending_pages[i:i + batch_size] for i in range(0, len(pending_pages), batch_size)]
+            page_calls = [functools.partial(extract_pages, chunk) for chunk in page_chunks]
+        
+        # Up to `concurrency` calls in flight; results come back in page order
+        if page_chunks:
+            print(f"\n🚀 Processing {len(pending_pages)} pages with enrichment in {len(page_chunks)} "
+                  f"call(s) ({engine.concurrency} in flight)...")
+        page_responses = engine.run(page_calls)
+        
+        page_outcomes = {}  # page number -> (page, results, error), regions of a page merged
+        for chunk, (chunk_results, live_calls, cached_calls, error) in zip(page_chunks, page_responses):
+            total_api_calls += live_calls
+            cached_api_calls += cached_calls
+            if cached_calls and not live_calls:
+                print(f"  ♻ Pages {', '.join(str(page[0]) for page in chunk)} served from Gemini response cache")
+            for page in chunk:
+                _, results, page_error = page_outcomes.get(page[0], (page, {}, None))
+                if page[0] in chunk_results:
+                    merge_page_data(results, page[0], chunk_results[page[0]])
+                page_outcomes[page[0]] = (page, results, page_error or (None if page[0] in chunk_results else error))
+        
+        for (actual_page_num, page_image, text_layout, use_text_layer), batch_results, error in page_outcomes.values():
             print(f"\nProcessing page {actual_page_num}...")
             
-            # Single API call per page with ENRICHMENT
-            print(f"🚀 Processing page {actual_page_num} with enrichment...")
-            total_api_calls += 1
+            # Gemini is unhealthy: keep the page with local text and regex-split questions
+            degraded = bool(error) and circuit_breaker is not None and error.category in (CIRCUIT_OPEN, SERVER)
+            if degraded:
+                batch_results = {actual_page_num: extract_page_locally(
+                    pdf_processor, actual_page_num, page_image, text_layout, use_text_layer
+                )}
+                degraded_pages.append(actual_page_num)
+                error = None
             
-            batch_results = gemini_ocr.extract_enriched_batch_quiz([(actual_page_num, page_image)])
+            # Report pages Gemini couldn't process instead of silently dropping them
+            if error:
+                print(f"  ❌ Page {actual_page_num} failed ({error.category}) after {error.attempts} attempt(s)")
+                failed_pages.append({
+                    'page_number': actual_page_num,
+                    'error_category': error.category,
+                    'attempts': error.attempts,
+                    'error': str(error.cause),
+                })
+                continue
             
             # Get enriched results for this page
             if actual_page_num in batch_results:
                 page_data = batch_results[actual_page_num]
+                if use_text_layer:
+                    page_data['text'] = text_layout['text']
                 page_text = page_data.get('text', '')
                 quiz_data = page_data.get('quiz', {})
                 
@@ -111,284 +773,23 @@ def enriched_batch_process_pdf(pdf_path: str, batch_size: int = 5):
                     quiz_data = {}
                 print(f"  ✓ Got {len(quiz_data.get('questions', []))} enriched questions")
                 
+                # Local diagram detection per question, then one set-of-marks locate call
+                # for all of the page's questions it couldn't place
+                page_questions = quiz_data.get('questions', [])
+                question_diagrams = [diagram_job(actual_page_num, question).result() for question in page_questions]
+                pending = [idx for idx, (_, needs_locate) in enumerate(question_diagrams) if needs_locate]
+                question_diagrams = [diagrams for diagrams, _ in question_diagrams]
+                if pending:
+                    located = diagram_worker.submit(
+                        locate_question_diagrams, actual_page_num, [page_questions[idx] for idx in pending]
+                    ).result()
+                    for idx, diagrams in zip(pending, located):
+                        question_diagrams[idx] = diagrams
+                
                 # Extract enriched questions
-                for question in quiz_data.get('questions', []):
+                for question, diagrams in zip(page_questions, question_diagrams):
                     enrichment = question.get('enrichment', {})
                     
-                    # Use hybrid AI detection for better diagram extraction
-                    diagrams = []
-                    output_dir = Path('output')
-                    page_snapshot = output_dir / f'page_{actual_page_num}.png'
-                    
-                    # Check if we should detect diagrams - COMPREHENSIVE CHECK
-                    question_text = question.get('question', '') or ''
-                    parts_text = ' '.join(
-                        part.get('question_text', '') or '' for part in question.get('parts', [])
-                    )
-                    question_type = question.get('question_type') or enrichment.get('question_type')
-                    
-                    # Enhanced diagram detection - check keywords first
-                    text_content = (question_text + ' ' + parts_text).lower()
-                    diagram_keywords = ['diagram', 'figure', 'graph', 'chart', 'plot', 'sketch', 'grid', 'map', 'shape', 'triangle', 'circle', 'polygon', 'quadrilateral', 'coordinate', 'dot diagram']
-                    has_diagram_keyword = any(keyword in text_content for keyword in diagram_keywords)
-                    
-                    needs_diagram = (
-                        has_diagram_keyword
-                        or question_type == 'diagram_based'
-                        or enrichment.get('requires_diagram', False) is True
-                    )
-                    
-                    if needs_diagram and page_snapshot.exists():
-                        # Tier 1: Run hybrid AI detection (best accuracy)
-                        try:
-                            from detect_diagrams_hybrid import detect_diagrams_hybrid
-                            detected = detect_diagrams_hybrid(str(page_snapshot))
-                            
-                            if detected:
-                                # Save detected diagrams
-                                from PIL import Image
-                                page_img = Image.open(page_snapshot)
-                                
-                                # Filter out low confidence detections to prefer fallback
-                                high_conf_detected = [d for d in detected if d.get('confidence', 0) > 85]
-                                
-                                for idx, diag_info in enumerate(high_conf_detected[:3]):  # Take up to 3 high-confidence detections
-                                    x1, y1, x2, y2 = diag_info['bbox']
-                                    padding = 40
-                                    x1 = max(0, x1 - padding)
-                                    y1 = max(0, y1 - padding)
-                                    x2 = min(page_img.width, x2 + padding)
-                                    y2 = min(page_img.height, y2 + padding)
-                                    
-                                    crop = page_img.crop((x1, y1, x2, y2))
-                                    # Use index in filename to support multiple diagrams
-                                    suffix = f"_{idx+1}" if idx > 0 else ""
-                                    diagram_name = f'page_{actual_page_num}_diagram_ai{suffix}.png'
-                                    diagram_path = output_dir / diagram_name
-                                    crop.save(diagram_path, optimize=True)
-                                    
-                                    confidence = diag_info.get('confidence', 0)
-                                    diagrams.append({
-                                        'local_path': f'output/{diagram_name}',
-                                        'filename': diagram_name,
-                                        'page_number': actual_page_num,
-                                        'file_size': os.path.getsize(diagram_path),
-                                        'source': 'hybrid_ai_detection',
-                                        'confidence': confidence,
-                                        'area': diag_info.get('area'),
-                                        'density': diag_info.get('density')
-                                    })
-                                    w = x2 - x1
-                                    h = y2 - y1
-                                    print(f"      ✓ AI detected diagram: {w}x{h} px (confidence: {confidence:.1f}%)")
-                        except Exception as e:
-                            print(f"      ⚠ Hybrid AI detection failed: {e}")
-                        
-                        # Tier 2: Try YOLOv8 if hybrid detection found nothing
-                        if not diagrams and needs_diagram:
-                            try:
-                                print(f"      → Trying YOLOv8 fallback...")
-                                from detect_diagrams_yolo import detect_diagrams_yolo
-                                yolo_detected = detect_diagrams_yolo(str(page_snapshot))
-                                
-                                if yolo_detected:
-                                    from PIL import Image
-                                    page_img = Image.open(page_snapshot)
-                                    
-                                    for idx, diag_info in enumerate(yolo_detected[:3]):  # Take up to 3 detections
-                                        x1, y1, x2, y2 = diag_info['bbox']
-                                        padding = 40
-                                        x1 = max(0, x1 - padding)
-                                        y1 = max(0, y1 - padding)
-                                        x2 = min(page_img.width, x2 + padding)
-                                        y2 = min(page_img.height, y2 + padding)
-                                        
-                                        crop = page_img.crop((x1, y1, x2, y2))
-                                        # Use index in filename to support multiple diagrams
-                                        suffix = f"_{idx+1}" if idx > 0 else ""
-                                        diagram_name = f'page_{actual_page_num}_diagram_yolo{suffix}.png'
-                                        diagram_path = output_dir / diagram_name
-                                        crop.save(diagram_path, optimize=True)
-                                        
-                                        confidence = diag_info.get('confidence', 0)
-                                        diagrams.append({
-                                            'local_path': f'output/{diagram_name}',
-                                            'filename': diagram_name,
-                                            'page_number': actual_page_num,
-                                            'file_size': os.path.getsize(diagram_path),
-                                            'source': 'yolov8_detection',
-                                            'confidence': confidence,
-                                            'area': diag_info.get('area')
-                                        })
-                                        w = x2 - x1
-                                        h = y2 - y1
-                                        print(f"      ✓ YOLOv8 detected diagram: {w}x{h} px (confidence: {confidence:.1f}%)")
-                            except Exception as e:
-                                print(f"      ⚠ YOLOv8 detection failed: {e}")
-                                # Tier 3: Final fallback to existing detected diagrams
-                                for diagram_file in output_dir.glob(f'page_{actual_page_num}_diagram_*.png'):
-                                    diagrams.append({
-                                        'local_path': f'output/{diagram_file.name}',
-                                        'filename': diagram_file.name,
-                                        'page_number': actual_page_num,
-                                        'file_size': os.path.getsize(diagram_file)
-                                    })
-                    
-                    # If Gemini provided diagram_bbox, use it to create a precise crop
-                    diagram_bbox = enrichment.get('diagram_bbox')
-                    if diagram_bbox and not diagrams:
-                        page_snapshot = output_dir / f'page_{actual_page_num}.png'
-                        if page_snapshot.exists():
-                            try:
-                                from PIL import Image
-                                img = Image.open(page_snapshot)
-                                x = diagram_bbox.get('x', 0)
-                                y = diagram_bbox.get('y', 0)
-                                w = diagram_bbox.get('width', img.width)
-                                h = diagram_bbox.get('height', img.height)
-                                
-                                # Add padding
-                                padding = 50
-                                x = max(0, x - padding)
-                                y = max(0, y - padding)
-                                w = min(img.width - x, w + 2*padding)
-                                h = min(img.height - y, h + 2*padding)
-                                
-                                cropped = img.crop((x, y, x + w, y + h))
-                                gemini_crop_name = f'page_{actual_page_num}_diagram_gemini.png'
-                                gemini_crop_path = output_dir / gemini_crop_name
-                                cropped.save(gemini_crop_path)
-                                
-                                diagrams.append({
-                                    'local_path': f'output/{gemini_crop_name}',
-                                    'filename': gemini_crop_name,
-                                    'page_number': actual_page_num,
-                                    'file_size': os.path.getsize(gemini_crop_path),
-                                    'source': 'gemini_bbox'
-                                })
-                                print(f"      ✓ Created diagram from Gemini bbox: {w}x{h} at ({x},{y})")
-                            except Exception as e:
-                                print(f"      ⚠ Failed to crop using Gemini bbox: {e}")
-
-                    # Fallback: if no diagram crops were detected but the question references a diagram,
-                    # use Gemini to intelligently locate the diagram on the page
-                    # (needs_diagram was already calculated above)
-                    
-                    if needs_diagram and not diagrams:
-                        page_snapshot = output_dir / f'page_{actual_page_num}.png'
-                        if page_snapshot.exists():
-                            try:
-                                from PIL import Image
-                                
-                                # Ask Gemini to locate the diagram
-                                print(f"      🤖 Using Gemini to locate diagram on page {actual_page_num}...")
-                                page_img = Image.open(page_snapshot)
-                                
-                                # Construct prompt to get diagram location
-                                question_context = question.get('question', '') or ''
-                                parts_summary = ' '.join(part.get('question_text', '')[:100] for part in question.get('parts', [])[:2])
-                                
-                                locate_prompt = f"""This page contains a diagram for the following question:
-"{question_context[:200]} {parts_summary[:200]}"
-
-Please analyze this page and return ONLY a JSON object with the bounding box of the diagram/chart/graph/table that relates to this question.
-Also provide a confidence score (0-100) indicating how sure you are that this is the correct diagram.
-
-Return format:
-{{"bbox": {{"x": <left>, "y": <top>, "width": <width>, "height": <height>}}, "type": "<diagram type>", "confidence": <0-100>}}
-
-If you cannot find a relevant diagram, return: {{"bbox": null, "type": "none", "confidence": 0}}
-"""
-                                
-                                import google.generativeai as genai
-                                response = gemini_ocr.model.generate_content([locate_prompt, page_img])
-                                result_text = response.text.strip()
-                                
-                                # Parse JSON from response
-                                if result_text.startswith('```'):
-                                    result_text = result_text.split('```')[1]
-                                    if result_text.startswith('json'):
-                                        result_text = result_text[4:]
-                                    result_text = result_text.strip()
-                                
-                                diagram_location = json.loads(result_text)
-                                
-                                if diagram_location.get('bbox') and diagram_location['bbox']:
-                                    bbox = diagram_location['bbox']
-                                    x, y, w, h = bbox['x'], bbox['y'], bbox['width'], bbox['height']
-                                    
-                                    # Add padding
-                                    padding = 50
-                                    x = max(0, x - padding)
-                                    y = max(0, y - padding)
-                                    w = min(page_img.width - x, w + 2*padding)
-                                    h = min(page_img.height - y, h + 2*padding)
-                                    
-                                    # Crop the diagram
-                                    cropped = page_img.crop((x, y, x + w, y + h))
-                                    fallback_name = f'page_{actual_page_num}_diagram_gemini_fallback.png'
-                                    fallback_path = output_dir / fallback_name
-                                    cropped.save(fallback_path)
-                                    
-                                    # Use Gemini's confidence score
-                                    confidence_score = float(diagram_location.get('confidence', 60.0))
-                                    
-                                    diagrams.append({
-                                        'local_path': f'output/{fallback_name}',
-                                        'filename': fallback_name,
-                                        'page_number': actual_page_num,
-                                        'file_size': os.path.getsize(fallback_path),
-                                        'source': 'gemini_intelligent_fallback',
-                                        'confidence': confidence_score,
-                                        'is_page_snapshot': False
-                                    })
-                                    print(f"      ✓ Gemini located diagram: {w}x{h} at ({x},{y}) - Type: {diagram_location.get('type', 'unknown')}")
-                                else:
-                                    # Gemini couldn't find diagram, use simple crop as last resort
-                                    print(f"      ⚠ Gemini couldn't locate specific diagram, using conservative crop")
-                                    crop_height = int(page_img.height * 0.5)
-                                    crop_start = int(page_img.height * 0.25)
-                                    tight = page_img.crop((0, crop_start, page_img.width, crop_start + crop_height))
-                                    
-                                    fallback_name = f'page_{actual_page_num}_diagram_fallback.png'
-                                    fallback_path = output_dir / fallback_name
-                                    tight.save(fallback_path)
-                                    
-                                    diagrams.append({
-                                        'local_path': f'output/{fallback_name}',
-                                        'filename': fallback_name,
-                                        'page_number': actual_page_num,
-                                        'file_size': os.path.getsize(fallback_path),
-                                        'source': 'fallback_heuristic',
-                                        'confidence': 70.0,
-                                        'is_page_snapshot': True
-                                    })
-                                    
-                            except Exception as e:
-                                print(f"      ⚠ Gemini fallback failed: {e}, using basic crop")
-                                import traceback
-                                traceback.print_exc()
-                                # Final fallback to simple crop
-                                page_img = Image.open(page_snapshot)
-                                crop_height = int(page_img.height * 0.5)
-                                crop_start = int(page_img.height * 0.25)
-                                tight = page_img.crop((0, crop_start, page_img.width, crop_start + crop_height))
-                                
-                                fallback_name = f'page_{actual_page_num}_diagram_fallback.png'
-                                fallback_path = output_dir / fallback_name
-                                tight.save(fallback_path)
-                                
-                                diagrams.append({
-                                    'local_path': f'output/{fallback_name}',
-                                    'filename': fallback_name,
-                                    'page_number': actual_page_num,
-                                    'file_size': os.path.getsize(fallback_path),
-                                    'source': 'fallback_heuristic',
-                                    'confidence': 70.0,
-                                    'is_page_snapshot': True
-                                })
-                    
-                    
                     enriched_question = {
                         'page_number': actual_page_num,
                         'question_num': question.get('number'),
@@ -412,10 +813,13 @@ If you cannot find a relevant diagram, return: {{"bbox": null, "type": "none", "
                         
                         # Calculate total marks
                         'marks': sum(part.get('marks') or 0 for part in question.get('parts', [])),
+                        'question_region': question.get('question_region'),  # With --question-regions
                         
                         # Status
                         'status': 'draft',  # Needs admin verification
                         'is_verified': False,
+                        'needs_enrichment': degraded,  # Extracted locally while Gemini was down
+                        'truncated': bool(question.get('truncated')),  # Cut off in Gemini's response: re-request it
                     }
                     
                     # Skip questions with no content (no question_text and no parts)
@@ -431,11 +835,49 @@ If you cannot find a relevant diagram, return: {{"bbox": null, "type": "none", "
                           f"({enrichment.get('difficulty')}, {school_level}){diagram_note}")
             else:
                 print(f"  ⚠ No data for page {actual_page_num}")
+        
+        # Let detection of streamed questions that were superseded (retried or re-mapped requests)
+        # finish before the next batch is rasterized
+        wait(list(diagram_jobs.values()))
+        diagram_jobs.clear()
+        page_features.clear()
+        detection_cache.invalidate()
+        
+        # Release this batch's rendered pages before the next batch is rasterized
+        del batch_pages, page_image, pending_pages, page_chunks, page_responses, page_outcomes
+    
+    diagram_worker.shutdown()
+    bundle_path = stop_debug()
+    
+    # Per-call token/latency/cost records, aggregated per page, prompt and job
+    usage_file = Path('output/enriched') / 'usage_summary.json'
+    usage = usage_recorder.write(usage_file)['job']
     
     print(f"\n{'='*50}")
     print(f"ENRICHED PDF processing complete!")
     print(f"Processed {total_pages} pages")
     print(f"🎯 Total API calls used: {total_api_calls}")
+    print(f"⏭ API calls avoided (blank/cover/instruction pages): {api_calls_avoided} "
+          f"({len(skipped_pages)} page(s) skipped)")
+    if response_cache:
+        print(f"♻ API calls served from response cache: {cached_api_calls}")
+        response_cache.close()
+    print(f"💵 Gemini usage: {usage['prompt_tokens']} prompt + {usage['output_tokens']} output tokens, "
+          f"{usage['latency_seconds']:.1f}s, ~${usage['cost_usd']:.4f} (details: {usage_file})")
+    if gemini_ocr.prompt_tokens_saved:
+        print(f"♻ Prompt tokens served from context cache: ~{gemini_ocr.prompt_tokens_saved}")
+    if detection_cache.hits:
+        print(f"♻ Page diagram detections reused across questions: {detection_cache.hits} "
+              f"({detection_cache.misses} detector run(s))")
+    if bundle_path:
+        print(f"🐞 Debug bundle: {bundle_path}")
+    if failed_pages:
+        print(f"❌ Failed pages: {', '.join(str(p['page_number']) for p in failed_pages)}")
+    if degraded_pages:
+        print(f"↓ Pages processed locally while Gemini was unavailable (need re-enrichment): "
+              f"{', '.join(map(str, degraded_pages))}")
+    if rate_limiter.throttles:
+        print(f"⏱️  API throttled {rate_limiter.throttles} time(s); final rate {rate_limiter.current_rpm:.1f} RPM")
     print(f"📚 Total enriched questions: {len(enriched_questions)}")
     print(f"{'='*50}\n")
     
@@ -445,6 +887,13 @@ If you cannot find a relevant diagram, return: {{"bbox": null, "type": "none", "
             "filename": Path(pdf_path).name,
             "total_pages": total_pages,
             "api_calls_used": total_api_calls,
+            "api_calls_avoided": api_calls_avoided,
+            "skipped_pages": skipped_pages,
+            "cached_api_calls": cached_api_calls,
+            "prompt_tokens_saved": gemini_ocr.prompt_tokens_saved,
+            "usage": usage,
+            "failed_pages": failed_pages,
+            "degraded_pages": degraded_pages,
             "total_questions": len(enriched_questions),
             "processing_complete": True
         },
@@ -500,7 +949,7 @@ If you cannot find a relevant diagram, return: {{"bbox": null, "type": "none", "
     print("\n📊 Summary by Topic:")
     topics = {}
     for q in enriched_questions:
-        topic = q.get('topic', 'Unknown')
+        topic = q.get('topic') or 'Unknown'
         if topic not in topics:
             topics[topic] = {'easy': 0, 'medium': 0, 'hard': 0, 'total': 0}
         
@@ -525,18 +974,116 @@ If you cannot find a relevant diagram, return: {{"bbox": null, "type": "none", "
     return output
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python test_enriched_batch_processor.py <pdf_file> [batch_size]")
-        print("Example: python test_enriched_batch_processor.py exam.pdf 5")
-        print("\nThis script outputs questions with automatic enrichment:")
-        print("  - Topic detection")
-        print("  - Difficulty assessment")
-        print("  - Keywords and learning outcomes")
-        print("  - Ready for adaptive learning platform")
-        sys.exit(1)
+    import argparse
     
-    pdf_path = sys.argv[1]
-    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    parser = argparse.ArgumentParser(
+        description="Process an exam PDF into enriched questions for the adaptive learning platform.",
+        epilog=(
+            "Example: python test_enriched_batch_processor.py exam.pdf 5 --render-workers 8\n\n"
+            "This script outputs questions with automatic enrichment:\n"
+            "  - Topic detection\n"
+            "  - Difficulty assessment\n"
+            "  - Keywords and learning outcomes\n"
+            "  - Ready for adaptive learning platform"
+        ),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('pdf_file', help="PDF file to process")
+    parser.add_argument('batch_size', nargs='?', type=int, default=5, help="Pages per Gemini call (default: 5)")
+    parser.add_argument('--render-workers', type=int, default=1,
+                        help="Rasterize pages in N worker processes (default: 1, serial)")
+    parser.add_argument('--analysis-dpi', type=int, default=None,
+                        help="Render pages at this DPI for detection and Gemini; only diagram crops "
+                             "are re-rendered at full DPI (e.g. 100)")
+    parser.add_argument('--page-cache', action='store_true',
+                        help="Reuse rendered pages across runs of the same PDF from an on-disk cache "
+                             "(default: off, pages are always rendered)")
+    parser.add_argument('--page-cache-dir', default='output/cache/pages',
+                        help="With --page-cache: directory of the rendered page cache (default: output/cache/pages)")
+    parser.add_argument('--page-cache-mb', type=int, default=2048,
+                        help="With --page-cache: size bound of the page cache in MB (default: 2048)")
+    parser.add_argument('--colorspace', choices=['rgb', 'gray', 'binary'], default='rgb',
+                        help="Render pages as RGB, single-channel grayscale, or 1-bit black/white "
+                             "(gray/binary use ~3x less memory on text-dominant papers)")
+    parser.add_argument('--no-page-filter', action='store_true',
+                        help="Send every page to Gemini, including blank, cover and instruction pages")
+    parser.add_argument('--response-cache', action='store_true',
+                        help="Replay Gemini responses cached by earlier runs for identical requests "
+                             "(default: off, every request calls Gemini)")
+    parser.add_argument('--response-cache-path', default='output/cache/gemini_responses.sqlite3',
+                        help="With --response-cache: SQLite file of the Gemini response cache "
+                             "(default: output/cache/gemini_responses.sqlite3)")
+    parser.add_argument('--response-cache-mb', type=int, default=512,
+                        help="With --response-cache: size bound of the response cache in MB (default: 512)")
+    parser.add_argument('--response-cache-days', type=float, default=30,
+                        help="With --response-cache: ignore cached responses older than this many days (default: 30)")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="Gemini requests kept in flight (default: 4)")
+    parser.add_argument('--rpm', type=float, default=8,
+                        help="Gemini requests per minute allowed by the API quota (default: 8)")
+    parser.add_argument('--tpm', type=float, default=250_000,
+                        help="Gemini tokens per minute allowed by the API quota (default: 250000)")
+    parser.add_argument('--upload-long-edge', type=int, default=2048,
+                        help="With --upload-optimizer: downscale page images to this long edge before "
+                             "sending them to Gemini (default: 2048, 0 keeps full size)")
+    parser.add_argument('--upload-mode', choices=['keep', 'gray', 'binary'], default='keep',
+                        help="With --upload-optimizer: send pages in their rendered colorspace, as grayscale, "
+                             "or as black/white")
+    parser.add_argument('--upload-codec', choices=['jpeg', 'webp', 'png'], default='jpeg',
+                        help="With --upload-optimizer: image codec of uploaded pages (default: jpeg)")
+    parser.add_argument('--upload-quality', type=int, default=90,
+                        help="With --upload-optimizer: JPEG/WebP quality of uploaded pages (default: 90)")
+    parser.add_argument('--upload-optimizer', action='store_true',
+                        help="Downscale and re-encode pages with the --upload-* settings before sending them "
+                             "to Gemini (default: full-resolution lossless pages)")
+    parser.add_argument('--no-streaming', action='store_true',
+                        help="Wait for each complete Gemini response instead of streaming it")
+    parser.add_argument('--structured-output', action='store_true',
+                        help="Constrain Gemini to JSON matching the response schemas and validate it in one pass")
+    parser.add_argument('--context-cache', action='store_true',
+                        help="Store the static enriched prompt as Gemini cached context and send only page "
+                             "images per call (needs a paid-tier API key; falls back to inline prompts)")
+    parser.add_argument('--context-cache-minutes', type=float, default=60,
+                        help="Lifetime of the cached prompt context in minutes (default: 60)")
+    parser.add_argument('--breaker-threshold', type=int, default=5,
+                        help="Consecutive Gemini server failures before falling back to local text/OCR "
+                             "for the remaining pages (default: 5, 0 disables the fallback)")
+    parser.add_argument('--breaker-probe-seconds', type=float, default=30,
+                        help="Seconds between Gemini health probes while falling back (default: 30)")
+    parser.add_argument('--question-regions', action='store_true',
+                        help="Cut pages into per-question regions at their question numbers and send each "
+                             "region as its own request (smaller outputs, diagrams matched by region)")
+    parser.add_argument('--debug-bundle', nargs='?', const='output/debug/debug_bundle.zip', default=None,
+                        metavar='ZIP',
+                        help="Capture detector intermediates and raw Gemini responses per page into one zip "
+                             "(default path: output/debug/debug_bundle.zip; off unless given)")
+    args = parser.parse_args()
     
-    enriched_batch_process_pdf(pdf_path, batch_size)
-
+    enriched_batch_process_pdf(
+        args.pdf_file,
+        args.batch_size,
+        render_workers=args.render_workers,
+        analysis_dpi=args.analysis_dpi,
+        page_cache_dir=args.page_cache_dir if args.page_cache else None,
+        page_cache_mb=args.page_cache_mb,
+        colorspace=args.colorspace,
+        skip_non_question_pages=not args.no_page_filter,
+        response_cache_path=args.response_cache_path if args.response_cache else None,
+        response_cache_mb=args.response_cache_mb,
+        response_cache_days=args.response_cache_days,
+        concurrency=args.concurrency,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        upload_long_edge=args.upload_long_edge,
+        upload_mode=args.upload_mode,
+        upload_codec=args.upload_codec,
+        upload_quality=args.upload_quality,
+        optimize_uploads=args.upload_optimizer,
+        stream_responses=not args.no_streaming,
+        structured_output=args.structured_output,
+        context_cache_minutes=args.context_cache_minutes if args.context_cache else None,
+        breaker_threshold=args.breaker_threshold,
+        breaker_probe_seconds=args.breaker_probe_seconds,
+        question_regions=args.question_regions,
+        debug_bundle=args.debug_bundle,
+    )
@@ -0,0 +1,83 @@
+"""
+Circuit breaker tests
+Only live API calls count towards the breaker; half-open admits a single trial request
+"""
+from types import SimpleNamespace
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from app.services.circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+from app.services.gemini_retry import CIRCUIT_OPEN, GeminiRequestError, RetryPolicy, call_with_retry
+
+
+NO_RETRY = RetryPolicy(max_attempts=1, max_parse_attempts=1, base_delay=0, max_delay=0)
+
+
+def _server_error():
+    raise google_exceptions.ServiceUnavailable('overloaded')
+
+
+def _call(request, breaker, cached=False):
+    model = SimpleNamespace(last_call_cached=cached)
+    return call_with_retry(request, NO_RETRY, model=model, breaker=breaker)
+
+
+def test_cache_hits_do_not_reset_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, probe_interval=3600)
+
+    with pytest.raises(GeminiRequestError):
+        _call(_server_error, breaker)
+    assert _call(lambda: 'replayed', breaker, cached=True) == 'replayed'
+    assert breaker.failures == 1
+    with pytest.raises(GeminiRequestError):
+        _call(_server_error, breaker)
+
+    assert breaker.state == OPEN
+
+
+def test_live_success_resets_failures():
+    breaker = CircuitBreaker(failure_threshold=2, probe_interval=3600)
+
+    with pytest.raises(GeminiRequestError):
+        _call(_server_error, breaker)
+    _call(lambda: 'live', breaker)
+
+    assert breaker.failures == 0
+    assert breaker.state == CLOSED
+
+
+def test_half_open_admits_one_trial_request():
+    breaker = CircuitBreaker(probe_interval=3600)
+    breaker.state = HALF_OPEN
+
+    assert breaker.allow()
+    assert not breaker.allow()
+    with pytest.raises(GeminiRequestError) as error:
+        _call(lambda: 'live', breaker)
+    assert error.value.category == CIRCUIT_OPEN
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_cache_hit_in_half_open_leaves_the_trial_to_a_live_request():
+    breaker = CircuitBreaker(probe_interval=3600)
+    breaker.state = HALF_OPEN
+
+    _call(lambda: 'replayed', breaker, cached=True)
+    assert breaker.state == HALF_OPEN
+
+    _call(lambda: 'live', breaker)
+    assert breaker.state == CLOSED
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker(probe_interval=3600)
+    breaker.state = HALF_OPEN
+
+    with pytest.raises(GeminiRequestError):
+        _call(_server_error, breaker)
+
+    assert breaker.state == OPEN
@@ -0,0 +1,126 @@
+"""
+Context cache tests
+Requests through the cached context send only a short instruction, page markers and images
+"""
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from app.services import gemini_context_cache, gemini_ocr_enriched
+from app.services.gemini_ocr_enriched import GeminiOCREnriched
+
+
+CACHED_TOKENS = 5000
+RESPONSE = json.dumps({'pages': [{'page_id': 1, 'text': '', 'quiz': {'questions': []}}]})
+
+
+class FakeCachedContent:
+    """caching.CachedContent stand-in: nothing cached server-side yet"""
+
+    created = []
+    fail_with = None
+
+    def __init__(self, display_name, system_instruction):
+        self.display_name = display_name
+        self.system_instruction = system_instruction
+
+    @classmethod
+    def list(cls):
+        return []
+
+    @classmethod
+    def create(cls, model, display_name, system_instruction, ttl):
+        cls.created.append(display_name)
+        if cls.fail_with is not None:
+            raise cls.fail_with
+        return cls(display_name, system_instruction)
+
+
+class FakeModel:
+    """GenerativeModel stand-in recording the text bytes of every request"""
+
+    def __init__(self, cached_content=None):
+        self.model_name = 'models/gemini-2.5-flash'
+        self.cached_content = cached_content
+        self.requests = []
+
+    def generate_content(self, contents, **kwargs):
+        self.requests.append(contents)
+        usage = SimpleNamespace(cached_content_token_count=CACHED_TOKENS if self.cached_content else 0)
+        return SimpleNamespace(text=RESPONSE, usage_metadata=usage)
+
+
+def text_bytes(contents):
+    return sum(len(part.encode()) for part in contents if isinstance(part, str))
+
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    FakeCachedContent.created = []
+    FakeCachedContent.fail_with = None
+    context_models = []
+
+    def from_cached_content(cached):
+        context_models.append(FakeModel(cached))
+        return context_models[-1]
+
+    monkeypatch.setattr(gemini_context_cache.caching, 'CachedContent', FakeCachedContent)
+    monkeypatch.setattr(gemini_ocr_enriched.genai.GenerativeModel, 'from_cached_content', from_cached_content)
+    return context_models
+
+
+def _client(context_cache_ttl):
+    client = GeminiOCREnriched('test-key', context_cache_ttl=context_cache_ttl)
+    client.model = FakeModel()
+    return client
+
+
+def _extract(client, page_num=1):
+    page = np.full((64, 48, 3), 255, dtype=np.uint8)
+    return client.extract_enriched_batch_quiz([(page_num, page)])
+
+
+def test_cached_requests_send_only_instruction_markers_and_images(fake_backend):
+    inline = _client(None)
+    _extract(inline)
+    inline_bytes = text_bytes(inline.model.requests[0])
+
+    client = _client(3600)
+    assert _extract(client) == {1: {'page_id': 1, 'text': '', 'quiz': {'questions': []}}}
+    _extract(client)
+
+    (context_model,) = fake_backend
+    assert client.model.requests == []
+    assert len(context_model.requests) == 2
+    for contents in context_model.requests:
+        assert contents[0] == "Extract the following exam pages as instructed."
+        assert contents[1] == "PAGE_ID: 1"
+        assert len(contents) == 3
+        assert text_bytes(contents) < inline_bytes / 50
+    assert context_model.cached_content.system_instruction == inline.model.requests[0][0]
+    assert len(FakeCachedContent.created) == 1
+
+
+def test_prompt_tokens_saved_accumulates(fake_backend):
+    client = _client(3600)
+    for _ in range(3):
+        _extract(client)
+
+    assert client.prompt_tokens_saved == 3 * CACHED_TOKENS
+
+
+def test_failing_cache_creation_falls_back_to_the_inline_prompt_once(fake_backend):
+    FakeCachedContent.fail_with = google_exceptions.PermissionDenied('caching not available')
+    client = _client(3600)
+
+    _extract(client)
+    _extract(client)
+
+    assert len(FakeCachedContent.created) == 1  # Not retried for every request
+    assert fake_backend == []
+    assert len(client.model.requests) == 2
+    assert all('PAGE IDENTIFICATION' in contents[0] for contents in client.model.requests)
+    assert client.prompt_tokens_saved == 0
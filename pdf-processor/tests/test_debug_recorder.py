@@ -0,0 +1,129 @@
+"""
+Debug recorder tests
+Off by default with nothing written; when on, artefacts land under the page each thread is working on
+"""
+import json
+import threading
+import zipfile
+
+import numpy as np
+import pytest
+
+from app.services import debug_recorder
+from app.services.debug_recorder import current_debug, debug_page, start_debug, stop_debug
+
+
+@pytest.fixture(autouse=True)
+def debug_off():
+    stop_debug()
+    yield
+    stop_debug()
+
+
+def read_bundle(path):
+    with zipfile.ZipFile(path) as bundle:
+        return bundle.namelist(), json.loads(bundle.read('manifest.json'))
+
+
+def test_off_by_default_and_detectors_write_nothing(tmp_path, monkeypatch):
+    from detect_diagrams_hybrid import detect_diagrams_hybrid
+
+    monkeypatch.chdir(tmp_path)
+    page = np.full((1100, 850, 3), 255, dtype=np.uint8)
+    page[300:700, 200:600:20] = 0  # Something for the detector to look at
+
+    assert current_debug() is None
+    detect_diagrams_hybrid(page, dpi=100)
+
+    assert list(tmp_path.iterdir()) == []
+    assert stop_debug() is None
+
+
+def test_stop_writes_the_manifest(tmp_path):
+    recorder = start_debug(str(tmp_path / 'debug' / 'bundle.zip'), pdf='exam.pdf', dpi=300)
+    assert current_debug() is recorder
+    recorder.note('job started')
+    recorder.stat('pages', 4)
+
+    bundle_path = stop_debug()
+
+    assert current_debug() is None
+    assert bundle_path == tmp_path / 'debug' / 'bundle.zip'
+    names, manifest = read_bundle(bundle_path)
+    assert names == ['manifest.json']
+    assert manifest['job'] == {'pdf': 'exam.pdf', 'dpi': 300}
+    assert manifest['job_level'] == {'notes': ['job started'], 'stats': {'pages': [4]}}
+    assert manifest['pages'] == {}
+    assert 'started' in manifest and 'finished' in manifest
+
+
+def test_records_go_to_the_page_of_each_thread(tmp_path):
+    recorder = start_debug(str(tmp_path / 'bundle.zip'))
+    barrier = threading.Barrier(4)
+
+    def work(page_num):
+        with debug_page(page_num):
+            barrier.wait()  # Every thread is inside its page before any records
+            for idx in range(20):
+                current_debug().stat('contour', (page_num, idx))
+                if idx == 10:
+                    barrier.wait()  # Interleave the pages' records
+            current_debug().image('edges', np.zeros((4, 4), dtype=np.uint8))
+            current_debug().note(f'page {page_num} done')
+
+    threads = [threading.Thread(target=work, args=(page_num,)) for page_num in (1, 2, 3, 4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.note('outside any page')
+
+    names, manifest = read_bundle(stop_debug())
+    for page_num in (1, 2, 3, 4):
+        entry = manifest['pages'][str(page_num)]
+        assert entry['stats']['contour'] == [[page_num, idx] for idx in range(20)]
+        assert entry['images'] == [f'page_{page_num}/edges.png']
+        assert entry['notes'] == [f'page {page_num} done']
+        assert f'page_{page_num}/edges.png' in names
+    assert manifest['job_level'] == {'notes': ['outside any page']}
+
+
+def test_debug_page_restores_the_enclosing_page(tmp_path):
+    recorder = start_debug(str(tmp_path / 'bundle.zip'))
+
+    with debug_page(1):
+        with debug_page(2):
+            recorder.note('inner')
+        recorder.note('outer')
+    recorder.note('job')
+
+    _, manifest = read_bundle(stop_debug())
+    assert manifest['pages'] == {'1': {'notes': ['outer']}, '2': {'notes': ['inner']}}
+    assert manifest['job_level'] == {'notes': ['job']}
+
+
+def test_repeated_names_are_made_unique(tmp_path):
+    recorder = start_debug(str(tmp_path / 'bundle.zip'))
+
+    with debug_page(3):
+        for _ in range(3):
+            recorder.file('response.json', '{}')
+        recorder.file('notes', 'no suffix')
+        recorder.file('notes', 'no suffix')
+    recorder.file('response.json', '{}')
+
+    names, manifest = read_bundle(stop_debug())
+    assert manifest['pages']['3']['files'] == [
+        'page_3/response.json', 'page_3/response_2.json', 'page_3/response_3.json', 'page_3/notes', 'page_3/notes_2',
+    ]
+    assert manifest['job_level']['files'] == ['job/response.json']
+    assert len(names) == len(set(names)) == 7
+
+
+def test_unique_numbers_each_name_separately(tmp_path):
+    recorder = debug_recorder.DebugRecorder(str(tmp_path / 'bundle.zip'))
+
+    assert [recorder._unique(name) for name in ('a.png', 'a.png', 'b.png', 'a.png', 'a_2.png')] == [
+        'a.png', 'a_2.png', 'b.png', 'a_3.png', 'a_2_2.png',
+    ]
+    recorder.close()
@@ -0,0 +1,148 @@
+"""
+Vector diagram detection tests
+Drawing paths and embedded images are clustered into diagram boxes; scans and page furniture are not diagrams
+"""
+import fitz
+import numpy as np
+import pytest
+
+from detect_diagrams_vector import _cluster_rects, _collect_primitives, detect_diagrams_vector, is_scanned_page
+
+
+def _png(width, height):
+    """PNG bytes of a grey image"""
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, width, height), False)
+    pix.set_rect(pix.irect, (128, 128, 128))
+    return pix.tobytes('png')
+
+
+@pytest.fixture
+def make_page():
+    """Build a one-page PDF in memory with build(page) and reopen it, as a parsed file would be"""
+    docs = []
+
+    def make(build):
+        doc = fitz.open()
+        build(doc.new_page(width=595, height=842))
+        reopened = fitz.open('pdf', doc.tobytes())
+        doc.close()
+        docs.append(reopened)
+        return reopened[0]
+
+    yield make
+    for doc in docs:
+        doc.close()
+
+
+def _triangle_with_text(page):
+    page.insert_text((72, 80), '1 The triangle ABC is drawn below.', fontsize=11)
+    page.draw_line((100, 300), (250, 300))
+    page.draw_line((250, 300), (175, 180))
+    page.draw_line((175, 180), (100, 300))
+    page.insert_text((72, 400), 'Find the angle ACB.', fontsize=11)
+
+
+def test_vector_drawing_is_one_diagram_and_text_is_ignored(make_page):
+    page = make_page(_triangle_with_text)
+
+    diagrams = detect_diagrams_vector(page, dpi=72, padding=0)
+
+    assert len(diagrams) == 1
+    x1, y1, x2, y2 = diagrams[0]['bbox']
+    assert (x1, y1) == pytest.approx((100, 180), abs=2)
+    assert (x2, y2) == pytest.approx((250, 300), abs=2)
+    assert diagrams[0]['density'] == 3
+    assert diagrams[0]['source'] == 'vector_drawings'
+
+
+def test_boxes_are_scaled_to_the_render_dpi(make_page):
+    page = make_page(_triangle_with_text)
+
+    at_72 = detect_diagrams_vector(page, dpi=72)[0]['bbox']
+    at_300 = detect_diagrams_vector(page, dpi=300)[0]['bbox']
+
+    assert at_300 == pytest.approx([v * 300 / 72 for v in at_72], abs=5)
+
+
+def test_embedded_image_is_a_diagram_on_its_own(make_page):
+    page = make_page(lambda page: page.insert_image(fitz.Rect(100, 100, 300, 250), stream=_png(40, 30)))
+
+    rects, is_image = _collect_primitives(page)
+    diagrams = detect_diagrams_vector(page, dpi=72, padding=0)
+
+    assert is_image.tolist() == [True]
+    assert rects[0] == pytest.approx([100, 100, 300, 250])
+    assert len(diagrams) == 1
+    assert diagrams[0]['confidence'] > 70
+
+
+def test_scanned_page_is_detected_and_its_image_is_not_a_primitive(make_page):
+    def scan(page):
+        page.insert_image(page.rect, stream=_png(60, 85))
+        page.insert_text((72, 80), 'Invisible OCR text', fontsize=11, render_mode=3)
+
+    page = make_page(scan)
+
+    assert is_scanned_page(page)
+    assert len(_collect_primitives(page)[0]) == 0
+    assert detect_diagrams_vector(page) == []
+
+
+def test_born_digital_page_is_not_a_scan(make_page):
+    assert not is_scanned_page(make_page(_triangle_with_text))
+    assert not is_scanned_page(make_page(lambda page: page.insert_image(fitz.Rect(100, 100, 300, 250), stream=_png(40, 30))))
+
+
+def test_page_frame_and_rules_are_skipped(make_page):
+    def furniture(page):
+        page.draw_rect(fitz.Rect(20, 20, 575, 822))
+        page.draw_line((40, 60), (555, 60))
+
+    rects, _ = _collect_primitives(make_page(furniture))
+
+    assert len(rects) == 0
+
+
+def test_lines_get_a_minimal_thickness(make_page):
+    rects, _ = _collect_primitives(make_page(lambda page: page.draw_line((100, 300), (200, 300))), min_stroke=0.5)
+
+    assert rects[0][3] - rects[0][1] >= 1.0
+
+
+def test_single_box_is_an_answer_space_not_a_diagram(make_page):
+    page = make_page(lambda page: page.draw_rect(fitz.Rect(400, 700, 550, 740)))
+
+    assert detect_diagrams_vector(page) == []
+
+
+def test_adjacent_rects_merge_and_distant_rects_do_not():
+    rects = np.array([
+        [0, 0, 10, 10],
+        [15, 0, 25, 10],    # 5 from the first
+        [28, 0, 40, 10],    # 3 from the second: chained into the same cluster
+        [200, 200, 210, 210],
+    ], dtype=np.float64)
+
+    labels = _cluster_rects(rects, gap=5)
+
+    assert labels[0] == labels[1] == labels[2]
+    assert labels[3] != labels[0]
+
+
+def test_overlapping_rects_merge_regardless_of_order():
+    rects = np.array([
+        [100, 100, 120, 120],
+        [0, 0, 10, 10],
+        [5, 5, 110, 110],   # Joins the first two only through itself
+    ], dtype=np.float64)
+
+    labels = _cluster_rects(rects, gap=0)
+
+    assert len(set(labels)) == 1
+
+
+def test_gap_is_the_merge_distance():
+    rects = np.array([[0, 0, 10, 10], [31, 0, 41, 10]], dtype=np.float64)
+
+    assert len(set(_cluster_rects(rects, gap=10))) == 2
+    assert len(set(_cluster_rects(rects, gap=11))) == 1
@@ -0,0 +1,129 @@
+"""
+Page detection cache tests
+Each detector runs once per page render; another image or DPI, or invalidation, runs it again
+"""
+import numpy as np
+import pytest
+
+from app.services.detection_cache import PageDetectionCache
+from page_features import PageFeatures
+
+
+class CountingDetector:
+    """Detector stand-in returning one box per call, numbered by call"""
+
+    def __init__(self, error=None):
+        self.calls = 0
+        self.error = error
+
+    def __call__(self):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return [{'bbox': (0, 0, 10, 10), 'call': self.calls}]
+
+
+def page(value=255, shape=(60, 40, 3)):
+    return PageFeatures(np.full(shape, value, dtype=np.uint8))
+
+
+def test_second_lookup_is_a_hit():
+    cache, detect, features = PageDetectionCache(), CountingDetector(), page()
+
+    first = cache.detections('hybrid', 3, detect, image_key=features.fingerprint, dpi=300)
+    second = cache.detections('hybrid', 3, detect, image_key=page().fingerprint, dpi=300)
+
+    assert detect.calls == 1
+    assert second is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_other_pages_and_detectors_miss():
+    cache, detect = PageDetectionCache(), CountingDetector()
+
+    cache.detections('hybrid', 3, detect)
+    cache.detections('hybrid', 4, detect)
+    cache.detections('yolo', 3, detect)
+
+    assert detect.calls == 3
+
+
+@pytest.mark.parametrize('other', [
+    page(value=0),                  # Different pixels
+    page(shape=(60, 40)),           # Same page rendered in grayscale
+    page(shape=(40, 60, 3)),
+])
+def test_changed_image_misses(other):
+    cache, detect = PageDetectionCache(), CountingDetector()
+
+    cache.detections('hybrid', 3, detect, image_key=page().fingerprint, dpi=300)
+    detected = cache.detections('hybrid', 3, detect, image_key=other.fingerprint, dpi=300)
+
+    assert detect.calls == 2
+    assert detected[0]['call'] == 2
+
+
+def test_changed_dpi_misses():
+    cache, detect = PageDetectionCache(), CountingDetector()
+
+    cache.detections('vector', 3, detect, dpi=300)
+    detected = cache.detections('vector', 3, detect, dpi=150)
+
+    assert detect.calls == 2
+    assert detected[0]['call'] == 2
+
+
+def test_failures_are_memoized():
+    cache, detect = PageDetectionCache(), CountingDetector(error=RuntimeError('no model'))
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError, match='no model'):
+            cache.detections('yolo', 1, detect)
+
+    assert detect.calls == 1
+
+
+def test_invalidating_a_page_only_forgets_that_page(tmp_path):
+    cache, detect = PageDetectionCache(), CountingDetector()
+    for page_num in (1, 2):
+        cache.detections('hybrid', page_num, detect)
+        crop_path = tmp_path / f'page_{page_num}.png'
+        cache.crop_saved(page_num, crop_path, (0, 0, 5, 5))
+        crop_path.write_bytes(b'png')
+
+    cache.invalidate(1)
+
+    cache.detections('hybrid', 1, detect)
+    cache.detections('hybrid', 2, detect)
+    assert detect.calls == 3
+    assert not cache.crop_saved(1, tmp_path / 'page_1.png', (0, 0, 5, 5))
+    assert cache.crop_saved(2, tmp_path / 'page_2.png', (0, 0, 5, 5))
+
+
+def test_invalidating_everything():
+    cache, detect = PageDetectionCache(), CountingDetector()
+    cache.detections('hybrid', 1, detect)
+    cache.detections('yolo', 2, detect)
+
+    cache.invalidate()
+
+    cache.detections('hybrid', 1, detect)
+    cache.detections('yolo', 2, detect)
+    assert detect.calls == 4
+
+
+def test_crops_are_saved_once_per_path_and_box(tmp_path):
+    cache, crop_path = PageDetectionCache(), tmp_path / 'page_1_diagram.png'
+
+    assert not cache.crop_saved(1, crop_path, (0, 0, 5, 5))
+    crop_path.write_bytes(b'png')
+    assert cache.crop_saved(1, crop_path, (0.0, 0, 5, 5))
+    assert not cache.crop_saved(1, crop_path, (0, 0, 6, 5))   # Another box to the same file
+
+
+def test_deleted_crop_is_saved_again(tmp_path):
+    cache, crop_path = PageDetectionCache(), tmp_path / 'page_1_diagram.png'
+
+    cache.crop_saved(1, crop_path, (0, 0, 5, 5))
+
+    assert not cache.crop_saved(1, crop_path, (0, 0, 5, 5))
@@ -0,0 +1,180 @@
+"""
+Diagram locator tests
+Gemini's set-of-marks answers are matched to questions and resolved to candidate boxes or its own boxes
+"""
+import json
+
+import numpy as np
+from PIL import Image
+
+from app.services.diagram_locator import (
+    MAX_LOCATE_CANDIDATES, assign_diagrams, box_iou, draw_candidate_marks, locate_page_diagrams, unique_candidates,
+)
+from app.services.gemini_retry import RetryPolicy
+
+
+NO_RETRY = RetryPolicy(max_attempts=1, max_parse_attempts=1, base_delay=0, max_delay=0)
+
+CANDIDATES = [(100, 100, 300, 250), (100, 400, 500, 700), (600, 100, 800, 300)]
+
+
+def questions(*numbers):
+    return [{'number': number, 'question': f'Question {number}', 'parts': []} for number in numbers]
+
+
+class FakeModel:
+    """GenerativeModel stand-in answering every request with text"""
+
+    def __init__(self, text):
+        self.text = text
+        self.requests = []
+
+    def generate_content(self, contents, **kwargs):
+        self.requests.append(contents)
+        return type('Response', (), {'text': self.text})()
+
+
+def locate(answers, numbers, candidates=CANDIDATES):
+    model = FakeModel(json.dumps({'questions': answers}))
+    page_img = Image.new('RGB', (1000, 1400), 'white')
+    return locate_page_diagrams(model, page_img, candidates, questions(*numbers), NO_RETRY, page_num=3), model
+
+
+def test_candidates_are_resolved_to_their_boxes():
+    located, model = locate([
+        {'number': '2', 'candidate': 3, 'type': 'graph', 'confidence': 88},
+        {'number': '1', 'candidate': 1, 'type': 'table', 'confidence': 91},
+    ], ['1', '2'])
+
+    assert len(model.requests) == 1
+    assert [location['box'] for location in located] == [CANDIDATES[0], CANDIDATES[2]]
+    assert [location['candidate'] for location in located] == [1, 3]
+    assert located[0] == {'box': CANDIDATES[0], 'source': 'gemini_set_of_marks', 'candidate': 1,
+                          'type': 'table', 'confidence': 91.0}
+
+
+def test_prompt_lists_the_candidates_and_questions():
+    _, model = locate([], ['4', '5'])
+
+    prompt, image = model.requests[0]
+    assert '3 numbered candidate box(es)' in prompt
+    assert '- Q4: "Question 4' in prompt and '- Q5: "Question 5' in prompt
+    assert image.size == (1000, 1400)
+
+
+def test_out_of_range_candidate_falls_back_to_the_own_box():
+    located, _ = locate([
+        {'number': '1', 'candidate': 4, 'bbox': {'x': 10, 'y': 20, 'width': 100, 'height': 50}},
+        {'number': '2', 'candidate': 0, 'bbox': {'x': 5, 'y': 5, 'width': 10, 'height': 10}},
+    ], ['1', '2'])
+
+    assert located[0]['box'] == (10, 20, 110, 70)
+    assert located[0]['source'] == 'gemini_intelligent_fallback'
+    assert located[0]['candidate'] is None
+    assert located[1]['box'] == (5, 5, 15, 15)
+
+
+def test_out_of_range_candidate_without_a_box_is_not_located():
+    located, _ = locate([{'number': '1', 'candidate': 12}, {'number': '2', 'candidate': True}], ['1', '2'])
+
+    assert located == [None, None]
+
+
+def test_own_boxes_are_scaled_back_to_page_pixels():
+    located = assign_diagrams(questions('1'), [{'number': '1', 'bbox': {'x': 50, 'y': 100, 'width': 200, 'height': 50}}],
+                              CANDIDATES, upload_scale=0.5)
+
+    assert located[0]['box'] == (100, 200, 500, 300)
+
+
+def test_duplicate_numbers_are_used_once_each():
+    located = assign_diagrams(questions('1', '1'), [
+        {'number': '1', 'candidate': 2},
+        {'number': '1', 'candidate': 3},
+    ], CANDIDATES)
+
+    assert [location['candidate'] for location in located] == [2, 3]
+
+
+def test_duplicate_candidate_ids_are_each_resolved():
+    located = assign_diagrams(questions('1', '2'), [
+        {'number': '1', 'candidate': 2},
+        {'number': '2', 'candidate': 2},
+    ], CANDIDATES)
+
+    assert [location['box'] for location in located] == [CANDIDATES[1], CANDIDATES[1]]
+
+
+def test_unknown_numbers_fall_back_to_order():
+    located = assign_diagrams(questions('1', '2'), [
+        {'number': 'Q1', 'candidate': 3},
+        {'number': '(b)', 'candidate': 1},
+    ], CANDIDATES)
+
+    assert [location['candidate'] for location in located] == [3, 1]
+
+
+def test_order_fallback_skips_answers_already_matched_by_number():
+    located = assign_diagrams(questions('1', '2'), [
+        {'number': '2', 'candidate': 1},
+        {'number': 'x', 'candidate': 3},
+    ], CANDIDATES)
+
+    # Q2 claims its answer by number before Q1 falls back to the answer at its position
+    assert located[0] is None
+    assert located[1]['candidate'] == 1
+
+
+def test_missing_answers_and_non_dict_entries_leave_questions_unlocated():
+    located = assign_diagrams(questions('1', '2'), ['candidate 1', {'number': '2', 'candidate': 2}], CANDIDATES)
+
+    assert located[0] is None
+    assert located[1]['candidate'] == 2
+
+
+def test_confidence_and_type_defaults():
+    located = assign_diagrams(questions('1'), [{'number': '1', 'candidate': 1}], CANDIDATES)
+
+    assert located[0]['confidence'] == 60.0
+    assert located[0]['type'] == 'unknown'
+
+
+def test_non_object_response_locates_nothing():
+    model = FakeModel('[1, 2]')
+    located = locate_page_diagrams(model, Image.new('RGB', (100, 100)), CANDIDATES, questions('1'), NO_RETRY, page_num=1)
+
+    assert located == [None]
+
+
+def test_duplicate_detections_are_one_candidate():
+    detections = [
+        {'bbox': (100, 100, 300, 250)},
+        {'bbox': (105, 98, 302, 255)},   # The same diagram from another detector
+        {'bbox': (100, 400, 500, 700)},
+    ]
+
+    assert unique_candidates(detections) == [(100, 100, 300, 250), (100, 400, 500, 700)]
+
+
+def test_candidates_are_capped():
+    detections = [{'bbox': (i * 100, 0, i * 100 + 50, 50)} for i in range(MAX_LOCATE_CANDIDATES + 3)]
+
+    assert len(unique_candidates(detections)) == MAX_LOCATE_CANDIDATES
+
+
+def test_box_iou():
+    assert box_iou((0, 0, 10, 10), (0, 0, 10, 10)) == 1.0
+    assert box_iou((0, 0, 10, 10), (5, 0, 15, 10)) == 50 / 150
+    assert box_iou((0, 0, 10, 10), (20, 20, 30, 30)) == 0.0
+    assert box_iou((0, 0, 0, 0), (0, 0, 0, 0)) == 0.0
+
+
+def test_marks_are_drawn_on_a_copy():
+    page_img = Image.new('L', (400, 300), 255)
+
+    marked = draw_candidate_marks(page_img, [(50, 50, 200, 150)])
+
+    assert marked.mode == 'RGB'
+    assert np.asarray(page_img).min() == 255
+    assert tuple(np.asarray(marked)[100, 50]) == (255, 0, 0)  # Box outline
+    assert tuple(np.asarray(marked)[250, 350]) == (255, 255, 255)
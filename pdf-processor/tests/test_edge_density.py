@@ -0,0 +1,89 @@
+"""
+Edge density tests
+Grid densities and rectangle sums match plain per-cell and per-slice numpy sums
+"""
+import numpy as np
+import pytest
+
+from edge_density import EdgeDensity
+
+
+def naive_grid(edges, grid_size):
+    """detect_diagrams_hybrid's original loop: one np.sum per cell, divided by the full cell area"""
+    height, width = edges.shape
+    density_map = np.zeros((height // grid_size + 1, width // grid_size + 1))
+    for i in range(0, height, grid_size):
+        for j in range(0, width, grid_size):
+            density_map[i // grid_size, j // grid_size] = np.sum(edges[i:i + grid_size, j:j + grid_size]) / (grid_size * grid_size)
+    return density_map
+
+
+def random_edges(height, width, seed=0, density=0.1):
+    rng = np.random.default_rng(seed)
+    return np.where(rng.random((height, width)) < density, 255, 0).astype(np.uint8)
+
+
+@pytest.mark.parametrize('height, width, grid_size', [
+    (350, 248, 100),    # Partial cells along the right and bottom edges and in the corner
+    (400, 300, 100),    # Evenly divisible: a trailing row and column of zeros
+    (400, 248, 100),    # Divisible rows only
+    (350, 300, 100),    # Divisible columns only
+    (95, 80, 100),      # Smaller than one cell
+    (1169, 827, 33),    # A 100 DPI A4 page with the 300 DPI grid scaled down
+])
+def test_cell_grid_matches_the_per_cell_loop(height, width, grid_size):
+    edges = random_edges(height, width)
+
+    grid = EdgeDensity(edges).cell_grid(grid_size)
+
+    assert grid.shape == (height // grid_size + 1, width // grid_size + 1)
+    np.testing.assert_array_equal(grid, naive_grid(edges, grid_size))
+
+
+def test_evenly_divisible_page_has_an_empty_trailing_row_and_column():
+    grid = EdgeDensity(np.full((200, 300), 255, dtype=np.uint8)).cell_grid(100)
+
+    assert grid.shape == (3, 4)
+    assert (grid[:2, :3] == 255).all()
+    assert (grid[2, :] == 0).all() and (grid[:, 3] == 0).all()
+
+
+def test_partial_cells_are_divided_by_the_full_cell_area():
+    grid = EdgeDensity(np.full((150, 150), 255, dtype=np.uint8)).cell_grid(100)
+
+    assert grid[0, 0] == 255
+    assert grid[0, 1] == grid[1, 0] == 255 / 2
+    assert grid[1, 1] == 255 / 4
+
+
+def test_full_white_page_does_not_overflow():
+    # 300 DPI A4 of edges: the cell sums exceed uint16 and the page total exceeds int32
+    edges = np.full((3508, 2480), 255, dtype=np.uint8)
+
+    assert (EdgeDensity(edges).cell_grid(100)[:35, :24] == 255).all()
+    assert EdgeDensity(edges).rect_sum(0, 0, 2480, 3508) == 255 * 3508 * 2480
+
+
+@pytest.mark.parametrize('box', [
+    (0, 0, 248, 350),       # Whole image
+    (10, 20, 110, 70),
+    (247, 349, 248, 350),   # Single pixel in the corner
+    (-20, -5, 40, 30),      # Clipped like a numpy slice
+    (200, 300, 400, 500),
+    (50, 50, 50, 80),       # Empty
+    (300, 0, 400, 10),      # Outside the image
+])
+def test_rect_sum_matches_the_slice_sum(box):
+    edges = random_edges(350, 248, seed=3)
+    x1, y1, x2, y2 = box
+
+    expected = float(np.sum(edges[max(y1, 0):max(y2, 0), max(x1, 0):max(x2, 0)]))
+
+    assert EdgeDensity(edges).rect_sum(x1, y1, x2, y2) == expected
+
+
+def test_integral_is_built_once():
+    edge_density = EdgeDensity(random_edges(50, 40))
+
+    assert edge_density.integral is edge_density.integral
+    assert edge_density.integral.shape == (51, 41)
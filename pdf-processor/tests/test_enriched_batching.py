@@ -0,0 +1,124 @@
+"""
+Enriched batching tests
+Returned page ids are verified against the ones sent; ambiguous pages and unparseable batches are re-requested smaller
+"""
+import json
+import re
+
+import numpy as np
+import pytest
+
+from app.services.gemini_ocr_enriched import GeminiOCREnriched, PartialBatchError
+from app.services.gemini_retry import RetryPolicy
+
+
+NO_RETRY = RetryPolicy(max_attempts=1, max_parse_attempts=1, base_delay=0, max_delay=0)
+
+
+def page(page_id, number=None):
+    """A page object as Gemini returns it"""
+    return {'page_id': page_id, 'text': f'page {page_id}', 'quiz': {'questions': [{'number': str(number or page_id)}]}}
+
+
+def pages_json(pages):
+    return json.dumps({'pages': pages})
+
+
+class FakeModel:
+    """GenerativeModel stand-in: multi-page requests get respond(page_ids), single pages a correct answer
+    (or, for the pages in failing, one that can't be parsed)"""
+
+    def __init__(self, respond, failing=()):
+        self.respond = respond
+        self.failing = set(failing)
+        self.requests = []
+
+    def generate_content(self, contents, **kwargs):
+        page_ids = [int(re.match(r'PAGE_ID: (\d+)', part).group(1))
+                    for part in contents[1:] if isinstance(part, str)]
+        self.requests.append(page_ids)
+        if len(page_ids) > 1:
+            text = self.respond(page_ids)
+        elif page_ids[0] in self.failing:
+            text = 'The page could not be processed.'
+        else:
+            text = pages_json([page(page_ids[0])])
+        return type('Response', (), {'text': text})()
+
+
+def extract(respond, page_numbers, failing=()):
+    client = GeminiOCREnriched('test-key', retry_policy=NO_RETRY)
+    client.model = FakeModel(respond, failing)
+    images = [(page_num, np.full((32, 24, 3), 255, dtype=np.uint8)) for page_num in page_numbers]
+    return client.extract_enriched_batch_quiz(images), client.model.requests
+
+
+def test_verified_pages_are_mapped_by_id_not_position():
+    results, requests = extract(lambda ids: pages_json([page(ids[1]), page(ids[0])]), [4, 5])
+
+    assert requests == [[4, 5]]
+    assert results == {4: page(4), 5: page(5)}
+
+
+def test_page_id_marker_strings_are_accepted():
+    results, requests = extract(lambda ids: pages_json([{**page(i), 'page_id': f'PAGE_ID: {i}'} for i in ids]), [3, 4])
+
+    assert requests == [[3, 4]]
+    assert [results[3]['text'], results[4]['text']] == ['page 3', 'page 4']
+
+
+def test_duplicated_page_ids_are_requested_again():
+    results, requests = extract(lambda ids: pages_json([page(ids[0]), page(ids[0], number=9), page(ids[1])]), [1, 2])
+
+    assert requests == [[1, 2], [1]]
+    assert results == {1: page(1), 2: page(2)}
+
+
+def test_missing_page_ids_are_requested_again():
+    results, requests = extract(lambda ids: pages_json([page(ids[0]), {**page(ids[1]), 'page_id': None}]), [1, 2, 3])
+
+    assert requests == [[1, 2, 3], [2], [3]]
+    assert results == {1: page(1), 2: page(2), 3: page(3)}
+
+
+def test_unknown_page_ids_are_requested_again():
+    results, requests = extract(lambda ids: pages_json([page(ids[0]), page(7), page(8)]), [1, 2, 3])
+
+    assert requests == [[1, 2, 3], [2], [3]]
+    assert sorted(results) == [1, 2, 3]
+
+
+def test_unparseable_multi_page_batch_ends_in_single_page_requests():
+    results, requests = extract(lambda ids: 'The pages could not be processed.', [1, 2, 3, 4])
+
+    # 4 -> 2 + 2 -> 1 + 1 + 1 + 1
+    assert requests == [[1, 2, 3, 4], [1, 2], [1], [2], [3, 4], [3], [4]]
+    assert results == {page_num: page(page_num) for page_num in (1, 2, 3, 4)}
+
+
+def test_truncated_multi_page_response_drops_and_requests_the_last_page():
+    def respond(ids):
+        text = pages_json([page(i) for i in ids])
+        return text[:text.rindex('"text"') + 12]  # Cut off inside the last page's text
+
+    results, requests = extract(respond, [1, 2, 3])
+
+    assert requests == [[1, 2, 3], [3]]
+    assert results == {1: page(1), 2: page(2), 3: page(3)}
+
+
+def test_failed_re_request_keeps_the_verified_pages():
+    with pytest.raises(PartialBatchError) as raised:
+        extract(lambda ids: pages_json([page(ids[0]), page(7), page(8)]), [1, 2, 3], failing=[2])
+
+    assert raised.value.category == 'parse'
+    assert raised.value.results == {1: page(1), 3: page(3)}
+    assert raised.value.failed_pages == [2]
+
+
+def test_failed_half_keeps_the_other_halves():
+    with pytest.raises(PartialBatchError) as raised:
+        extract(lambda ids: 'The pages could not be processed.', [1, 2, 3, 4], failing=[3])
+
+    assert raised.value.results == {1: page(1), 2: page(2), 4: page(4)}
+    assert raised.value.failed_pages == [3]
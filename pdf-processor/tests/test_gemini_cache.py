@@ -0,0 +1,160 @@
+"""
+Response cache tests
+Request keys, TTL expiry, LRU eviction, streamed responses and eviction of unparseable responses
+"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.services import gemini_cache
+from app.services.gemini_cache import CachedGenerativeModel, GeminiResponseCache
+
+
+MODEL = 'gemini-2.5-flash'
+
+
+def _page(value=255):
+    page = np.full((40, 30, 3), value, dtype=np.uint8)
+    page[10:20, 5:25] = 0
+    return page
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(gemini_cache.time, 'time', fake.time)
+    return fake
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = GeminiResponseCache(str(tmp_path / 'responses.sqlite3'), ttl_seconds=3600, max_bytes=25)
+    yield cache
+    cache.close()
+
+
+class StreamingResponse:
+    """Streamed response: chunks, then the full text once read"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.text = ''.join(chunks)
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield SimpleNamespace(text=chunk)
+
+
+class FakeModel:
+    model_name = 'models/gemini-2.5-flash'
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        self.calls += 1
+        if stream:
+            return StreamingResponse(['{"pages"', ': []}'])
+        return SimpleNamespace(text='{"pages": []}')
+
+
+@pytest.mark.parametrize('make_part', [
+    lambda page: Image.fromarray(page),
+    lambda page: page,
+    lambda page: np.asfortranarray(page),  # Same pixels, different memory layout
+    lambda page: {'mime_type': 'image/png', 'data': page.tobytes()},
+], ids=['pil', 'ndarray', 'fortran_ndarray', 'blob'])
+def test_make_key_is_stable_for_equal_parts(make_part):
+    first = GeminiResponseCache.make_key(MODEL, ['Extract', make_part(_page())])
+    second = GeminiResponseCache.make_key(MODEL, ['Extract', make_part(_page().copy())])
+    other_page = GeminiResponseCache.make_key(MODEL, ['Extract', make_part(_page(254))])
+
+    assert first == second
+    assert first != other_page
+
+
+def test_make_key_separates_models_prompts_and_generation_config():
+    parts = ['Extract', _page()]
+    key = GeminiResponseCache.make_key(MODEL, parts)
+
+    assert key != GeminiResponseCache.make_key('gemini-2.0-flash-exp', parts)
+    assert key != GeminiResponseCache.make_key(MODEL, ['Extract!', _page()])
+    with_config = GeminiResponseCache.make_key(MODEL, parts, generation_config={'response_mime_type': 'application/json'})
+    assert with_config != key
+    assert with_config != GeminiResponseCache.make_key(MODEL, parts, generation_config={'temperature': 0})
+
+
+def test_entries_expire_after_the_ttl(cache, clock):
+    cache.put('a', MODEL, 'response')
+    clock.now += 3599
+    assert cache.get('a') == 'response'
+
+    clock.now += 2
+    assert cache.get('a') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entries_are_evicted_first(cache, clock):
+    cache.put('a', MODEL, 'x' * 10)
+    clock.now += 1
+    cache.put('b', MODEL, 'y' * 10)
+    clock.now += 1
+    assert cache.get('a') is not None  # 'b' is now the least recently used
+    clock.now += 1
+    cache.put('c', MODEL, 'z' * 10)  # 30 bytes > max_bytes 25
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 'x' * 10
+    assert cache.get('c') == 'z' * 10
+
+
+def test_streamed_response_is_stored_only_once_fully_read(cache):
+    cache.max_bytes = 1024
+    model = CachedGenerativeModel(FakeModel(), cache)
+
+    stream = iter(model.generate_content(['Extract'], stream=True))
+    next(stream)
+    key = GeminiResponseCache.make_key(model.model_name, ['Extract'])
+    assert cache.get(key) is None  # Abandoned mid-stream: nothing stored
+
+    list(stream)
+    assert cache.get(key) == '{"pages": []}'
+
+
+def test_streamed_and_plain_requests_share_entries(cache):
+    cache.max_bytes = 1024
+    fake = FakeModel()
+    model = CachedGenerativeModel(fake, cache)
+
+    list(model.generate_content(['Extract'], stream=True))
+    replayed = model.generate_content(['Extract'])
+
+    assert fake.calls == 1
+    assert model.last_call_cached
+    assert replayed.text == '{"pages": []}'
+    assert [chunk.text for chunk in model.generate_content(['Extract'], stream=True)] == ['{"pages": []}']
+
+
+def test_forget_last_deletes_the_entry(cache):
+    cache.max_bytes = 1024
+    fake = FakeModel()
+    model = CachedGenerativeModel(fake, cache)
+
+    model.generate_content(['Extract'])
+    model.generate_content(['Extract'])
+    assert model.last_call_cached
+    model.forget_last()
+    model.generate_content(['Extract'])
+
+    assert fake.calls == 2
+    assert not model.last_call_cached
@@ -0,0 +1,153 @@
+"""
+Request engine tests
+Token-bucket waits, AIMD rate adaptation, throttle pauses, usage refunds and bounded concurrent fan-out
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import gemini_engine
+from app.services.gemini_engine import GeminiRequestEngine, RateLimitedModel, RateLimiter, TokenBucket
+
+
+class FakeClock:
+    """time.monotonic/time.sleep stand-in: sleeping advances the clock"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(gemini_engine.time, 'monotonic', fake.monotonic)
+    monkeypatch.setattr(gemini_engine.time, 'sleep', fake.sleep)
+    return fake
+
+
+def test_reserve_waits_off_the_debt(clock):
+    bucket = TokenBucket(60)  # 1 token per second, 60 burst
+
+    assert [bucket.reserve(1) for _ in range(60)] == [0.0] * 60
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    assert bucket.reserve(1) == pytest.approx(2.0)
+
+    clock.now += 2
+    assert bucket.reserve(1) == pytest.approx(1.0)
+
+
+def test_reserve_never_takes_more_than_the_capacity(clock):
+    bucket = TokenBucket(60, capacity=10)
+
+    assert bucket.reserve(100) == 0.0
+    assert bucket.reserve(5) == pytest.approx(5.0)
+
+
+def test_throttles_halve_the_rate_once_per_cooldown(clock):
+    limiter = RateLimiter(rpm=8, tpm=None, min_rpm=1, throttle_cooldown=10)
+
+    limiter.on_throttle()
+    limiter.on_throttle()  # Same burst of 429s
+    assert limiter.current_rpm == 4
+    assert limiter.throttles == 2
+
+    clock.now += 10
+    limiter.on_throttle()
+    assert limiter.current_rpm == 2
+    assert limiter.requests.rate == pytest.approx(2 / 60)
+
+    for _ in range(3):
+        clock.now += 10
+        limiter.on_throttle()
+    assert limiter.current_rpm == 1  # min_rpm floor
+
+
+def test_successes_recover_the_rate_additively(clock):
+    limiter = RateLimiter(rpm=8, tpm=None, recovery_rpm=0.5)
+    limiter.on_throttle()
+
+    for expected in (4.5, 5.0, 5.5):
+        limiter.on_success()
+        assert limiter.current_rpm == pytest.approx(expected)
+    for _ in range(20):
+        limiter.on_success()
+    assert limiter.current_rpm == 8
+    assert limiter.requests.rate == pytest.approx(8 / 60)
+
+
+def test_drain_pauses_the_next_callers(clock):
+    bucket = TokenBucket(60)
+    bucket.drain(5)
+
+    assert bucket.reserve(0) == pytest.approx(5.0)
+
+
+def test_throttle_pause_holds_back_every_request(clock):
+    limiter = RateLimiter(rpm=60, tpm=None, throttle_cooldown=10)
+    limiter.on_throttle(pause=5)
+
+    limiter.acquire()
+
+    assert clock.sleeps and clock.sleeps[0] >= 5
+
+
+def test_settle_refunds_overestimated_tokens(clock):
+    limiter = RateLimiter(rpm=600, tpm=60_000)
+    limiter.acquire(60_000)
+    assert clock.sleeps == []
+
+    limiter.settle(estimated=60_000, actual=10_000)
+    limiter.acquire(50_000)
+    assert clock.sleeps == []  # The 50k refunded tokens were available at once
+
+    limiter.settle(estimated=1_000, actual=3_000)
+    limiter.acquire(0)
+    assert clock.sleeps == [pytest.approx(2.0)]  # 2k underestimated tokens at 1k per second
+
+
+def test_rate_limited_model_settles_the_reported_usage(clock):
+    limiter = RateLimiter(rpm=600, tpm=60_000)
+    usage = SimpleNamespace(total_token_count=100)
+    model = RateLimitedModel(
+        SimpleNamespace(generate_content=lambda contents, **kwargs: SimpleNamespace(usage_metadata=usage)),
+        limiter, expected_output_tokens=4096
+    )
+
+    model.generate_content('x' * 400)
+
+    # Reserved ~4197 tokens up front, charged 100 once the response reported its usage
+    assert limiter.tokens.tokens == pytest.approx(60_000 - 100)
+
+
+def test_run_keeps_order_and_bounds_calls_in_flight():
+    lock = threading.Lock()
+    in_flight = []
+    peak = []
+
+    def call(index):
+        with lock:
+            in_flight.append(index)
+            peak.append(len(in_flight))
+        time.sleep(0.01 * (8 - index))  # Later calls finish first
+        with lock:
+            in_flight.remove(index)
+        return index
+
+    results = GeminiRequestEngine(concurrency=3).run([lambda index=index: call(index) for index in range(8)])
+
+    assert results == list(range(8))
+    assert max(peak) == 3
+
+
+def test_run_without_calls():
+    assert GeminiRequestEngine().run([]) == []
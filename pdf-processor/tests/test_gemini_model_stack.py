@@ -0,0 +1,71 @@
+"""
+Model stack tests
+Every client gets the same layer order, and call counts are kept per thread
+"""
+import threading
+from types import SimpleNamespace
+
+from app.services.gemini_cache import CachedGenerativeModel, GeminiResponseCache
+from app.services.gemini_engine import RateLimitedModel, RateLimiter
+from app.services.gemini_model_stack import CallCounter, wrap_model
+from app.services.gemini_usage import UsageRecorder, UsageRecordingModel
+
+
+class FakeModel:
+    model_name = 'models/gemini-2.5-flash'
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, contents, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(text='{"pages": []}')
+
+
+def test_layers_are_limiter_then_cache_then_recorder(tmp_path):
+    cache = GeminiResponseCache(str(tmp_path / 'responses.sqlite3'))
+    model = wrap_model(FakeModel(), RateLimiter(), cache, UsageRecorder(), model_name='gemini-2.5-flash')
+
+    assert isinstance(model, UsageRecordingModel)
+    assert isinstance(model.model, CachedGenerativeModel)
+    assert isinstance(model.model.model, RateLimitedModel)
+    assert isinstance(model.model.model.model, FakeModel)
+    cache.close()
+
+
+def test_cache_hits_are_recorded_without_spending_quota(tmp_path):
+    cache = GeminiResponseCache(str(tmp_path / 'responses.sqlite3'))
+    limiter = RateLimiter()
+    recorder = UsageRecorder()
+    fake = FakeModel()
+    model = wrap_model(fake, limiter, cache, recorder)
+
+    model.generate_content(['page'])
+    requests_left = limiter.requests.tokens
+    model.generate_content(['page'])
+
+    assert fake.calls == 1
+    assert limiter.requests.tokens >= requests_left
+    assert [call['cached'] for call in recorder.calls] == [False, True]
+    cache.close()
+
+
+def test_missing_layers_are_left_out():
+    fake = FakeModel()
+    assert wrap_model(fake) is fake
+
+
+def test_call_counter_counts_live_and_cached_calls_per_thread():
+    counter = CallCounter()
+    counter.count(SimpleNamespace(last_call_cached=False))
+    counter.count(SimpleNamespace(last_call_cached=True))
+    counter.count(FakeModel())  # Unwrapped models are always live
+
+    other_thread = []
+    thread = threading.Thread(target=lambda: other_thread.append(counter.pop()))
+    thread.start()
+    thread.join()
+
+    assert other_thread == [(0, 0)]
+    assert counter.pop() == (2, 1)
+    assert counter.pop() == (0, 0)
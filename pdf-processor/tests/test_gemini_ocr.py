@@ -0,0 +1,77 @@
+"""
+Gemini OCR tests
+Free-form JSON responses are parsed inside the retried request, so unparseable output is requested again
+"""
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app.services.gemini_ocr import GeminiOCR
+from app.services.gemini_retry import RetryPolicy
+
+
+PAGE = np.full((32, 32, 3), 255, dtype=np.uint8)
+
+
+class FakeModel:
+    """GenerativeModel stand-in answering requests with the given texts in turn"""
+
+    def __init__(self, *texts):
+        self.texts = list(texts)
+        self.requests = 0
+
+    def generate_content(self, contents, **kwargs):
+        self.requests += 1
+        return SimpleNamespace(text=self.texts.pop(0))
+
+
+def gemini_ocr(*texts, max_parse_attempts=2):
+    ocr = GeminiOCR('test-key', retry_policy=RetryPolicy(max_parse_attempts=max_parse_attempts, base_delay=0, max_delay=0))
+    ocr.model = FakeModel(*texts)
+    return ocr
+
+
+def test_unparseable_quiz_response_is_requested_again():
+    ocr = gemini_ocr('Sorry, here is the quiz: {{{', '{"questions": [{"number": "1"}]}')
+
+    quiz = ocr.extract_quiz_with_answers(PAGE)
+
+    assert ocr.model.requests == 2
+    assert json.loads(quiz) == {'questions': [{'number': '1'}]}
+
+
+def test_non_object_response_is_requested_again():
+    ocr = gemini_ocr('[1, 2]', '{"text": "x = 2", "quiz": {"questions": []}}')
+
+    assert ocr.extract_text_and_quiz(PAGE) == ('x = 2', '{"questions": []}')
+    assert ocr.model.requests == 2
+
+
+def test_batch_response_is_requested_again():
+    ocr = gemini_ocr('not json', '{"pages": [{"page_number": 4, "text": "x", "quiz": {}}]}')
+
+    assert ocr.extract_batch_quiz([(4, PAGE)]) == {4: ('x', '{}')}
+    assert ocr.model.requests == 2
+
+
+def test_repaired_response_is_not_requested_again(capsys):
+    ocr = gemini_ocr('{"questions": [{"number": "1",}]}')
+
+    assert json.loads(ocr.extract_quiz_with_answers(PAGE)) == {'questions': [{'number': '1'}]}
+    assert ocr.model.requests == 1
+    assert 'Repaired Gemini JSON' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('extract, failed', [
+    ('extract_quiz_with_answers', ''),
+    ('extract_text_and_quiz', ('', '')),
+    ('extract_batch_quiz', {}),
+])
+def test_parse_attempts_are_bounded(extract, failed):
+    ocr = gemini_ocr('no json', 'still no json', 'unused')
+
+    args = [[(1, PAGE)]] if extract == 'extract_batch_quiz' else [PAGE]
+    assert getattr(ocr, extract)(*args) == failed
+    assert ocr.model.requests == 2
@@ -0,0 +1,171 @@
+"""
+Retry layer tests
+Error classification, per-category retry budgets, cache eviction of unparseable responses and server back-off hints
+"""
+import json
+from types import SimpleNamespace
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+from google.generativeai.types import BlockedPromptException
+from google.protobuf import duration_pb2
+from google.rpc import error_details_pb2
+from pydantic import BaseModel, ValidationError
+
+from app.services import gemini_retry
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.gemini_retry import (
+    CIRCUIT_OPEN, OTHER, PARSE, RATE_LIMIT, SAFETY, SERVER,
+    GeminiRequestError, RetryPolicy, call_with_retry, classify_error, retry_after_hint,
+)
+
+
+POLICY = RetryPolicy(max_attempts=4, max_parse_attempts=2, base_delay=0.01, max_delay=0.05)
+
+
+def _finish_reason(code):
+    return ValueError(
+        "Invalid operation: The `response.text` quick accessor requires the response to contain a valid "
+        f"`Part`, but none were returned. The candidate's finish_reason is {code}."
+    )
+
+
+def _validation_error():
+    class Page(BaseModel):
+        page_id: int
+
+    try:
+        Page.model_validate_json('{"page_id": "three"}')
+    except ValidationError as e:
+        return e
+
+
+@pytest.mark.parametrize('error, category', [
+    (google_exceptions.ResourceExhausted('Quota exceeded'), RATE_LIMIT),
+    (google_exceptions.TooManyRequests('slow down'), RATE_LIMIT),
+    (Exception('429 Resource has been exhausted (e.g. check quota).'), RATE_LIMIT),
+    (google_exceptions.ServiceUnavailable('overloaded'), SERVER),
+    (google_exceptions.InternalServerError('internal'), SERVER),
+    (ConnectionError('reset by peer'), SERVER),
+    (_finish_reason(2), PARSE),   # MAX_TOKENS: a retry may fit
+    (_finish_reason(3), SAFETY),  # SAFETY: the same request is blocked again
+    (_finish_reason(4), SAFETY),  # RECITATION
+    (json.JSONDecodeError('Expecting value', '', 0), PARSE),
+    (_validation_error(), PARSE),
+    (BlockedPromptException('blocked'), SAFETY),
+    (CircuitOpenError('open'), CIRCUIT_OPEN),
+    (RuntimeError('bug'), OTHER),
+], ids=lambda value: value if isinstance(value, str) else type(value).__name__)
+def test_classify_error(error, category):
+    assert classify_error(error) == category
+
+
+@pytest.mark.parametrize('error, hint', [
+    (google_exceptions.ResourceExhausted('quota', details=[error_details_pb2.RetryInfo(
+        retry_delay=duration_pb2.Duration(seconds=37, nanos=500_000_000))]), 37.5),
+    (google_exceptions.TooManyRequests('slow down', response=SimpleNamespace(headers={'Retry-After': '12'})), 12.0),
+    (google_exceptions.ResourceExhausted('Quota exceeded. Please retry in 21.3s.'), 21.3),
+    (google_exceptions.ResourceExhausted('retry_delay { seconds: 9 }'), 9.0),
+    (google_exceptions.ServiceUnavailable('overloaded'), None),
+])
+def test_retry_after_hint(error, hint):
+    assert retry_after_hint(error) == hint
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(gemini_retry.time, 'sleep', slept.append)
+    return slept
+
+
+class Failing:
+    """Request raising the given errors in turn, then returning 'ok'"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+@pytest.mark.parametrize('error, attempts', [
+    (google_exceptions.ServiceUnavailable('overloaded'), POLICY.max_attempts),
+    (google_exceptions.ResourceExhausted('quota'), POLICY.max_attempts),
+    (json.JSONDecodeError('Expecting value', '', 0), POLICY.max_parse_attempts),
+    (_finish_reason(3), 1),
+    (RuntimeError('bug'), 1),
+])
+def test_each_category_gets_its_own_budget(sleeps, error, attempts):
+    request = Failing(*[error] * 10)
+
+    with pytest.raises(GeminiRequestError) as failure:
+        call_with_retry(request, POLICY)
+
+    assert request.calls == failure.value.attempts == attempts
+    assert failure.value.category == classify_error(error)
+    assert len(sleeps) == attempts - 1
+
+
+def test_budgets_are_counted_per_category(sleeps):
+    server = google_exceptions.ServiceUnavailable('overloaded')
+    parse = json.JSONDecodeError('Expecting value', '', 0)
+    request = Failing(server, parse, server, server, parse)
+
+    with pytest.raises(GeminiRequestError) as failure:
+        call_with_retry(request, POLICY)
+
+    # The second parse error exhausts its budget of 2; three server errors stay under 4
+    assert failure.value.category == PARSE
+    assert failure.value.attempts == 5
+
+
+def test_transient_errors_recover(sleeps):
+    request = Failing(google_exceptions.ServiceUnavailable('overloaded'), json.JSONDecodeError('x', '', 0))
+
+    assert call_with_retry(request, POLICY) == 'ok'
+    assert request.calls == 3
+
+
+def test_unparseable_responses_are_forgotten_by_the_cache(sleeps):
+    forgotten = []
+    model = SimpleNamespace(forget_last=lambda: forgotten.append(True))
+    request = Failing(google_exceptions.ServiceUnavailable('overloaded'), json.JSONDecodeError('x', '', 0))
+
+    call_with_retry(request, POLICY, model=model)
+
+    assert forgotten == [True]  # Only for the parse error
+
+
+def test_server_hint_is_a_lower_bound_on_the_delay(sleeps):
+    hinted = google_exceptions.ResourceExhausted('Quota exceeded. Please retry in 30s.')
+
+    call_with_retry(Failing(hinted), POLICY)
+
+    assert len(sleeps) == 1
+    assert 30 <= sleeps[0] <= 31  # Hint plus up to a second of jitter, above max_delay
+
+
+def test_rate_limit_pauses_go_through_the_limiter(sleeps):
+    pauses = []
+    limiter = SimpleNamespace(on_throttle=lambda pause: pauses.append(pause), on_success=lambda: None)
+    hinted = google_exceptions.ResourceExhausted('quota', details=[error_details_pb2.RetryInfo(
+        retry_delay=duration_pb2.Duration(seconds=12))])
+
+    call_with_retry(Failing(hinted), POLICY, rate_limiter=limiter)
+
+    assert sleeps == []
+    assert len(pauses) == 1 and pauses[0] >= 12
+
+
+def test_backoff_without_hints_stays_within_the_policy(sleeps):
+    request = Failing(*[google_exceptions.ServiceUnavailable('overloaded')] * 3)
+
+    call_with_retry(request, POLICY)
+
+    assert len(sleeps) == 3
+    assert all(POLICY.base_delay <= delay <= POLICY.max_delay for delay in sleeps)
@@ -0,0 +1,90 @@
+"""
+Gemini response schema tests
+Every response model converts to a response_schema the SDK accepts; $refs are inlined and Optional becomes nullable
+"""
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from google.generativeai import protos
+from google.generativeai.types import generation_types
+
+from app.services.gemini_ocr import GeminiOCR
+from app.services.gemini_schemas import (
+    AnswerBatch, DiagramAssignments, EnrichedBatch, Enrichment, Quiz, QuizBatch, TextAndQuiz,
+    json_generation_config, parse_structured, to_gemini_schema,
+)
+
+
+RESPONSE_MODELS = [Quiz, TextAndQuiz, QuizBatch, EnrichedBatch, AnswerBatch, DiagramAssignments]
+
+
+def _walk(schema):
+    yield schema
+    for prop in schema.get('properties', {}).values():
+        yield from _walk(prop)
+    if 'items' in schema:
+        yield from _walk(schema['items'])
+
+
+@pytest.mark.parametrize('model', RESPONSE_MODELS, ids=lambda model: model.__name__)
+def test_response_models_round_trip_through_generation_config(model):
+    config = protos.GenerationConfig(
+        generation_types.to_generation_config_dict(json_generation_config(model))
+    )
+
+    assert config.response_mime_type == 'application/json'
+    assert list(config.response_schema.properties) == list(model.model_fields)
+    assert list(config.response_schema.required) == list(model.model_fields)
+
+
+@pytest.mark.parametrize('model', RESPONSE_MODELS, ids=lambda model: model.__name__)
+def test_schemas_keep_only_keys_gemini_accepts(model):
+    allowed = {'type', 'format', 'enum', 'properties', 'required', 'items', 'nullable'}
+    for node in _walk(to_gemini_schema(model)):
+        assert set(node) <= allowed
+
+
+def test_refs_are_inlined_and_optional_fields_are_nullable():
+    schema = to_gemini_schema(Quiz)
+    question = schema['properties']['questions']['items']
+
+    assert '$ref' not in json.dumps(schema)
+    assert question['type'] == 'object'
+    assert question['properties']['number'] == {'type': 'string'}
+    assert question['properties']['question'] == {'type': 'string', 'nullable': True}
+    assert question['properties']['parts']['items']['properties']['marks'] == {'type': 'integer', 'nullable': True}
+
+
+def test_optional_nested_model_is_an_inlined_nullable_object():
+    bbox = to_gemini_schema(Enrichment)['properties']['diagram_bbox']
+
+    assert bbox['type'] == 'object'
+    assert bbox['nullable'] is True
+    assert bbox['required'] == ['x', 'y', 'width', 'height']
+
+
+def test_parse_structured_fills_defaults_and_rejects_mismatches():
+    data = parse_structured(Quiz, '{"questions": [{"number": "1", "question": null}]}')
+    assert data == {'questions': [{'number': '1', 'question': None, 'parts': []}]}
+
+    with pytest.raises(ValueError):
+        parse_structured(Quiz, '{"questions": [{"question": "no number"}]}')
+
+
+def test_quiz_extraction_is_schema_constrained_under_structured_output():
+    requests = []
+
+    class FakeModel:
+        def generate_content(self, contents, **kwargs):
+            requests.append(kwargs)
+            return SimpleNamespace(text='{"questions": [{"number": "1"}]}')
+
+    gemini_ocr = GeminiOCR('test-key', structured_output=True)
+    gemini_ocr.model = FakeModel()
+
+    quiz = gemini_ocr.extract_quiz_with_answers(np.full((32, 32, 3), 255, dtype=np.uint8))
+
+    assert requests == [{'generation_config': json_generation_config(Quiz)}]
+    assert json.loads(quiz) == {'questions': [{'number': '1', 'question': None, 'parts': []}]}
@@ -0,0 +1,52 @@
+"""
+Tests for Gemini usage accounting
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.gemini_cache import CachedGenerativeModel, GeminiResponseCache
+from app.services.gemini_usage import UsageRecorder, UsageRecordingModel, price_model_name
+
+
+class FakeModel:
+    """GenerativeModel stand-in returning a fixed response with usage metadata"""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def generate_content(self, contents, **kwargs):
+        usage = SimpleNamespace(prompt_token_count=3000, candidates_token_count=1000,
+                                cached_content_token_count=2000)
+        return SimpleNamespace(text='{"pages": []}', usage_metadata=usage)
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('gemini-2.5-flash', 'gemini-2.5-flash'),
+    ('models/gemini-2.5-flash', 'gemini-2.5-flash'),
+    ('gemini-2.5-flash:quiz-prompt-0123456789abcdef', 'gemini-2.5-flash'),
+    ('models/gemini-2.5-flash:quiz-prompt-0123456789abcdef', 'gemini-2.5-flash'),
+])
+def test_price_model_name(name, expected):
+    assert price_model_name(name) == expected
+
+
+def test_context_cached_calls_are_priced_as_the_base_model(tmp_path):
+    recorder = UsageRecorder()
+    cache = GeminiResponseCache(str(tmp_path / 'responses.sqlite3'))
+    # A context-cached model: the response cache key name carries the cache name
+    cached_model = CachedGenerativeModel(
+        FakeModel('models/gemini-2.5-flash'), cache,
+        model_name='gemini-2.5-flash:quiz-prompt-0123456789abcdef'
+    )
+
+    UsageRecordingModel(cached_model, recorder).generate_content(['page 1'])
+    UsageRecordingModel(cached_model, recorder, model_name='gemini-2.5-flash').generate_content(['page 2'])
+    UsageRecordingModel(FakeModel('models/gemini-2.5-flash'), recorder).generate_content(['page 3'])
+    cache.close()
+
+    input_price, output_price, cached_price = recorder.prices['gemini-2.5-flash']
+    expected = (1000 * input_price + 2000 * cached_price + 1000 * output_price) / 1e6
+    assert [call['model'] for call in recorder.calls] == ['gemini-2.5-flash'] * 3
+    assert [call['cost_usd'] for call in recorder.calls] == [pytest.approx(expected)] * 3
+    assert recorder.summary()['job']['cost_usd'] == pytest.approx(3 * expected)
@@ -0,0 +1,104 @@
+"""
+JSON repair tests
+Gemini's almost-JSON: truncation, LaTeX backslashes, missing commas, unquoted keys
+"""
+import json
+from pathlib import Path
+
+import pytest
+
+from app.services.json_repair import parse_llm_json
+
+
+# Gemini responses as the debug bundle stores them (gemini_response.json) with their expected
+# parse in <name>.expected.json; add responses that failed in production here
+FIXTURES = sorted((Path(__file__).parent / 'fixtures' / 'llm_json').glob('*.txt'))
+
+
+@pytest.mark.parametrize('response_file', FIXTURES, ids=lambda path: path.stem)
+def test_gemini_response_corpus(response_file):
+    expected = json.loads(response_file.with_suffix('.expected.json').read_text(encoding='utf-8'))
+
+    data, _, truncated = parse_llm_json(response_file.read_text(encoding='utf-8'))
+
+    assert data == expected['data']
+    assert truncated == expected['truncated']
+
+
+def test_valid_json_is_unchanged():
+    data, fixes, truncated = parse_llm_json('```json\n{"pages": [{"text": "x\\ny"}]}\n```')
+
+    assert data == {'pages': [{'text': 'x\ny'}]}
+    assert fixes == []
+    assert not truncated
+
+
+def test_truncated_document_is_closed_and_flagged():
+    text = '{"pages": [{"quiz": {"questions": [{"number": "1", "question": "Solve"}, {"number": "2", "question": "Find the ar'
+    data, fixes, truncated = parse_llm_json(text)
+
+    questions = data['pages'][0]['quiz']['questions']
+    assert [question['number'] for question in questions] == ['1', '2']
+    assert questions[1]['question'] == 'Find the ar'
+    assert truncated
+
+
+def test_truncated_literal_is_flagged():
+    data, _, truncated = parse_llm_json('{"a": [1, 2], "b": tr')
+
+    assert data == {'a': [1, 2], 'b': True}
+    assert truncated
+
+
+@pytest.mark.parametrize('raw, expected', [
+    (r'{"q": "\frac{1}{2} \times 3"}', r'\frac{1}{2} \times 3'),
+    (r'{"q": "\(x^2\) and \sqrt{2}"}', r'\(x^2\) and \sqrt{2}'),
+    (r'{"q": "a \neq b, \theta"}', r'a \neq b, \theta'),
+])
+def test_latex_backslashes_are_kept(raw, expected):
+    data, _, truncated = parse_llm_json(raw)
+
+    assert data['q'] == expected
+    assert not truncated
+
+
+@pytest.mark.parametrize('raw, expected', [
+    (r'{"q": "x\ne 5"}', 'x\ne 5'),
+    (r'{"q": "Diagram\nnot drawn to scale"}', 'Diagram\nnot drawn to scale'),
+    (r'{"q": "x\nu y", "r": "\frac{1}{2}"}', 'x\nu y'),
+])
+def test_newline_before_a_word_stays_a_newline(raw, expected):
+    data, _, _ = parse_llm_json(raw)
+
+    assert data['q'] == expected
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('["x" "y"]', ['x', 'y']),
+    ('[1 2 3]', [1, 2, 3]),
+    ('{"a": "x"\n "b": 1}', {'a': 'x', 'b': 1}),
+    ('{"a": {"b": 1} "c": [1]}', {'a': {'b': 1}, 'c': [1]}),
+])
+def test_missing_commas(raw, expected):
+    data, fixes, _ = parse_llm_json(raw)
+
+    assert data == expected
+    assert any(fix.startswith('missing comma') for fix in fixes)
+
+
+def test_unquoted_keys_and_python_literals():
+    data, fixes, _ = parse_llm_json("{number: '3', has_diagram: True, marks: None,}")
+
+    assert data == {'number': '3', 'has_diagram': True, 'marks': None}
+    assert 'unquoted key x3' in fixes
+
+
+def test_unescaped_quotes_inside_a_string():
+    data, _, _ = parse_llm_json('{"q": "He said "hi" to me", "n": 1}')
+
+    assert data == {'q': 'He said "hi" to me', 'n': 1}
+
+
+def test_unrecoverable_output_raises():
+    with pytest.raises(json.JSONDecodeError):
+        parse_llm_json('Sorry, I cannot read this page.')
@@ -0,0 +1,118 @@
+"""
+Incremental JSON parser tests
+Items and their page context come out the same whatever the chunking, with strings, escapes and fences around them
+"""
+import json
+import random
+
+import pytest
+
+from app.services.json_stream import IncrementalJSONParser
+
+
+QUESTIONS = [
+    [
+        {'number': '1', 'question': 'Solve {x + 1} = 3, then [x]', 'parts': [{'part': '(a)'}]},
+        {'number': '2', 'question': 'He said "hence", a, b}, c]', 'parts': []},
+    ],
+    [
+        {'number': '3', 'question': 'Path C:\\temp\\new\tand \\frac{1}{2}\nnext line', 'parts': []},
+    ],
+]
+
+DOCUMENT = json.dumps({
+    'pages': [
+        {'page_id': 7, 'text': 'page "seven" {not a brace}', 'quiz': {'questions': QUESTIONS[0]}},
+        {'page_id': 8, 'text': '', 'quiz': {'questions': QUESTIONS[1]}},
+    ]
+}, indent=2)
+
+
+def _feed(text, chunk_size, keys=('questions',)):
+    parser = IncrementalJSONParser(keys)
+    items = []
+    for start in range(0, len(text), chunk_size):
+        items += parser.feed(text[start:start + chunk_size])
+    return items
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, len(DOCUMENT)])
+def test_items_are_independent_of_chunk_boundaries(chunk_size):
+    items = _feed(DOCUMENT, chunk_size)
+
+    assert [item for _, _, item in items] == QUESTIONS[0] + QUESTIONS[1]
+    assert [context['page_id'] for _, context, _ in items] == [7, 7, 8]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7])
+def test_braces_commas_and_escaped_quotes_inside_strings(chunk_size):
+    items = _feed(DOCUMENT, chunk_size)
+
+    assert items[1][2]['question'] == 'He said "hence", a, b}, c]'
+    assert items[2][2]['question'] == QUESTIONS[1][0]['question']
+    assert items[0][1]['text'] == 'page "seven" {not a brace}'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 4])
+def test_fence_text_around_the_document_is_ignored(chunk_size):
+    text = 'Here is the JSON:\n```json\n' + DOCUMENT + '\n```\nLet me know {if} you need more.'
+
+    items = _feed(text, chunk_size)
+
+    assert [item['number'] for _, _, item in items] == ['1', '2', '3']
+
+
+def test_paths_give_the_page_index_of_each_item():
+    document = json.dumps({'pages': [
+        {'page_number': 1, 'answers': [{'question_num': '1'}, {'question_num': '2'}]},
+        {'page_number': 5, 'answers': [{'question_num': '3'}]},
+        {'page_number': 6, 'answers': []},
+        {'page_number': 9, 'answers': [{'question_num': '4'}]},
+    ]})
+
+    items = _feed(document, 5, keys=('answers',))
+
+    assert [path for path, _, _ in items] == [
+        ('pages', 0, 'answers', 0), ('pages', 0, 'answers', 1), ('pages', 1, 'answers', 0), ('pages', 3, 'answers', 0),
+    ]
+    # GeminiAnswerParser maps streamed answers to pages by path[1]
+    assert [(path[1], item['question_num']) for path, _, item in items] == [(0, '1'), (0, '2'), (1, '3'), (3, '4')]
+
+
+def test_context_only_holds_scalars_seen_before_the_item():
+    document = '{"pages": [{"quiz": {"questions": [{"number": "1"}]}, "page_id": 2}]}'
+
+    ((_, context, item),) = _feed(document, 3)
+
+    assert item == {'number': '1'}
+    assert 'page_id' not in context  # Generated after the question: the full parse maps it
+
+
+def test_incomplete_items_are_not_returned():
+    items = _feed(DOCUMENT[:DOCUMENT.index('"number": "2"') + 20], 3)
+
+    assert [item['number'] for _, _, item in items] == ['1']
+
+
+@pytest.mark.parametrize('key', [r'\q{1}', r'\q[1]', r'x\q{"questions": 1}'])
+def test_keys_that_decode_to_containers_name_nothing(key):
+    document = '{"%s": [{"number": "0"}], "%s": 1, "questions": [{"number": "1"}]}' % (key, key)
+
+    items = _feed(document, 3)
+
+    assert [(path, item) for path, _, item in items] == [(('questions', 0), {'number': '1'})]
+
+
+def test_mutated_documents_never_raise():
+    rng = random.Random(7)
+    noise = list('{}[]",:\\\'') + ['\\q{', '\\q[', '"\\q{1}":', 'null', '\n']
+    for _ in range(300):
+        text = list(DOCUMENT)
+        for _ in range(rng.randint(1, 8)):
+            position = rng.randrange(len(text))
+            if rng.random() < 0.3:
+                del text[position]
+            else:
+                text.insert(position, rng.choice(noise))
+        for _, _, item in _feed(''.join(text), rng.choice([1, 5, 64])):
+            assert isinstance(item, dict)
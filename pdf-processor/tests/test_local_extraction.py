@@ -0,0 +1,30 @@
+"""
+Local extraction tests
+Degraded-mode splitting of question and answer pages without Gemini
+"""
+import numpy as np
+
+from app.services.local_extraction import extract_answers_locally, split_questions
+
+
+PAGE = np.full((100, 100, 3), 255, dtype=np.uint8)
+
+
+def test_questions_are_split_into_parts():
+    questions = split_questions("1 Simplify 3x + 2x [1]\n2 (a) Solve x + 1 = 4 [1]\n(b) Expand 2(x - 1) [2]\n")
+
+    assert [question['number'] for question in questions] == ['1', '2']
+    assert [part['part'] for part in questions[1]['parts']] == ['(a)', '(b)']
+    assert questions[1]['parts'][1]['marks'] == 2
+
+
+def test_answer_page_is_split_into_answers():
+    layout = {'text': "1 (a) x = 3\n(b) 2x - 2\n2 5x\nworking: 3x + 2x = 5x\n", 'lines': [], 'quality': 1.0}
+    page = extract_answers_locally(None, 1, PAGE, layout, use_text_layer=True)
+
+    answers = page['answers']
+    assert [answer['question_num'] for answer in answers] == ['1', '2']
+    assert answers[0]['parts'][0] == {
+        'part': '(a)', 'steps': ['x = 3'], 'final_answer': None, 'marks': None, 'has_diagram': False,
+    }
+    assert answers[1]['parts'][0]['steps'] == ['5x', 'working: 3x + 2x = 5x']
@@ -0,0 +1,91 @@
+"""
+Page render cache tests
+Misses stay silent; stored pages come back unchanged; the least recently used pages are evicted
+"""
+import os
+
+import cv2
+import numpy as np
+
+from app.services.page_cache import PageRenderCache
+
+
+PDF_HASH = 'ab' * 32
+
+
+def test_miss_returns_none_without_opencv_warnings(tmp_path, capfd):
+    cache = PageRenderCache(tmp_path / 'cache')
+
+    assert cache.fetch(PDF_HASH, 0, 300, 'rgb', tmp_path / 'page_1.png') is None
+    assert capfd.readouterr().err == ''
+    assert not (tmp_path / 'page_1.png').exists()
+
+
+def test_stored_page_is_returned(tmp_path):
+    cache = PageRenderCache(tmp_path / 'cache')
+    page = np.zeros((20, 30, 3), dtype=np.uint8)
+    page[:, :, 0] = 200  # Red channel, to catch BGR/RGB mix-ups
+    source = tmp_path / 'rendered.png'
+    cv2.imwrite(str(source), cv2.cvtColor(page, cv2.COLOR_RGB2BGR))
+    cache.store(PDF_HASH, 0, 300, 'rgb', source)
+
+    cached = cache.fetch(PDF_HASH, 0, 300, 'rgb', tmp_path / 'page_1.png')
+
+    assert np.array_equal(cached, page)
+    assert (tmp_path / 'page_1.png').exists()
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = PageRenderCache(tmp_path / 'cache')
+    source = tmp_path / 'rendered.png'
+    source.write_bytes(b'not a png')
+    cache.store(PDF_HASH, 0, 300, 'rgb', source)
+
+    assert cache.fetch(PDF_HASH, 0, 300, 'rgb', tmp_path / 'page_1.png') is None
+
+
+def _write_page(path, seed):
+    """A noise PNG (so every page compresses to about the same size); returns its image"""
+    page = np.random.default_rng(seed).integers(0, 256, size=(24, 24, 3), dtype=np.uint8)
+    cv2.imwrite(str(path), cv2.cvtColor(page, cv2.COLOR_RGB2BGR))
+    return page
+
+
+def test_least_recently_used_entry_is_evicted_and_a_fetched_one_survives(tmp_path):
+    sources = [tmp_path / f'rendered_{i}.png' for i in range(3)]
+    pages = [_write_page(source, seed) for seed, source in enumerate(sources)]
+    entry_size = max(source.stat().st_size for source in sources)
+    cache = PageRenderCache(tmp_path / 'cache', max_bytes=int(entry_size * 2.5))
+
+    cache.store(PDF_HASH, 0, 300, 'rgb', sources[0])
+    cache.store(PDF_HASH, 1, 300, 'rgb', sources[1])
+    os.utime(cache._entry_path(PDF_HASH, 0, 300, 'rgb'), (1000, 1000))
+    os.utime(cache._entry_path(PDF_HASH, 1, 300, 'rgb'), (2000, 2000))
+    assert np.array_equal(cache.fetch(PDF_HASH, 0, 300, 'rgb', tmp_path / 'page_1.png'), pages[0])  # Now the newest
+    cache.store(PDF_HASH, 2, 300, 'rgb', sources[2])
+
+    assert cache.fetch(PDF_HASH, 1, 300, 'rgb', tmp_path / 'page_2.png') is None
+    assert np.array_equal(cache.fetch(PDF_HASH, 0, 300, 'rgb', tmp_path / 'page_1.png'), pages[0])
+    assert np.array_equal(cache.fetch(PDF_HASH, 2, 300, 'rgb', tmp_path / 'page_3.png'), pages[2])
+
+
+def test_directory_is_only_rescanned_when_over_the_bound(tmp_path, monkeypatch):
+    source = tmp_path / 'rendered.png'
+    _write_page(source, 0)
+    size = source.stat().st_size
+    cache = PageRenderCache(tmp_path / 'cache', max_bytes=size * 5)
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, 'evict', lambda: (scans.append(1), evict()))
+
+    for page_index in range(5):
+        cache.store(PDF_HASH, page_index, 300, 'rgb', source)
+    cache.store(PDF_HASH, 4, 300, 'rgb', source)  # Replacing an entry doesn't grow the cache
+    assert len(scans) == 1  # The first store measures the directory
+
+    cache.store(PDF_HASH, 5, 300, 'rgb', source)
+    assert len(scans) == 2
+    # Evicted down to 90% of the bound: room for the next store without another scan
+    assert len(list((tmp_path / 'cache').glob('*/*.png'))) == 4
+    cache.store(PDF_HASH, 6, 300, 'rgb', source)
+    assert len(scans) == 2
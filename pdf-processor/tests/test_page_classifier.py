@@ -0,0 +1,103 @@
+"""
+Page classifier tests
+Cover and instruction pages are skipped; first pages that carry questions are not
+"""
+import cv2
+import numpy as np
+import pytest
+
+from app.services.page_classifier import PageClassifier, calls_avoided
+
+
+@pytest.fixture
+def printed_page():
+    page = np.full((1100, 850, 3), 255, dtype=np.uint8)
+    for top in range(100, 1000, 40):
+        page[top:top + 12, 80:770] = 0  # Lines of "text"
+    return page
+
+
+@pytest.fixture
+def sparse_page():
+    """A 300 DPI page with a single question line and a large answer space"""
+    page = np.full((3508, 2480, 3), 255, dtype=np.uint8)
+    cv2.putText(page, '1 Solve the equation 3x + 5 = 20.', (250, 400),
+                cv2.FONT_HERSHEY_SIMPLEX, 1.4, (0, 0, 0), 2, cv2.LINE_AA)
+    cv2.putText(page, '[2]', (2150, 400), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (0, 0, 0), 2, cv2.LINE_AA)
+    return page
+
+
+COVER_TEXT = """Candidate Name
+Index Number
+MATHEMATICS 4048/01
+Paper 1 2 hours
+READ THESE INSTRUCTIONS FIRST
+Write your name and index number on all the work you hand in.
+Answer all questions.
+"""
+
+
+def test_cover_page_is_skipped(printed_page):
+    result = PageClassifier().classify(printed_page, COVER_TEXT)
+
+    assert result['label'] == 'cover'
+    assert result['skip']
+
+
+def test_first_page_with_questions_stays_content(printed_page):
+    text = """Candidate Name ____________   Index Number ______
+Answer all questions. Show all working.
+1. Work out 3/4 + 2/5, giving your answer as a fraction.
+2. Factorise completely 6x^2 - 15x.
+3. Solve 5 - 2x > 11.
+"""
+    result = PageClassifier().classify(printed_page, text)
+
+    assert result['label'] == 'content'
+    assert not result['skip']
+
+
+def test_long_instruction_text_stays_content(printed_page):
+    text = "Answer all the questions. " + "The diagram shows a triangle with sides of given length. " * 40
+    result = PageClassifier().classify(printed_page, text)
+
+    assert result['label'] == 'content'
+
+
+def test_blank_page_is_skipped():
+    result = PageClassifier().classify(np.full((1100, 850), 255, dtype=np.uint8), "")
+
+    assert result['label'] == 'blank'
+
+
+def test_sparse_question_page_stays_content(sparse_page):
+    result = PageClassifier().classify(sparse_page, "1 Solve the equation 3x + 5 = 20. [2]")
+
+    assert result['label'] == 'content'
+    assert not result['skip']
+
+
+def test_sparse_page_without_text_layer_is_not_blank(sparse_page):
+    result = PageClassifier().classify(sparse_page, "")
+
+    assert result['label'] == 'content'
+    assert result['ink'] >= PageClassifier().blank_ink_ratio
+
+
+def test_blank_page_notice_with_page_number_is_blank(printed_page):
+    result = PageClassifier().classify(printed_page, "4\nBLANK PAGE\n")
+
+    assert result['label'] == 'blank'
+
+
+@pytest.mark.parametrize('page_count, skipped_count, pages_per_call, expected', [
+    (5, 3, 5, 0),   # The remaining 2 pages still take one call
+    (5, 5, 5, 1),
+    (10, 5, 5, 1),
+    (7, 2, 5, 1),   # 2 calls for 7 pages, 1 for the remaining 5
+    (7, 1, 5, 0),
+    (7, 2, 1, 2),
+    (4, 0, 5, 0),
+])
+def test_calls_avoided_counts_whole_batches(page_count, skipped_count, pages_per_call, expected):
+    assert calls_avoided(page_count, skipped_count, pages_per_call) == expected
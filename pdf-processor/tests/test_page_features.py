@@ -0,0 +1,144 @@
+"""
+Page features tests
+Detectors accept arrays, paths or a shared PageFeatures, preprocess each page once, and keep their 300 DPI results
+"""
+import types
+
+import cv2
+import numpy as np
+import pytest
+
+import page_features
+from detect_diagrams_hybrid import detect_diagrams_hybrid
+from detect_diagrams_yolo import detect_diagrams_yolo
+from page_features import PageFeatures
+
+
+def exam_page():
+    """A 300 DPI page with lines of text, a labelled triangle and a bar chart (RGB)"""
+    page = np.full((3508, 2480, 3), 255, np.uint8)
+    for top in range(100, 400, 40):
+        cv2.putText(page, 'Solve the equation for x and show working', (80, top),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 0), 2)
+    corners = np.array([[200, 900], [600, 900], [400, 550]], np.int32)
+    cv2.polylines(page, [corners], True, (0, 0, 0), 3)
+    cv2.circle(page, (400, 780), 60, (0, 0, 0), 2)
+    for label, (x, y) in zip('ABC', corners):
+        cv2.putText(page, label, (int(x) + 10, int(y) + 10), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 2)
+    cv2.rectangle(page, (750, 1100), (1100, 1450), (0, 0, 0), 3)
+    for i in range(5):
+        cv2.rectangle(page, (780 + i * 60, 1400 - i * 50), (820 + i * 60, 1450), (60, 60, 60), -1)
+    return page
+
+
+# Detections of exam_page() by the detectors before they took arrays (reading the PNG from disk)
+BASELINE_HYBRID = [
+    {'bbox': (192, 529, 639, 916), 'area': 172989, 'density': 7.5735, 'confidence': 100.0, 'source': 'contour_density'},
+    {'bbox': (741, 1091, 1109, 1459), 'area': 135424, 'density': 3.264, 'confidence': 100.0, 'source': 'contour_density'},
+]
+BASELINE_YOLO = [
+    {'bbox': (198, 548, 603, 910), 'area': 146610, 'confidence': 85, 'source': 'layout_analysis'},
+    {'bbox': (748, 1098, 1103, 1453), 'area': 126025, 'confidence': 85, 'source': 'layout_analysis'},
+]
+
+
+@pytest.fixture(scope='module')
+def page():
+    return exam_page()
+
+
+@pytest.fixture
+def counting_cv2(monkeypatch):
+    """Count the grayscale conversions and Canny runs of PageFeatures"""
+    calls = {'cvtColor': 0, 'Canny': 0}
+
+    def counted(name):
+        def call(*args, **kwargs):
+            calls[name] += 1
+            return getattr(cv2, name)(*args, **kwargs)
+        return call
+
+    proxy = types.SimpleNamespace(**{name: getattr(cv2, name) for name in dir(cv2) if not name.startswith('__')})
+    proxy.cvtColor, proxy.Canny = counted('cvtColor'), counted('Canny')
+    monkeypatch.setattr(page_features, 'cv2', proxy)
+    return calls
+
+
+def test_of_wraps_an_array(page):
+    features = PageFeatures.of(page)
+
+    assert features.image is page
+    assert features.name == 'page'
+    np.testing.assert_array_equal(features.gray, cv2.cvtColor(page, cv2.COLOR_RGB2GRAY))
+
+
+def test_of_reads_a_path_as_grayscale(tmp_path, page):
+    path = tmp_path / 'page_4.png'
+    cv2.imwrite(str(path), cv2.cvtColor(page, cv2.COLOR_RGB2BGR))
+
+    features = PageFeatures.of(path)
+
+    assert features.name == 'page_4.png'
+    assert features.image.ndim == 2
+    assert features.gray is features.image
+    assert np.abs(features.gray.astype(int) - cv2.cvtColor(page, cv2.COLOR_RGB2GRAY)).max() <= 1
+
+
+def test_of_keeps_an_existing_instance(page):
+    features = PageFeatures(page, 'page_7.png')
+
+    assert PageFeatures.of(features) is features
+
+
+def test_of_a_missing_path_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        PageFeatures.of(tmp_path / 'missing.png')
+
+
+@pytest.mark.parametrize('channels, code', [(3, cv2.COLOR_RGB2GRAY), (4, cv2.COLOR_RGBA2GRAY)])
+def test_gray_of_color_pages(channels, code):
+    image = np.random.default_rng(0).integers(0, 256, size=(40, 30, channels), dtype=np.uint8)
+
+    np.testing.assert_array_equal(PageFeatures(image).gray, cv2.cvtColor(image, code))
+
+
+def test_gray_and_edges_are_computed_once_for_both_detectors(page, counting_cv2):
+    features = PageFeatures(page)
+
+    detect_diagrams_hybrid(features)
+    detect_diagrams_yolo(features)
+    detect_diagrams_hybrid(features)
+
+    assert counting_cv2 == {'cvtColor': 1, 'Canny': 1}
+    assert features.edge_density.edges is features.edges
+
+
+def test_fingerprint_follows_the_pixels(page):
+    assert PageFeatures(page).fingerprint == PageFeatures(page.copy()).fingerprint
+    assert PageFeatures(page).fingerprint != PageFeatures(cv2.cvtColor(page, cv2.COLOR_RGB2GRAY)).fingerprint
+    changed = page.copy()
+    changed[0, 0] = 0
+    assert PageFeatures(page).fingerprint != PageFeatures(changed).fingerprint
+
+
+def test_hybrid_results_at_300_dpi_are_unchanged(page):
+    detected = detect_diagrams_hybrid(page, dpi=300)
+
+    assert [{**d, 'density': pytest.approx(d['density'])} for d in detected] == BASELINE_HYBRID
+    assert detect_diagrams_hybrid(PageFeatures(page)) == detected
+
+
+def test_yolo_results_at_300_dpi_are_unchanged(page):
+    assert detect_diagrams_yolo(page, dpi=300) == BASELINE_YOLO
+    assert detect_diagrams_yolo(PageFeatures(page)) == BASELINE_YOLO
+
+
+def test_dpi_scales_the_size_thresholds(page):
+    # The same page at 150 DPI: boxes halve instead of falling under the 300 DPI minimum sizes
+    half = cv2.resize(page, (page.shape[1] // 2, page.shape[0] // 2), interpolation=cv2.INTER_AREA)
+
+    detected = detect_diagrams_yolo(half, dpi=150)
+
+    assert len(detected) == len(BASELINE_YOLO)
+    for box, baseline in zip(detected, BASELINE_YOLO):
+        assert box['bbox'] == pytest.approx([v / 2 for v in baseline['bbox']], abs=6)
@@ -0,0 +1,284 @@
+"""
+Tests for PDFProcessor rendering (parallel order, two-resolution crops, colorspaces),
+extract_text_layout quality scoring and process_page's quiz data
+"""
+import json
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import cv2
+import fitz
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.services import pdf_processor
+from app.services.gemini_ocr import GeminiOCR
+from app.services.pdf_processor import PDFProcessor, TEXT_LAYER_MIN_QUALITY
+
+
+QUESTION_TEXT = '\n'.join([
+    '1 Solve the equation 3x + 5 = 20. [2]',
+    '2 The diagram shows a triangle ABC with AB = 7 cm and BC = 9 cm.',
+    '(a) Calculate the length of AC. [3]',
+    '(b) Find angle ABC, giving your answer to 1 decimal place. [2]',
+])
+
+QUIZ = {'questions': [{'number': '1', 'question': 'Solve the equation 3x + 5 = 20.', 'parts': []}]}
+
+
+class FakeModel:
+    """GenerativeModel stand-in answering like Gemini: the quiz-only prompt gets a fenced, trailing-comma reply"""
+
+    def generate_content(self, contents, **kwargs):
+        if 'Return a JSON with two fields' in contents[0]:
+            return SimpleNamespace(text=json.dumps({'text': 'OCR text', 'quiz': QUIZ}))
+        return SimpleNamespace(text='```json\n' + json.dumps(QUIZ)[:-1] + ',}\n```')
+
+
+def _write_pdf(tmp_path, text):
+    """One-page PDF holding text (nothing if empty)"""
+    doc = fitz.open()
+    page = doc.new_page()
+    y = 72
+    for line in text.splitlines():
+        page.insert_text((72, y), line, fontsize=11)
+        y += 14
+    path = tmp_path / 'page.pdf'
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def _layout(tmp_path, text):
+    """Quality-scored layout of a one-page PDF holding text (nothing if empty)"""
+    path = _write_pdf(tmp_path, text)
+    processor = PDFProcessor(output_dir=str(tmp_path))
+    processor.pdf_doc = fitz.open(path)
+    try:
+        return processor.extract_text_layout(1)
+    finally:
+        processor.pdf_doc.close()
+
+
+@pytest.mark.parametrize('text', ['', 'Q1 short'])
+def test_blank_and_near_empty_text_layers_are_not_trusted(tmp_path, text):
+    layout = _layout(tmp_path, text)
+    assert layout['quality'] == 0.0
+    assert layout['quality'] < TEXT_LAYER_MIN_QUALITY
+
+
+def test_full_text_layer_is_trusted(tmp_path):
+    layout = _layout(tmp_path, QUESTION_TEXT)
+    assert layout['quality'] >= TEXT_LAYER_MIN_QUALITY
+    assert 'Solve the equation' in layout['text']
+
+
+@pytest.mark.parametrize('text', [QUESTION_TEXT, ''], ids=['text_layer', 'ocr'])
+def test_quiz_data_has_the_same_shape_on_both_branches(tmp_path, text):
+    gemini_ocr = GeminiOCR('test-key')
+    gemini_ocr.model = FakeModel()
+    processor = PDFProcessor(output_dir=str(tmp_path), gemini_ocr=gemini_ocr)
+    processor.pdf_doc = fitz.open(_write_pdf(tmp_path, text))
+    try:
+        page = processor.process_page(np.full((400, 300, 3), 255, dtype=np.uint8), 1)
+    finally:
+        processor.pdf_doc.close()
+
+    assert json.loads(page['quiz_data']) == QUIZ
+
+
+def _write_numbered_pdf(tmp_path, page_count):
+    """PDF whose page N has a bar N * 20 points wide, so rendered pages can be told apart"""
+    doc = fitz.open()
+    for number in range(1, page_count + 1):
+        page = doc.new_page(width=200, height=150)
+        page.draw_rect(fitz.Rect(10, 10, 10 + number * 20, 30), fill=(0, 0, 0))
+        page.insert_text((10, 60), f'Page {number}', fontsize=12)
+    path = tmp_path / 'numbered.pdf'
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def _bar_width(img):
+    """Width in pixels of the black bar at the top of a _write_numbered_pdf page"""
+    row = img[img.shape[0] // 10] if img.ndim == 2 else img[img.shape[0] // 10, :, 0]
+    return int(np.count_nonzero(row < 128))
+
+
+class InlinePool:
+    """ProcessPoolExecutor stand-in: runs a submitted range when its result is taken, tracking chunks in flight"""
+
+    instances = []
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.submitted = []
+        InlinePool.instances.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args):
+        self.submitted.append(args[1:3])
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        future = Future()
+        pool = self
+
+        def result(timeout=None):
+            pool.in_flight -= 1
+            return fn(*args)
+
+        future.result = result
+        return future
+
+
+@pytest.fixture
+def inline_pool(monkeypatch):
+    InlinePool.instances = []
+    monkeypatch.setattr(pdf_processor, 'ProcessPoolExecutor', InlinePool)
+    return InlinePool
+
+
+def test_parallel_pages_come_in_order_with_bounded_work_in_flight(tmp_path, inline_pool):
+    path = _write_numbered_pdf(tmp_path, 7)
+    processor = PDFProcessor(output_dir=str(tmp_path), dpi=72, render_workers=2, render_chunk_size=2)
+
+    pages = list(processor.iter_pages(str(path)))
+    processor.close()
+
+    assert [number for number, _ in pages] == list(range(1, 8))
+    assert [_bar_width(img) for _, img in pages] == pytest.approx([number * 20 for number in range(1, 8)], abs=1)
+    pool = inline_pool.instances[0]
+    assert pool.max_workers == 2
+    assert pool.submitted == [(0, 2), (2, 4), (4, 6), (6, 7)]
+    assert pool.max_in_flight <= 2
+
+
+def test_parallel_rendering_stops_submitting_when_the_consumer_stops(tmp_path, inline_pool):
+    processor = PDFProcessor(output_dir=str(tmp_path), dpi=72, render_workers=2, render_chunk_size=1)
+    pages = processor.iter_pages(str(_write_numbered_pdf(tmp_path, 10)))
+
+    assert next(pages)[0] == 1
+    pages.close()
+    processor.close()
+
+    assert len(inline_pool.instances[0].submitted) == 3
+
+
+def test_worker_processes_match_serial_rendering(tmp_path):
+    path = _write_numbered_pdf(tmp_path, 5)
+    serial = PDFProcessor(output_dir=str(tmp_path / 'serial'), dpi=72)
+    parallel = PDFProcessor(output_dir=str(tmp_path / 'parallel'), dpi=72, render_workers=2, render_chunk_size=2)
+
+    expected = list(serial.iter_pages(str(path)))
+    rendered = list(parallel.iter_pages(str(path)))
+    serial.close()
+    parallel.close()
+
+    assert [number for number, _ in rendered] == [1, 2, 3, 4, 5]
+    for (_, expected_img), (_, img) in zip(expected, rendered):
+        np.testing.assert_array_equal(img, expected_img)
+    assert sorted(p.name for p in (tmp_path / 'parallel').glob('page_*.png')) == [f'page_{n}.png' for n in range(1, 6)]
+
+
+def _fine_print_pdf(tmp_path):
+    """A page with 1-point stripes (visible at full DPI, blurred away in a 72 DPI preview) and a caption"""
+    doc = fitz.open()
+    page = doc.new_page(width=200, height=200)
+    for x in range(40, 160, 2):
+        page.draw_line((x, 40), (x, 160), width=1)
+    page.insert_text((40, 180), 'Figure 1', fontsize=10)
+    path = tmp_path / 'fine.pdf'
+    doc.save(path)
+    doc.close()
+    return path
+
+
+@pytest.mark.parametrize('colorspace', ['rgb', 'gray'])
+def test_region_is_re_rendered_at_full_dpi(tmp_path, colorspace):
+    processor = PDFProcessor(output_dir=str(tmp_path), dpi=288, analysis_dpi=72, colorspace=colorspace)
+    ((_, preview),) = list(processor.iter_pages(str(_fine_print_pdf(tmp_path))))
+    bbox = (40, 40, 160, 160)
+
+    crop = processor.crop_page_region(preview, 1, bbox)
+    with processor.doc_lock:
+        full = pdf_processor._render_page(processor.get_page(1), 288, colorspace=colorspace)
+    processor.close()
+
+    assert preview.shape[:2] == (200, 200)
+    assert crop.shape[:2] == (480, 480)
+    np.testing.assert_array_equal(crop, full[160:640, 160:640])
+    # Not the preview crop scaled up: that has lost the stripes
+    upscaled = cv2.resize(preview[40:160, 40:160], (480, 480), interpolation=cv2.INTER_LINEAR)
+    assert np.abs(crop.astype(int) - upscaled.astype(int)).mean() > 20
+
+
+def test_single_resolution_crop_is_a_slice_of_the_page(tmp_path):
+    processor = PDFProcessor(output_dir=str(tmp_path), dpi=72)
+    ((_, page),) = list(processor.iter_pages(str(_fine_print_pdf(tmp_path))))
+
+    crop = processor.crop_page_region(page, 1, (40, 40, 160, 160))
+    processor.close()
+
+    assert np.shares_memory(crop, page)
+    assert crop.shape == (120, 120, 3)
+
+
+def test_binary_crops_are_re_rendered_anti_aliased(tmp_path):
+    processor = PDFProcessor(output_dir=str(tmp_path), dpi=144, analysis_dpi=72, colorspace='binary')
+    ((_, preview),) = list(processor.iter_pages(str(_fine_print_pdf(tmp_path))))
+
+    crop = processor.render_region(1, (30, 165, 170, 190))  # The caption
+    processor.close()
+
+    assert set(np.unique(preview)) <= {0, 255}
+    assert crop.ndim == 2
+    assert len(np.unique(crop)) > 2
+
+
+@pytest.mark.parametrize('colorspace, shape', [('rgb', (150, 200, 3)), ('gray', (150, 200)), ('binary', (150, 200))])
+def test_colorspace_shape_and_dtype(tmp_path, colorspace, shape):
+    processor = PDFProcessor(output_dir=str(tmp_path), dpi=72, colorspace=colorspace)
+
+    ((_, img),) = list(processor.iter_pages(str(_write_numbered_pdf(tmp_path, 1))))
+    processor.close()
+
+    assert img.shape == shape
+    assert img.dtype == np.uint8
+    if colorspace == 'binary':
+        assert set(np.unique(img)) <= {0, 255}
+
+
+def test_binary_pages_round_trip_through_1_bit_pngs(tmp_path):
+    processor = PDFProcessor(output_dir=str(tmp_path), dpi=72, colorspace='binary')
+
+    ((_, img),) = list(processor.iter_pages(str(_write_numbered_pdf(tmp_path, 1))))
+    processor.close()
+
+    with Image.open(tmp_path / 'page_1.png') as saved:
+        assert saved.mode == '1'
+        np.testing.assert_array_equal(np.asarray(saved.convert('L')), img)
+
+
+def test_gray_pages_save_as_8_bit_grayscale(tmp_path):
+    processor = PDFProcessor(output_dir=str(tmp_path), dpi=72, colorspace='gray')
+
+    ((_, img),) = list(processor.iter_pages(str(_write_numbered_pdf(tmp_path, 1))))
+    processor.close()
+
+    with Image.open(tmp_path / 'page_1.png') as saved:
+        assert saved.mode == 'L'
+        np.testing.assert_array_equal(np.asarray(saved), img)
+
+
+def test_unknown_colorspace_is_rejected(tmp_path):
+    with pytest.raises(ValueError, match='colorspace'):
+        PDFProcessor(output_dir=str(tmp_path), colorspace='cmyk')
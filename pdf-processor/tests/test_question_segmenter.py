@@ -0,0 +1,96 @@
+"""
+Question segmenter tests
+Regions cut from text lines, including pages that open mid-question
+"""
+import numpy as np
+import pytest
+
+from app.services.question_segmenter import PART_ANCHOR, QUESTION_ANCHOR, QUESTION_START, segment_questions
+
+
+WIDTH, HEIGHT = 2480, 3508
+
+
+def _line(text, top, left=200):
+    return {'text': text, 'bbox': (left, top, left + 20 * len(text), top + 40)}
+
+
+def _blank_page():
+    return np.full((HEIGHT, WIDTH, 3), 255, dtype=np.uint8)
+
+
+def test_page_starting_mid_question_keeps_the_continuation():
+    lines = [
+        _line('(b) Find the gradient of the line AB.', 200),
+        _line('(c) Hence find the equation of the line.', 600),
+        _line('4 Solve the simultaneous equations', 1400),
+        _line('5 Expand and simplify (x + 3)(x - 2)', 2400),
+    ]
+    regions = segment_questions(_blank_page(), lines)
+
+    assert [region['number'] for region in regions] == ['3', '4', '5']
+    assert regions[0]['continuation'] is True
+    assert regions[0]['bbox'] == (0, 0, WIDTH, 1400 - 20)
+    assert not regions[1].get('continuation')
+    assert regions[1]['bbox'][1] == 1400 - 20
+
+
+def test_running_header_is_not_a_continuation():
+    lines = [
+        _line('Page 3', 100),
+        _line('4 Solve the simultaneous equations', 1400),
+        _line('5 Expand and simplify (x + 3)(x - 2)', 2400),
+    ]
+    regions = segment_questions(_blank_page(), lines)
+
+    assert [region['number'] for region in regions] == ['4', '5']
+
+
+def test_continued_diagram_without_text_is_a_continuation():
+    page = _blank_page()
+    page[200:1200, 400:1600] = 0
+    lines = [_line('4 Solve the simultaneous equations', 1400)]
+    regions = segment_questions(page, lines)
+
+    assert [region['number'] for region in regions] == ['3', '4']
+    assert regions[0]['continuation'] is True
+
+
+def test_instructions_above_question_one_are_left_out():
+    lines = [
+        _line('Answer all the questions in the spaces provided. Show all your working.', 200),
+        _line('1 Work out 3/4 + 2/5', 800),
+        _line('2 Factorise x^2 - 9', 1800),
+    ]
+    regions = segment_questions(_blank_page(), lines)
+
+    assert [region['number'] for region in regions] == ['1', '2']
+
+
+@pytest.mark.parametrize('line, number, starts_text', [
+    ('1 Work out 3 + 4', '1', True),
+    ('2. Solve the equation', '2', True),
+    ('Q3 (a) Expand', '3', True),
+    ('Question 12) Find x', '12', True),
+    ('4 5x', '4', True),                    # An answer line
+    ('7', '7', False),                      # Alone on its line: an anchor, but no text to split
+    ('8.  ', '8', False),
+    ('1 hour 30 minutes', None, False),
+    ('80 marks', None, False),
+    ('3.5 cm', None, False),
+    ('123 Main Road', None, False),
+])
+def test_question_numbers_are_shared_by_every_splitter(line, number, starts_text):
+    anchor = QUESTION_ANCHOR.match(line)
+
+    assert (anchor.group(1) if anchor else None) == number
+    assert bool(QUESTION_START.match(line)) == starts_text
+
+
+@pytest.mark.parametrize('line, label', [
+    ('(a) Solve', 'a'), ('b) Expand', 'b'), ('(iv) Hence', 'iv'), ('(vii) Show', 'vii'), ('(z) No', None),
+])
+def test_part_labels(line, label):
+    match = PART_ANCHOR.match(line)
+
+    assert (match.group(1) if match else None) == label
@@ -0,0 +1,77 @@
+"""
+Upload optimizer tests
+prepare() reports the scale of the uploaded image, and scale_bbox maps Gemini's boxes back with it
+"""
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.services.upload_optimizer import UploadOptimizer, scale_bbox, to_upload_part
+
+
+def _page(width=2480, height=3508):
+    """A 300 DPI A4 page with a dark block to keep JPEG honest"""
+    page = np.full((height, width, 3), 255, dtype=np.uint8)
+    page[400:900, 300:1200] = 0
+    return page
+
+
+def _decode(blob):
+    return Image.open(BytesIO(blob['data']))
+
+
+@pytest.mark.parametrize('max_long_edge, size, expected_scale', [
+    (2048, (2480, 3508), 2048 / 3508),
+    (2048, (1240, 1754), 1.0),      # Already small enough
+    (None, (2480, 3508), 1.0),      # Never downscale
+])
+def test_prepare_reports_the_upload_scale(max_long_edge, size, expected_scale):
+    width, height = size
+    blob, scale = UploadOptimizer(max_long_edge=max_long_edge).prepare(_page(width, height))
+
+    assert scale == pytest.approx(expected_scale)
+    uploaded = _decode(blob)
+    assert uploaded.size == (round(width * scale), round(height * scale))
+    assert blob['mime_type'] == 'image/jpeg'
+
+
+@pytest.mark.parametrize('mode, codec, image_mode', [
+    ('gray', 'jpeg', 'L'),
+    ('keep', 'webp', 'RGB'),
+    ('binary', 'png', '1'),
+    ('keep', 'png', 'RGB'),
+])
+def test_prepare_modes_and_codecs(mode, codec, image_mode):
+    blob, _ = UploadOptimizer(mode=mode, codec=codec).prepare(_page())
+
+    assert blob['mime_type'] == f'image/{codec}'
+    assert _decode(blob).mode == image_mode
+
+
+def test_scale_bbox_round_trips_a_box_through_the_uploaded_image():
+    _, scale = UploadOptimizer(max_long_edge=2048).prepare(_page())
+    page_box = {'x': 300, 'y': 400, 'width': 900, 'height': 500}
+    # Gemini answers in the pixels of the image it saw
+    uploaded_box = {key: round(value * scale) for key, value in page_box.items()}
+
+    restored = scale_bbox(uploaded_box, scale)
+
+    for key, value in page_box.items():
+        assert abs(restored[key] - value) <= 1 / scale
+    assert all(isinstance(value, int) for value in restored.values())
+
+
+def test_scale_bbox_leaves_unscaled_and_missing_boxes_alone():
+    box = {'x': 10, 'y': 20, 'width': 30, 'height': 40}
+    assert scale_bbox(box, 1.0) is box
+    assert scale_bbox(None, 0.5) is None
+    assert scale_bbox({'x': 10, 'y': None}, 0.5) == {'x': 20, 'y': None}
+
+
+def test_without_an_optimizer_the_page_goes_full_size():
+    part, scale = to_upload_part(_page())
+    assert isinstance(part, Image.Image)
+    assert part.size == (2480, 3508)
+    assert scale == 1.0